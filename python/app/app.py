@@ -1,34 +1,46 @@
-import math
-from flask import Flask, render_template, request, jsonify
+import time
+from flask import Flask, Response, render_template, request, jsonify
 from ptc4gtfs.db import GTFSDatabase
 from ptc4gtfs.model import load_networkx_ptc4gtfs_graph
-from ptc4gtfs.ptc import find_path_in_ptc4gtfs_graph
 from datetime import datetime
-from zoneinfo import ZoneInfo
+from ptc4gtfs.utils import parse_departure_time
+from app.schema import stream_json
+from app.routing import find_path_payload, departure_board_payload, parse_excluded_modes, encode_stop_ids
+from app.metrics import QueryMetrics
+from ptc4gtfs.stats import QueryStats, collecting
+from ptc4gtfs.departures import DepartureIndex
+from ptc4gtfs.ids import IdKind
 
 app = Flask(__name__)
 db = GTFSDatabase("sqlite:///./gtfs.db")
 graph = load_networkx_ptc4gtfs_graph()
+metrics = QueryMetrics()
+# Betriebstag -> Abfahrtsindex für /find_path und /departures (nur der aktuelle Tag wird gehalten)
+departures_cache = {}
+
+def parse_departure_arg(value):
+    # Optionale Abfahrtszeit (HH:MM oder ISO-Zeitstempel) in der Agentur-Zeitzone, None = jetzt
+    if not value:
+        return None
+    return parse_departure_time(value, tz=db.get_agency_timezone())
+
+
+def departures_for(departure_time):
+    # Abfahrtsindex des Betriebstages einmal aufbauen, statt bei jeder Suche oder Abfahrtstafel neu zu lesen
+    service_date = departure_time.date()
+    if service_date not in departures_cache:
+        departures_cache.clear()
+        departures_cache[service_date] = DepartureIndex.for_service_date(db, service_date)
+    return departures_cache[service_date]
+
 
 def load_stops(graph):
-    # Lade alle übergeordneten Haltestellen (Stationen)
-    return db.get_all_parent_station(graph)
-
-
-def clean_inf(obj):
-    # Ersetzt inf/nan durch None für JSON
-    if isinstance(obj, dict):
-        return {k: clean_inf(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [clean_inf(x) for x in obj]
-    elif isinstance(obj, tuple):
-        return tuple(clean_inf(x) for x in obj)
-    elif isinstance(obj, float):
-        if math.isinf(obj) or math.isnan(obj):
-            return None
-        return obj
-    else:
-        return obj
+    # Lade alle übergeordneten Haltestellen (Stationen), stop_id als GTFS-ID für Formular und Ergebnisansicht
+    ids = db.get_id_dictionary()
+    return [
+        {**stop, "stop_id": ids.decode(IdKind.STOP, stop["stop_id"])}
+        for stop in db.get_all_parent_station(graph)
+    ]
 
 
 @app.route("/", methods=["GET"])
@@ -52,88 +64,107 @@ def find_path_route():
         str(s["stop_id"]) == str(to_id) for s in stops
     ):
         return jsonify({"error": "Ungültige Station(en) ausgewählt."}), 400
-
+    from_id, to_id = encode_stop_ids(db, from_id, to_id)
+
+    # Optional: Profilsuche über ein Abfahrtsfenster (in Minuten)
+    window = request.form.get("window", type=int)
+    max_results = request.form.get("max_results", default=5, type=int)
+    # Optional: mehrere Alternativen (Ankunft/Umstiege) aus einer Pareto-Suche
+    alternatives = request.form.get("alternatives", type=int)
+    # Optional: kompletten Such-Dump (distances, predecessors, arrival_times) mitschicken
+    debug = request.form.get("debug", default="").lower() in ("1", "true", "yes")
     try:
-        db.create_departures_today()
-        results_data = find_path_in_ptc4gtfs_graph(db, from_id, to_id, graph)
-        print(f"Results Data: {results_data}")
-
-        if not results_data:
-            return jsonify({"error": "Keine Route gefunden."}), 404
-
-        distances, predecessors, arrival_times, path_nodes = results_data
-
-        if not path_nodes:
-            return jsonify({"error": "Keine Route gefunden."}), 404
-
-        # Baue Segmente für die Anzeige
-        segments = []
-        for i in range(len(path_nodes) - 1):
-            from_node = path_nodes[i]
-            to_node = path_nodes[i + 1]
-            from_stop_id = str(from_node[0])
-            to_stop_id = str(to_node[0])
-            route_id = to_node[1] if len(to_node) > 1 else None
-            route_name = None
-            if route_id:
-                route = db.get_route_by_id(route_id)
-                if route and "route_short_name" in route:
-                    route_name = route["route_short_name"]
-            if not route_name:
-                route_name = "Fußweg/Gleiswechsel"
-            from_stop = db.get_stop_by_id(from_stop_id)
-            to_stop = db.get_stop_by_id(to_stop_id)
-            segments.append(
-                {
-                    "from_stop_name": (
-                        from_stop["stop_name"] if from_stop else from_stop_id
-                    ),
-                    "from_stop_id": from_stop_id,
-                    "route_id": route_id,
-                    "route_name": route_name,
-                    "to_stop_name": to_stop["stop_name"] if to_stop else to_stop_id,
-                    "to_stop_id": to_stop_id,
-                }
-            )
+        departure_time = parse_departure_arg(request.form.get("departure"))
+    except ValueError:
+        return jsonify({"error": "Ungültige Abfahrtszeit."}), 400
+    # Optional: späteste Ankunft statt Abfahrtszeit (Rückwärtssuche)
+    try:
+        arrive_by = parse_departure_arg(request.form.get("arrive_by"))
+    except ValueError:
+        return jsonify({"error": "Ungültige Ankunftszeit."}), 400
+    # Optional: Verkehrsmittel ausschließen, z.B. "bus,tram"
+    try:
+        excluded_route_types = parse_excluded_modes(request.form.get("exclude_modes"))
+    except ValueError:
+        return jsonify({"error": "Unbekanntes Verkehrsmittel."}), 400
 
-        # Baue Liste der Haltestellen für die Karte
-        stops_list = []
-        for node in path_nodes:
-            stop_id = str(node[0])
-            stop = db.get_stop_by_id(stop_id)
-            stops_list.append(
-                {
-                    "stop_id": stop_id,
-                    "stop_name": stop["stop_name"] if stop else stop_id,
-                    "lat": stop["stop_lat"] if stop else None,
-                    "lon": stop["stop_lon"] if stop else None,
-                }
-            )
+    if departure_time is None:
+        departure_time = datetime.now(db.get_agency_timezone())
 
-        # Daten für JSON-Ausgabe bereinigen
-        response_data = {
-            "segments": clean_inf(segments),
-            "stops": clean_inf(stops_list),
-            "raw": clean_inf(results_data),
-        }
-        return jsonify(response_data)
+    stats = QueryStats()
+    started = time.perf_counter()
+    try:
+        # collecting: auch die DB-Aufrufe für die Stammdaten der Antwort zählen
+        with collecting(stats):
+            payload, status = find_path_payload(
+                db,
+                graph,
+                from_id,
+                to_id,
+                departure_time=departure_time,
+                window=window,
+                max_results=max_results,
+                alternatives=alternatives,
+                debug=debug,
+                # Abfahrtsindex des Betriebstages aus dem Cache (bei Ankunft-bis der Tag der Ankunft)
+                departures=departures_for(arrive_by or departure_time),
+                stats=stats,
+                arrive_by=arrive_by,
+                excluded_route_types=excluded_route_types,
+            )
+        metrics.observe(stats, status, time.perf_counter() - started)
+        return stream_json(payload, status)
     except Exception as e:
+        metrics.observe(stats, 500, time.perf_counter() - started)
         return jsonify({"error": f"Serverfehler: {str(e)}"}), 500
 
 
+@app.route("/departures", methods=["GET"])
+def departures_route():
+    # Nächste Abfahrten an einer Station (alle Steige), ohne Routensuche
+    stop_id = request.args.get("stop_id")
+    if not stop_id:
+        return jsonify({"error": "stop_id fehlt."}), 400
+    n = request.args.get("n", default=10, type=int)
+    try:
+        departure_time = parse_departure_arg(request.args.get("departure")) or datetime.now(db.get_agency_timezone())
+    except ValueError:
+        return jsonify({"error": "Ungültige Abfahrtszeit."}), 400
+    payload, status = departure_board_payload(db, stop_id, n, departure_time, departures_for(departure_time))
+    return stream_json(payload, status)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    # Zähler und Histogramme der Suchen im Prometheus-Textformat
+    return Response(metrics.text(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/result", methods=["GET"])
 def result():
     # Zeige Ergebnisansicht mit Kartenpositionen
     stops = load_stops(graph)
     from_id = request.args.get("from_id")
     to_id = request.args.get("to_id")
+    window = request.args.get("window", default="")
+    alternatives = request.args.get("alternatives", default="")
+    debug = request.args.get("debug", default="")
+    exclude_modes = request.args.get("exclude_modes", default="")
     from_stop = next((s for s in stops if str(s["stop_id"]) == str(from_id)), None)
     to_stop = next((s for s in stops if str(s["stop_id"]) == str(to_id)), None)
     from_lat = from_stop["stop_lat"] if from_stop else None
     from_lon = from_stop["stop_lon"] if from_stop else None
     to_lat = to_stop["stop_lat"] if to_stop else None
     to_lon = to_stop["stop_lon"] if to_stop else None
-    search_time = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%H:%M")
+    departure = request.args.get("departure", default="")
+    arrive_by = request.args.get("arrive_by", default="")
+    try:
+        departure_time = parse_departure_arg(arrive_by or departure)
+    except ValueError:
+        departure, arrive_by, departure_time = "", "", None
+    if departure_time is None:
+        departure_time = datetime.now(db.get_agency_timezone())
+    search_time = ("Ankunft bis " if arrive_by else "") + departure_time.strftime("%d.%m.%Y %H:%M")
     return render_template(
         "result.html",
         from_station=from_stop["stop_name"] if from_stop else from_id,
@@ -145,6 +176,12 @@ def result():
         to_lat=to_lat,
         to_lon=to_lon,
         search_time=search_time,
+        window=window,
+        alternatives=alternatives,
+        departure=departure,
+        arrive_by=arrive_by,
+        exclude_modes=exclude_modes,
+        debug=debug,
     )
 
 
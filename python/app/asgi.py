@@ -0,0 +1,364 @@
+"""
+Asynchroner Serving-Modus (ASGI) für die Routensuche.
+
+Die Suchen laufen in einem Prozess-Pool, dessen Worker Datenbank, Graph und Abfahrtsindex einmal
+vorladen. Identische Anfragen, die gleichzeitig laufen, werden zu einer Suche zusammengefasst.
+Ist die Warteschlange voll, wird sofort mit 503 abgelehnt; jede Anfrage hat ein eigenes Timeout (504).
+
+Start z.B. mit:  uvicorn app.asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.departures import DepartureIndex
+from ptc4gtfs.realtime import POLL_INTERVAL, RealtimeDepartures
+from ptc4gtfs.model import load_networkx_ptc4gtfs_graph
+from ptc4gtfs.utils import parse_departure_time
+from app.routing import find_path_payload, departure_board_payload, parse_excluded_modes, encode_stop_ids
+from app.schema import encode_json
+from app.metrics import LATENCY_BUCKETS, Histogram, QueryMetrics
+from ptc4gtfs.stats import QueryStats, collecting
+
+logger = logging.getLogger(__name__)
+
+# Konfiguration über Umgebungsvariablen
+DB_URL = os.environ.get("PTC4GTFS_DB_URL", "sqlite:///./gtfs.db")
+GRAPH_PATH = os.environ.get("PTC4GTFS_GRAPH", "ptc4gtfs_graph.pkl")
+WORKERS = int(os.environ.get("PTC4GTFS_WORKERS", os.cpu_count() or 1))
+MAX_PENDING = int(os.environ.get("PTC4GTFS_MAX_PENDING", WORKERS * 8))
+REQUEST_TIMEOUT = float(os.environ.get("PTC4GTFS_REQUEST_TIMEOUT", 30))
+# Optional: GTFS-Realtime TripUpdates (Datei oder URL), die jeder Worker regelmäßig übernimmt
+REALTIME_SOURCE = os.environ.get("PTC4GTFS_REALTIME")
+REALTIME_INTERVAL = float(os.environ.get("PTC4GTFS_REALTIME_INTERVAL", POLL_INTERVAL))
+
+
+class Overloaded(Exception):
+    pass
+
+
+# Worker-Prozesse
+
+_worker_state = {}
+
+
+def _init_worker(db_url, graph_path):
+    # Einmal pro Worker: Datenbank und Graph laden
+    _worker_state["db"] = GTFSDatabase(db_url)
+    _worker_state["graph"] = load_networkx_ptc4gtfs_graph(graph_path)
+    _worker_state["departures"] = {}
+
+
+def _departures_for_day(db, departure_time, cache):
+    # Abfahrtsindex pro Betriebstag nur einmal aufbauen (cache: Betriebstag -> Index, nur der aktuelle Tag).
+    # Der Index wird nur lesend aus stop_times gebaut (DepartureIndex.for_service_date): Worker und Abfahrtstafel
+    # teilen sich die Datenbank, die gemeinsame Tabelle departures_today darf keiner von ihnen umbauen.
+    service_date = departure_time.date()
+    if service_date not in cache:
+        for previous in cache.values():
+            if isinstance(previous, RealtimeDepartures):
+                previous.stop_polling()
+        cache.clear()
+        if REALTIME_SOURCE:
+            # Echtzeit-Meldungen im Hintergrund übernehmen; jede Suche rechnet auf dem Snapshot bei ihrem Start
+            cache[service_date] = RealtimeDepartures.from_db(db, service_date)
+            cache[service_date].start_polling(REALTIME_SOURCE, REALTIME_INTERVAL)
+        else:
+            cache[service_date] = DepartureIndex.for_service_date(db, service_date)
+    departures = cache[service_date]
+    return departures.departures if isinstance(departures, RealtimeDepartures) else departures
+
+
+def _worker_departures(db, departure_time):
+    return _departures_for_day(db, departure_time, _worker_state["departures"])
+
+
+def _find_path_in_worker(params):
+    # Führt eine Suche im Worker aus und gibt (HTTP-Status, JSON-Bytes, Messwerte als Dict) zurück
+    db = _worker_state["db"]
+    graph = _worker_state["graph"]
+    stats = QueryStats()
+    try:
+        # GTFS-IDs aus dem Formular in die Codes von Datenbank und Graph übersetzen
+        from_id, to_id = encode_stop_ids(db, params["from_id"], params["to_id"])
+        if from_id is None or to_id is None or not graph.has_node(from_id) or not graph.has_node(to_id):
+            return 400, encode_json({"error": "Ungültige Station(en) ausgewählt."}), None
+        departure_time = datetime.fromisoformat(params["departure"])
+        arrive_by = datetime.fromisoformat(params["arrive_by"]) if params["arrive_by"] else None
+        with collecting(stats):
+            payload, status = find_path_payload(
+                db,
+                graph,
+                from_id,
+                to_id,
+                departure_time=departure_time,
+                window=params["window"],
+                max_results=params["max_results"],
+                alternatives=params["alternatives"],
+                debug=params["debug"],
+                # Abfahrtsindex für den Betriebstag der Suche (bei Ankunft-bis der Tag der Ankunft)
+                departures=_worker_departures(db, arrive_by or departure_time),
+                stats=stats,
+                arrive_by=arrive_by,
+                excluded_route_types=params["exclude_modes"],
+            )
+    except Exception as e:
+        payload, status = {"error": f"Serverfehler: {str(e)}"}, 500
+    return status, encode_json(payload), stats.to_dict()
+
+
+# Routing-Service im Event-Loop
+
+class RoutingService:
+    """
+    Verteilt Suchen auf den Prozess-Pool, fasst identische laufende Anfragen zusammen (Coalescing),
+    begrenzt die Anzahl offener Suchen (Backpressure) und sammelt Metriken.
+    """
+
+    def __init__(self, db_url=DB_URL, graph_path=GRAPH_PATH, workers=WORKERS, max_pending=MAX_PENDING, timeout=REQUEST_TIMEOUT):
+        self.db_url = db_url
+        self.graph_path = graph_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = None
+        self.timezone = None
+        # Schlüssel der Anfrage -> (Suche im Prozess-Pool, Future im Event-Loop)
+        self.inflight = {}
+        # Schlüssel der Anfrage -> Anzahl wartender Anfragen
+        self.waiters = {}
+        self.waiting = 0
+        self.counters = {"requests": 0, "coalesced": 0, "rejected": 0, "timeouts": 0, "abandoned": 0, "errors": 0}
+        self.latency = Histogram("ptc4gtfs_request_latency_seconds", "Antwortzeit von /find_path", LATENCY_BUCKETS)
+        # Messwerte des Routers aus den Workern (eine Suche pro Worker-Aufruf, auch bei Coalescing)
+        self.query_metrics = QueryMetrics()
+        # Abfahrtstafeln laufen direkt im Event-Loop auf einem eigenen Abfahrtsindex (ohne Prozess-Pool)
+        self.db = None
+        self.board_departures = {}
+        self.board_lock = None
+
+    def start(self):
+        if self.executor is not None:
+            return
+        self.db = GTFSDatabase(self.db_url)
+        self.timezone = self.db.get_agency_timezone()
+        self.board_lock = asyncio.Lock()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.db_url, self.graph_path),
+        )
+        logger.info(f"RoutingService gestartet: {self.workers} Worker, max. {self.max_pending} offene Suchen")
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        for departures in self.board_departures.values():
+            if isinstance(departures, RealtimeDepartures):
+                departures.stop_polling()
+        self.board_departures.clear()
+
+    def normalize_params(self, form):
+        # Vereinheitlicht die Parameter, damit gleiche Anfragen denselben Schlüssel bekommen.
+        # Ohne Abfahrtszeit wird "jetzt" auf die Minute gerundet.
+        def get_int(name, default=None):
+            value = form.get(name)
+            return int(value) if value else default
+
+        departure = form.get("departure")
+        if departure:
+            departure_time = parse_departure_time(departure, tz=self.timezone)
+        else:
+            departure_time = datetime.now(self.timezone).replace(second=0, microsecond=0)
+        arrive_by = form.get("arrive_by")
+        return {
+            "from_id": form.get("from_id"),
+            "to_id": form.get("to_id"),
+            "departure": departure_time.isoformat(),
+            "arrive_by": parse_departure_time(arrive_by, tz=self.timezone).isoformat() if arrive_by else None,
+            "window": get_int("window"),
+            "max_results": get_int("max_results", 5),
+            "alternatives": get_int("alternatives"),
+            "exclude_modes": tuple(int(route_type) for route_type in parse_excluded_modes(form.get("exclude_modes"))),
+            "debug": (form.get("debug") or "").lower() in ("1", "true", "yes"),
+        }
+
+    async def find_path(self, params):
+        key = tuple(sorted(params.items()))
+        if key not in self.inflight:
+            if len(self.inflight) >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise Overloaded()
+            # Suche direkt im Pool einreihen, damit sie nach einem Timeout noch aus der Warteschlange genommen werden kann
+            search = self.executor.submit(_find_path_in_worker, params)
+            future = asyncio.wrap_future(search)
+            self.inflight[key] = search, future
+            # Erst wenn der Worker fertig (oder die Suche gestrichen) ist, zählt sie nicht mehr gegen max_pending
+            future.add_done_callback(lambda _: self.release(key, search))
+            future.add_done_callback(self.observe_query)
+        else:
+            search, future = self.inflight[key]
+            self.counters["coalesced"] += 1
+
+        started = time.perf_counter()
+        self.waiting += 1
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            # shield: ein Timeout einer Anfrage bricht die gemeinsame Suche nicht für andere ab
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+        finally:
+            self.waiting -= 1
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
+                self.abandon(key, search)
+            self.latency.observe(time.perf_counter() - started)
+
+    def release(self, key, search):
+        # Suche aus inflight entfernen, sofern unter dem Schlüssel nicht schon eine neuere läuft
+        if self.inflight.get(key, (None,))[0] is search:
+            del self.inflight[key]
+
+    def abandon(self, key, search):
+        # Wartet niemand mehr auf die Suche, wird sie aus der Warteschlange des Pools gestrichen.
+        # Eine bereits laufende Suche lässt sich nicht abbrechen: sie bleibt in inflight (zählt also weiter
+        # gegen max_pending) und kann von gleichen Anfragen übernommen werden, bis der Worker frei ist.
+        if search.cancel():
+            self.release(key, search)
+            self.counters["abandoned"] += 1
+            logger.debug("Suche ohne wartende Anfrage aus der Warteschlange gestrichen")
+
+    async def departure_board(self, stop_id, n, departure):
+        # Abfahrtstafel aus dem Index; nur der Aufbau des Index für einen neuen Betriebstag läuft in einem Thread
+        departure_time = parse_departure_time(departure, tz=self.timezone) if departure else datetime.now(self.timezone)
+        if departure_time.date() not in self.board_departures:
+            async with self.board_lock:
+                await asyncio.to_thread(_departures_for_day, self.db, departure_time, self.board_departures)
+        departures = _departures_for_day(self.db, departure_time, self.board_departures)
+        return departure_board_payload(self.db, stop_id, n, departure_time, departures)
+
+    def observe_query(self, future):
+        # Messwerte einer abgeschlossenen Worker-Suche übernehmen
+        if future.cancelled() or future.exception() is not None:
+            return
+        status, body, stats = future.result()
+        self.query_metrics.observe(stats, status, stats["total_seconds"] if stats else 0.0)
+
+    def metrics_text(self):
+        # Metriken im Prometheus-Textformat
+        lines = [
+            "# HELP ptc4gtfs_queue_depth Laufende Suchen im Prozess-Pool (nach Coalescing)",
+            "# TYPE ptc4gtfs_queue_depth gauge",
+            f"ptc4gtfs_queue_depth {len(self.inflight)}",
+            "# HELP ptc4gtfs_waiting_requests Anfragen, die auf ein Suchergebnis warten",
+            "# TYPE ptc4gtfs_waiting_requests gauge",
+            f"ptc4gtfs_waiting_requests {self.waiting}",
+            "# HELP ptc4gtfs_max_pending Obergrenze offener Suchen",
+            "# TYPE ptc4gtfs_max_pending gauge",
+            f"ptc4gtfs_max_pending {self.max_pending}",
+        ]
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE ptc4gtfs_{name}_total counter")
+            lines.append(f"ptc4gtfs_{name}_total {value}")
+        lines += self.latency.lines()
+        lines += self.query_metrics.lines()
+        return "\n".join(lines) + "\n"
+
+
+service = RoutingService()
+
+
+# ASGI-Anwendung
+
+async def _send_response(send, status, body, content_type="application/json", headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            service.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            service.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    # Falls der Server kein Lifespan unterstützt
+    service.start()
+
+    path, method = scope["path"], scope["method"]
+    if path == "/metrics" and method == "GET":
+        await _send_response(send, 200, service.metrics_text().encode(), "text/plain; version=0.0.4")
+        return
+    if path == "/departures" and method == "GET":
+        query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        try:
+            stop_id, n = query["stop_id"], int(query.get("n") or 10)
+            payload, status = await service.departure_board(stop_id, n, query.get("departure"))
+        except (KeyError, ValueError):
+            payload, status = {"error": "Ungültige Parameter."}, 400
+        except Exception as e:
+            service.counters["errors"] += 1
+            payload, status = {"error": f"Serverfehler: {str(e)}"}, 500
+        await _send_response(send, status, encode_json(payload))
+        return
+    if path != "/find_path" or method != "POST":
+        await _send_response(send, 404, encode_json({"error": "Nicht gefunden."}))
+        return
+
+    form = {k: v[0] for k, v in parse_qs((await _read_body(receive)).decode()).items()}
+    service.counters["requests"] += 1
+    if not form.get("from_id") or not form.get("to_id"):
+        await _send_response(send, 400, encode_json({"error": "Beide Stationen müssen ausgewählt werden."}))
+        return
+    try:
+        params = service.normalize_params(form)
+    except ValueError:
+        await _send_response(send, 400, encode_json({"error": "Ungültige Parameter."}))
+        return
+
+    try:
+        status, body, _ = await service.find_path(params)
+    except Overloaded:
+        await _send_response(send, 503, encode_json({"error": "Server ausgelastet."}), headers=[(b"retry-after", b"1")])
+        return
+    except asyncio.TimeoutError:
+        await _send_response(send, 504, encode_json({"error": "Zeitüberschreitung bei der Routensuche."}))
+        return
+    except Exception as e:
+        service.counters["errors"] += 1
+        await _send_response(send, 500, encode_json({"error": f"Serverfehler: {str(e)}"}))
+        return
+    await _send_response(send, status, body)
@@ -0,0 +1,86 @@
+import threading
+from bisect import bisect_left
+from ptc4gtfs.stats import QueryStats
+
+# Bucket-Grenzen (Sekunden) der Latenz-Histogramme
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bucket-Grenzen des Histogramms der abgearbeiteten Knoten pro Anfrage
+SETTLED_BUCKETS = (100, 1000, 10000, 50000, 100000, 500000, 1000000)
+
+
+class Histogram:
+    # Kumulatives Histogramm im Prometheus-Format (ohne externe Bibliothek)
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class QueryMetrics:
+    """
+    Sammelt die QueryStats aller Suchen eines Servers: Summen der Router-Zähler und -Zeiten als Counter,
+    Antwortzeit und abgearbeitete Knoten pro Anfrage als Histogramm, Anfragen pro HTTP-Status.
+    Thread-sicher, Ausgabe im Prometheus-Textformat.
+    """
+
+    def __init__(self, prefix="ptc4gtfs"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.totals = dict.fromkeys(QueryStats.COUNTERS + QueryStats.TIMINGS, 0)
+        self.responses = {}
+        self.request_latency = Histogram(f"{prefix}_find_path_latency_seconds", "Antwortzeit von /find_path", LATENCY_BUCKETS)
+        self.search_latency = Histogram(f"{prefix}_search_seconds", "Reine Suchzeit im Router pro Anfrage", LATENCY_BUCKETS)
+        self.nodes_settled = Histogram(f"{prefix}_nodes_settled", "Abgearbeitete Knoten pro Anfrage", SETTLED_BUCKETS)
+
+    def observe(self, stats, status, seconds):
+        # stats: QueryStats oder dessen to_dict() (aus einem Worker-Prozess), None wenn keine Suche lief
+        if isinstance(stats, QueryStats):
+            stats = stats.to_dict()
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            self.request_latency.observe(seconds)
+            if stats:
+                for name in self.totals:
+                    self.totals[name] += stats[name]
+                self.search_latency.observe(stats["search_seconds"])
+                self.nodes_settled.observe(stats["nodes_settled"])
+
+    def lines(self):
+        with self.lock:
+            lines = [
+                f"# HELP {self.prefix}_find_path_responses_total Antworten von /find_path nach HTTP-Status",
+                f"# TYPE {self.prefix}_find_path_responses_total counter",
+            ]
+            lines += [f'{self.prefix}_find_path_responses_total{{status="{status}"}} {count}' for status, count in sorted(self.responses.items())]
+            for name, value in self.totals.items():
+                # Summen über alle Suchen, Zeiten in Sekunden
+                metric = f"{self.prefix}_router_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            lines += self.request_latency.lines()
+            lines += self.search_latency.lines()
+            lines += self.nodes_settled.lines()
+        return lines
+
+    def text(self):
+        return "\n".join(self.lines()) + "\n"
@@ -0,0 +1,174 @@
+from ptc4gtfs.ptc import (
+    find_path_in_ptc4gtfs_graph,
+    find_path_arrive_by_in_ptc4gtfs_graph,
+    find_profile_in_ptc4gtfs_graph,
+    find_alternatives_in_ptc4gtfs_graph,
+    departure_board,
+)
+from ptc4gtfs.journey import build_itineraries
+from ptc4gtfs.db import str_conv_route_type
+from ptc4gtfs.ids import IdKind
+from ptc4gtfs.stats import QueryStats
+from app.schema import build_path_response
+
+# Version des Antwortschemas von /departures
+# 2: stop_id, route_id und trip_id als GTFS-ID (String)
+DEPARTURES_VERSION = 2
+
+# Obergrenze für n bei /departures
+MAX_DEPARTURES = 100
+
+
+def parse_excluded_modes(value):
+    # Ausgeschlossene Verkehrsmittel aus dem Formular ("bus,tram"), sortiert und ohne Doppelte; ValueError bei unbekannten
+    if not value:
+        return ()
+    return tuple(sorted({str_conv_route_type(mode) for mode in value.split(",") if mode.strip()}))
+
+
+def find_path_payload(
+    db,
+    graph,
+    from_id,
+    to_id,
+    departure_time=None,
+    window=None,
+    max_results=5,
+    alternatives=None,
+    debug=False,
+    departures=None,
+    stats=None,
+    arrive_by=None,
+    excluded_route_types=None,
+):
+    # Führt die passende Suche für /find_path aus und gibt (Antwort, HTTP-Status) zurück.
+    # Wird von der Flask-App und von den Workern des ASGI-Servers verwendet.
+    # stats (optional): QueryStats, in das die Suche zählt (für /metrics); im Debug-Modus auch in der Antwort.
+    # arrive_by (optional): späteste Ankunft; sucht die späteste passende Verbindung statt ab departure_time.
+    # excluded_route_types (optional): Verkehrsmittel (RouteType), die keine Suche benutzt.
+    if stats is None:
+        stats = QueryStats()
+    if (window or alternatives) and arrive_by is None:
+        if window:
+            journeys = find_profile_in_ptc4gtfs_graph(
+                db,
+                from_id,
+                to_id,
+                graph,
+                departure_time=departure_time,
+                window_minutes=window,
+                max_results=max_results,
+                departures=departures,
+                stats=stats,
+                excluded_route_types=excluded_route_types,
+            )
+        else:
+            journeys = find_alternatives_in_ptc4gtfs_graph(
+                db,
+                from_id,
+                to_id,
+                graph,
+                departure_time=departure_time,
+                max_alternatives=alternatives,
+                departures=departures,
+                stats=stats,
+                excluded_route_types=excluded_route_types,
+            )
+        if not journeys:
+            return {"error": "Keine Route gefunden."}, 404
+        # Stammdaten aller Verbindungen mit einer gebündelten Abfrage
+        itineraries = build_itineraries(db, [journey["path"] for journey in journeys])
+        response_journeys = []
+        for journey, itinerary in zip(journeys, itineraries):
+            response_journeys.append(
+                {
+                    "departure_time": journey["departure_time"],
+                    "arrival_time": journey["arrival_time"],
+                    "duration": journey["duration"],
+                    "transfers": journey.get("transfers"),
+                    "legs": itinerary["legs"],
+                    "segments": itinerary["segments"],
+                    "stops": itinerary["stops"],
+                }
+            )
+        # Erste Verbindung zusätzlich als Standardantwort für die Anzeige
+        return (
+            build_path_response(
+                response_journeys[0]["segments"],
+                response_journeys[0]["stops"],
+                legs=response_journeys[0]["legs"],
+                journeys=response_journeys,
+                stats=stats.to_dict() if debug else None,
+            ),
+            200,
+        )
+
+    if arrive_by is not None:
+        results_data = find_path_arrive_by_in_ptc4gtfs_graph(
+            db, from_id, to_id, graph, arrival_time=arrive_by, departures=departures, stats=stats,
+            excluded_route_types=excluded_route_types,
+        )
+    else:
+        results_data = find_path_in_ptc4gtfs_graph(
+            db, from_id, to_id, graph, departure_time=departure_time, departures=departures, stats=stats,
+            excluded_route_types=excluded_route_types,
+        )
+    if not results_data:
+        return {"error": "Keine Route gefunden."}, 404
+
+    distances, predecessors, arrival_times, path_nodes = results_data
+
+    if not path_nodes:
+        return {"error": "Keine Route gefunden."}, 404
+
+    itinerary = build_itineraries(db, [path_nodes])[0]
+
+    # Kompakte Antwort, der Such-Dump nur auf Anfrage
+    return (
+        build_path_response(
+            itinerary["segments"],
+            itinerary["stops"],
+            legs=itinerary["legs"],
+            raw=decode_search_dump(db, results_data) if debug else None,
+            stats=stats.to_dict() if debug else None,
+        ),
+        200,
+    )
+
+
+def decode_search_dump(db, results_data):
+    # Such-Dump (distances, predecessors, arrival_times, path) für debug=1: Haltestellen, Routen und Trips
+    # sind im Router Codes der Datenbank, in der Antwort GTFS-IDs wie in legs/segments/stops
+    ids = db.get_id_dictionary()
+    distances, predecessors, arrival_times, path = results_data
+
+    def stop(code):
+        return ids.decode(IdKind.STOP, code)
+
+    def step(node, route_id=None, trip_id=None, *rest):
+        return (stop(node), ids.decode(IdKind.ROUTE, route_id) if route_id else None, ids.decode(IdKind.TRIP, trip_id) if trip_id else None, *rest)
+
+    return (
+        {stop(node): distance for node, distance in distances.items()},
+        {stop(node): step(*predecessor) for node, predecessor in predecessors.items()},
+        {stop(node): arrival_time for node, arrival_time in arrival_times.items()},
+        # Start: (stop_id, None, Zeit), danach (stop_id, route_id, trip_id, Ankunft)
+        [(stop(entry[0]), None, entry[-1]) if len(entry) == 3 else step(*entry) for entry in path],
+    )
+
+
+def departure_board_payload(db, stop_id, n=10, departure_time=None, departures=None):
+    # Antwort für /departures: die nächsten n Abfahrten an einer Station (alle Steige), gibt (Antwort, HTTP-Status) zurück.
+    # stop_id ist die GTFS-ID der Station.
+    code = db.get_id_dictionary().encode(IdKind.STOP, stop_id)
+    if code is None or not db.get_station_platforms(code):
+        return {"error": "Unbekannte Station."}, 404
+    n = max(1, min(int(n), MAX_DEPARTURES))
+    board = departure_board(db, code, departure_time=departure_time, n=n, departures=departures)
+    return {"version": DEPARTURES_VERSION, "stop_id": str(stop_id), "departures": board}, 200
+
+
+def encode_stop_ids(db, *stop_ids):
+    # GTFS-IDs aus der Anfrage in die Codes der Datenbank übersetzen; None für unbekannte IDs
+    id_dictionary = db.get_id_dictionary()
+    return tuple(id_dictionary.encode(IdKind.STOP, stop_id) for stop_id in stop_ids)
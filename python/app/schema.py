@@ -0,0 +1,86 @@
+import json
+import math
+from datetime import datetime, date
+from flask import Response
+
+# Version des Antwortschemas von /find_path
+# 1: segments, stops und immer der komplette Such-Dump unter "raw"
+# 2: segments, stops (optional journeys), "raw" nur noch im Debug-Modus
+# 3: zusätzlich legs (zusammengefasste Fahrten/Umstiege mit Zeiten), auch pro Journey
+# 4: stop_id, route_id und trip_id immer als GTFS-ID (String), auch bei nicht-numerischen Feeds
+RESPONSE_VERSION = 4
+
+# Größe der Blöcke, in denen die JSON-Antwort gestreamt wird
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def clean_inf(obj):
+    # Ersetzt inf/nan durch None für JSON
+    if isinstance(obj, dict):
+        return {k: clean_inf(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [clean_inf(x) for x in obj]
+    elif isinstance(obj, tuple):
+        return tuple(clean_inf(x) for x in obj)
+    elif isinstance(obj, float):
+        if math.isinf(obj) or math.isnan(obj):
+            return None
+        return obj
+    else:
+        return obj
+
+
+def build_path_response(segments, stops, legs=None, journeys=None, raw=None, stats=None):
+    # Baut die kompakte Antwort; der Such-Dump (raw) und die Messwerte (stats) werden nur im Debug-Modus mitgeschickt
+    response = {
+        "version": RESPONSE_VERSION,
+        "segments": segments,
+        "stops": stops,
+    }
+    if legs is not None:
+        response["legs"] = legs
+    if journeys is not None:
+        response["journeys"] = journeys
+    if raw is not None:
+        response["raw"] = clean_inf(raw)
+    if stats is not None:
+        response["stats"] = stats
+    return response
+
+
+def _json_default(obj):
+    # Zeitangaben als ISO-8601, alles andere als String
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _chunked(parts, chunk_size=STREAM_CHUNK_SIZE):
+    # Fasst die vielen kleinen Teilstücke von iterencode zu größeren Blöcken zusammen
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def encode_json(payload):
+    # Serialisiert payload vollständig zu UTF-8-Bytes (z.B. im Worker-Prozess des ASGI-Servers)
+    encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+    return encoder.encode(payload).encode("utf-8")
+
+
+def stream_json(payload, status=200):
+    # Serialisiert payload schrittweise, statt die komplette Antwort im Speicher aufzubauen
+    encoder = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+    return Response(
+        _chunked(encoder.iterencode(payload)),
+        status=status,
+        mimetype="application/json",
+    )
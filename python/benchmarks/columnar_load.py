@@ -0,0 +1,53 @@
+import click
+import time
+import pandas as pd
+from sqlalchemy import text
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.departures import DepartureIndex
+from ptc4gtfs import columnar
+from ptc4gtfs import utils
+
+# Benchmark: Bulk-Laden über SQLite gegen die Parquet-Spaltenablage.
+# Die Ablage muss vorher mit `python -m ptc4gtfs --columnar init-db <ordner>` erzeugt worden sein.
+#
+#   python -m benchmarks.columnar_load --db gtfs.db
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+@click.command()
+@click.option('--db', 'db_path', default='gtfs.db', help='Pfad zur SQLite-DB-Datei')
+@click.option('--table', default='stop_times', help='Tabelle für den Full-Table-Scan')
+def main(db_path, table):
+    url = f"sqlite:///{db_path}"
+    columnar_dir = columnar.default_columnar_dir(db_path)
+    sqlite_db = GTFSDatabase(url)
+    columnar_db = GTFSDatabase(url, columnar_dir=columnar_dir)
+    if not columnar_db.columnar.has_table(table):
+        raise click.ClickException(f"{columnar_dir} enthält {table} nicht, zuerst mit --columnar init-db laden")
+    sqlite_db.ensure_departures_today()
+
+    def sqlite_rows():
+        # Bisheriger Weg: Zeilen als Liste von Dicts
+        with sqlite_db.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(text(f"SELECT * FROM {table}")).fetchall()]
+
+    cases = [
+        (f"{table}: SQLite -> dicts", sqlite_rows),
+        (f"{table}: SQLite -> DataFrame", lambda: sqlite_db.get_table_frame(table)),
+        (f"{table}: Parquet -> DataFrame", lambda: columnar_db.get_table_frame(table)),
+        ("DepartureIndex: SQLite (dicts)", lambda: DepartureIndex(sqlite_db.get_all_departures_today())),
+        ("DepartureIndex: SQLite (DataFrame)", lambda: DepartureIndex.from_db(sqlite_db)),
+        ("DepartureIndex: Parquet", lambda: DepartureIndex.from_db(columnar_db)),
+    ]
+    click.echo(f"{'Fall':<40}{'Sekunden':>10}{'Zeilen':>12}")
+    for name, func in cases:
+        seconds, result = _timed(func)
+        rows = len(result) if isinstance(result, (list, pd.DataFrame)) else len(result.trip_ids())
+        click.echo(f"{name:<40}{seconds:>10.3f}{rows:>12}")
+    click.echo(f"{utils.GREEN}Parquet-Ablage: {columnar_dir}{utils.RESET}")
+
+if __name__ == '__main__':
+    main()
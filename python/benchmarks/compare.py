@@ -0,0 +1,51 @@
+import click
+import json
+from ptc4gtfs import utils
+
+# Vergleicht zwei Ergebnisdateien von benchmarks.routing_suite (z.B. vor/nach einem Commit).
+#
+#   python -m benchmarks.compare alt.json neu.json
+
+def _metrics(result):
+    # Flache Sicht auf die vergleichbaren Kennzahlen: Name -> (Wert, kleiner ist besser)
+    metrics = {}
+    for name, stage in result["stages"].items():
+        metrics[f"{name}.seconds"] = (stage["seconds"], True)
+        if "peak_memory_bytes" in stage:
+            metrics[f"{name}.peak_mib"] = (stage["peak_memory_bytes"] / 2**20, True)
+    variants = {name: result[name] for name in ("find_path", "find_path_contracted", "find_path_bidirectional", "find_path_bidirectional_warm") if name in result}
+    # Lange Fahrten (ab Ergebnis-Version 3)
+    variants.update({f"long_trips.{name}": value for name, value in result.get("long_trips", {}).items() if isinstance(value, dict)})
+    for variant, find_path in variants.items():
+        metrics[f"{variant}.throughput_qps"] = (find_path["throughput_qps"], False)
+        for name, value in find_path["latency_ms"].items():
+            metrics[f"{variant}.latency_{name}_ms"] = (value, True)
+        # Suchaufwand pro Suche (ab Ergebnis-Version 2)
+        for name, value in find_path.get("per_query", {}).items():
+            metrics[f"{variant}.{name}"] = (value, True)
+    metrics["max_rss_mib"] = (result["max_rss_bytes"] / 2**20, True)
+    return metrics
+
+@click.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('candidate', type=click.Path(exists=True, dir_okay=False))
+def main(baseline, candidate):
+    with open(baseline) as f:
+        base = json.load(f)
+    with open(candidate) as f:
+        cand = json.load(f)
+    if base["params"] != cand["params"]:
+        click.echo(f"{utils.YELLOW}Achtung: unterschiedliche Parameter {base['params']} / {cand['params']}{utils.RESET}")
+    click.echo(f"{'Kennzahl':<36}{base['meta'].get('commit') or 'alt':>12}{cand['meta'].get('commit') or 'neu':>12}{'Änderung':>11}")
+    base_metrics, cand_metrics = _metrics(base), _metrics(cand)
+    for name, (old, lower_is_better) in base_metrics.items():
+        if name not in cand_metrics or old is None or cand_metrics[name][0] is None:
+            continue
+        new = cand_metrics[name][0]
+        change = (new - old) / old * 100 if old else 0.0
+        better = change < 0 if lower_is_better else change > 0
+        color = utils.GREEN if better else utils.RED if abs(change) >= 5 else ""
+        click.echo(f"{name:<36}{old:>12.3f}{new:>12.3f}{color}{change:>+10.1f}%{utils.RESET}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import click
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs import utils
+
+# Mikro-Benchmark: Overhead pro Punktabfrage der GTFSDatabase,
+# SQLAlchemy-Standard-Engine ("before") gegen gepoolte, getunte SQLite-Engine ("after").
+#
+#   python -m benchmarks.db_overhead --db gtfs.db -n 5000 --threads 4
+
+def _sample_args(db, n, seed):
+    # Zieht feste Stichproben existierender IDs, damit beide Varianten dieselben Abfragen machen
+    rng = random.Random(seed)
+    stops = [stop['stop_id'] for stop in db.get_all_stops()]
+    routes = [route['route_id'] for route in db.get_all_routes()]
+    departures = db.get_all_departures_today()
+    dep_sample = [rng.choice(departures) for _ in range(n)] if departures else []
+    return {
+        "get_stop_by_id": [(rng.choice(stops),) for _ in range(n)],
+        "get_route_by_id": [(rng.choice(routes),) for _ in range(n)],
+        "get_trip_by_trip_id_and_stop_id": [(d['trip_id'], d['stop_id']) for d in dep_sample],
+        "get_next_departure_today": [(d['stop_id'], d['route_id'], "08:00:00") for d in dep_sample],
+    }
+
+def _measure(db, method_name, calls, threads):
+    method = getattr(db, method_name)
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda args: method(*args), calls))
+    else:
+        for args in calls:
+            method(*args)
+    elapsed = time.perf_counter() - start
+    return elapsed / max(len(calls), 1) * 1e6
+
+@click.command()
+@click.option('--db', 'db_path', default='gtfs.db', help='Pfad zur SQLite-DB-Datei')
+@click.option('-n', '--calls', default=2000, help='Aufrufe pro Methode')
+@click.option('--threads', default=1, help='Parallele Threads (prüft zugleich die Thread-Sicherheit)')
+@click.option('--seed', default=42, help='Seed für die Stichprobe')
+def main(db_path, calls, threads, seed):
+    url = f"sqlite:///{db_path}"
+    before = GTFSDatabase(url, tuned=False)
+    after = GTFSDatabase(url)
+    after.ensure_departures_today()
+    samples = _sample_args(after, calls, seed)
+
+    click.echo(f"{'Methode':<36}{'vorher µs/Aufruf':>18}{'nachher µs/Aufruf':>19}{'Faktor':>9}")
+    for method_name, method_calls in samples.items():
+        if not method_calls:
+            continue
+        # Aufwärmen, damit Pool und Caches gefüllt sind
+        _measure(before, method_name, method_calls[:50], 1)
+        _measure(after, method_name, method_calls[:50], 1)
+        t_before = _measure(before, method_name, method_calls, threads)
+        t_after = _measure(after, method_name, method_calls, threads)
+        click.echo(f"{method_name:<36}{t_before:>18.1f}{t_after:>19.1f}{t_before / t_after:>8.2f}x")
+    click.echo(f"{utils.GREEN}{calls} Aufrufe pro Methode, {threads} Thread(s){utils.RESET}")
+
+if __name__ == '__main__':
+    main()
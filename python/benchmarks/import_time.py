@@ -0,0 +1,80 @@
+import click
+import os
+import re
+import subprocess
+import sys
+from ptc4gtfs import utils
+
+# Importzeit-Budget der CLI pro Befehl, gemessen mit `python -X importtime`.
+# Die Befehle werden wirklich ausgeführt, damit auch die im Befehl geladenen Module zählen.
+# Überschreitet ein Befehl sein Budget, endet das Skript mit Exit-Code 1 (für CI/Skripte).
+#
+#   python -m benchmarks.import_time --db gtfs.db --graph ptc4gtfs_graph.pkl --from 100 --to 105
+
+# Budget in Millisekunden (Summe der Importzeiten, ohne Interpreterstart)
+IMPORT_BUDGET_MS = {
+    "--help": 150,
+    "inspect-db": 600,
+    "prepare-today": 600,
+    "find-shortes-path": 1500,
+}
+
+# Zeile von -X importtime: "import time: self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+# Module des Interpreterstarts, die auch ohne ptc4gtfs geladen werden
+STARTUP_MODULES = {"site", "encodings", "zipimport", "codecs", "io", "abc", "_frozen_importlib_external", "time", "_signal", "_io", "marshal", "posix", "winreg", "_codecs", "_thread", "_warnings", "_weakref"}
+
+def parse_importtime(stderr):
+    # Gibt (Summe in ms, Liste (Modul, ms) der direkt importierten Pakete) zurück
+    top_level = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # Nur Module der obersten Ebene (eine Leerstelle Einrückung), deren cumulative enthält alles darunter
+        if match and len(match.group(3)) == 1 and match.group(4) not in STARTUP_MODULES:
+            top_level.append((match.group(4), int(match.group(2)) / 1000))
+    return sum(ms for _, ms in top_level), top_level
+
+def measure(args, cwd=None):
+    env = dict(os.environ)
+    # ptc4gtfs aus diesem Checkout importieren, auch wenn cwd woanders liegt
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "ptc4gtfs", *args],
+        capture_output=True, text=True, cwd=cwd, env=env,
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f"ptc4gtfs {' '.join(args)} fehlgeschlagen:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+@click.command()
+@click.option('--db', 'db_path', default='gtfs.db', help='Pfad zur SQLite-DB-Datei')
+@click.option('--graph', 'graph_path', default='ptc4gtfs_graph.pkl', help='Graph-Datei für find-shortes-path')
+@click.option('--from', 'from_id', type=int, help='Start-Station für find-shortes-path (ohne: Befehl überspringen)')
+@click.option('--to', 'to_id', type=int, help='Ziel-Station für find-shortes-path')
+@click.option('--top', default=5, help='Anzahl der teuersten Pakete pro Befehl')
+def main(db_path, graph_path, from_id, to_id, top):
+    db_path = os.path.abspath(db_path)
+    commands = {
+        "--help": ["--help"],
+        "inspect-db": ["--db", db_path, "inspect-db"],
+        "prepare-today": ["--db", db_path, "prepare-today"],
+    }
+    if from_id is not None and to_id is not None:
+        commands["find-shortes-path"] = ["--db", db_path, "find-shortes-path", str(from_id), str(to_id), os.path.abspath(graph_path)]
+
+    over_budget = []
+    for name, args in commands.items():
+        # Eigenes Arbeitsverzeichnis wegen der Logdatei gtfs_cli.log
+        total_ms, packages = measure(args, cwd=os.path.dirname(db_path))
+        budget = IMPORT_BUDGET_MS[name]
+        color = utils.GREEN if total_ms <= budget else utils.RED
+        click.echo(f"{color}{name:<24}{total_ms:>10.1f} ms  (Budget {budget} ms){utils.RESET}")
+        for package, ms in sorted(packages, key=lambda item: -item[1])[:top]:
+            click.echo(f"    {package:<36}{ms:>10.1f} ms")
+        if total_ms > budget:
+            over_budget.append(name)
+    if over_budget:
+        raise click.ClickException(f"Importzeit-Budget überschritten: {', '.join(over_budget)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import click
+import logging
+import shutil
+import sys
+import time
+from pathlib import Path
+import pandas as pd
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.ids import IdKind
+from ptc4gtfs.model import EdgeAttr
+from ptc4gtfs import model, parser, utils
+from benchmarks.synthetic_feed import generate_feed
+
+# Prüft update-db + generate-graph --incremental gegen einen vollständigen Neuaufbau aus demselben Feed:
+# synthetischer Feed -> init-db + Graph, dann Fahrzeiten einer Route ändern und eine Route entfernen,
+# einmal inkrementell aktualisieren und einmal neu aufbauen. Verglichen werden die Tabellen der Datenbank
+# und die Kanten des Graphen (mit Gewicht), beides über die GTFS-IDs, da sich die Codes unterscheiden können.
+# Bei Abweichungen Exit-Code 1.
+#
+#   python -m benchmarks.incremental_update -w benchmark_work/incremental --stations 40 --routes 6
+
+# Tabellen, deren Inhalt nach Update und Neuaufbau gleich sein muss
+COMPARED_TABLES = ("routes", "trips", "stop_times", "calendar")
+# Spalten mit IDs, die für den Vergleich in GTFS-IDs übersetzt werden
+ID_COLUMNS = {"stop_id": IdKind.STOP, "route_id": IdKind.ROUTE, "trip_id": IdKind.TRIP, "service_id": IdKind.SERVICE}
+
+def _change_feed(feed_dir, changed_route, removed_route):
+    # Fahrzeiten von changed_route ab dem zweiten Halt um eine Minute pro Halt verlängern, removed_route entfernen
+    trips = pd.read_csv(feed_dir / "trips.txt")
+    stop_times = pd.read_csv(feed_dir / "stop_times.txt")
+    changed_trips = set(trips.loc[trips["route_id"] == changed_route, "trip_id"])
+    removed_trips = set(trips.loc[trips["route_id"] == removed_route, "trip_id"])
+    changed = stop_times["trip_id"].isin(changed_trips)
+    delay = stop_times.loc[changed].groupby("trip_id").cumcount() * 60
+    for column in ("arrival_time", "departure_time"):
+        seconds = stop_times.loc[changed, column].map(utils.parse_gtfs_time) + delay
+        stop_times.loc[changed, column] = seconds.map(utils.format_gtfs_time)
+    stop_times[~stop_times["trip_id"].isin(removed_trips)].to_csv(feed_dir / "stop_times.txt", index=False)
+    trips[trips["route_id"] != removed_route].to_csv(feed_dir / "trips.txt", index=False)
+    routes = pd.read_csv(feed_dir / "routes.txt")
+    routes[routes["route_id"] != removed_route].to_csv(feed_dir / "routes.txt", index=False)
+
+def _build(workdir, feed_dir):
+    # init-db und generate-graph in workdir
+    db = GTFSDatabase(f"sqlite:///{workdir / 'gtfs.db'}")
+    db.load_gtfs_feed(feed_dir)
+    model.generate_ptc4gtfs_graph(db, file_name=str(workdir / "ptc4gtfs_graph.pkl"))
+    return db
+
+def _decoded_table(db, name):
+    # Tabelle mit GTFS-IDs, nach allen Spalten sortiert
+    ids = db.get_id_dictionary()
+    with db.engine.connect() as conn:
+        df = pd.read_sql_query(f"SELECT * FROM {name}", conn)
+    for column, kind in ID_COLUMNS.items():
+        if column in df.columns:
+            df[column] = [ids.decode(kind, code) for code in df[column]]
+    df = df.astype(str)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def _decoded_edges(db, graph):
+    # (von, nach, Typ, Route) -> Gewicht, Knoten und Routen als GTFS-IDs
+    ids = db.get_id_dictionary()
+    edges = {}
+    for a, b, attr in graph.edges(data=True):
+        route_id = attr.get(EdgeAttr.ROUTE_ID.value)
+        key = (ids.decode(IdKind.STOP, a), ids.decode(IdKind.STOP, b), attr.get(EdgeAttr.TYPE.value), ids.decode(IdKind.ROUTE, route_id))
+        edges[key] = attr.get(EdgeAttr.WEIGHT.value)
+    return edges
+
+@click.command()
+@click.option('-w', '--workdir', default='benchmark_work/incremental', help='Arbeitsordner (wird geleert)')
+@click.option('--stations', default=40, help='Anzahl Stationen')
+@click.option('--routes', default=6, help='Anzahl Routen')
+@click.option('--trips-per-route', default=20, help='Trips pro Route')
+@click.option('--seed', default=42, help='Seed des Feeds')
+def main(workdir, stations, routes, trips_per_route, seed):
+    logging.basicConfig(level=logging.WARNING)
+    workdir = Path(workdir)
+    if workdir.exists():
+        shutil.rmtree(workdir)
+    old_feed, new_feed = workdir / "feed_old", workdir / "feed_new"
+    incremental, rebuilt = workdir / "incremental", workdir / "rebuilt"
+    for path in (incremental, rebuilt):
+        path.mkdir(parents=True)
+    generate_feed(old_feed, stations=stations, routes=routes, trips_per_route=trips_per_route, seed=seed)
+    shutil.copytree(old_feed, new_feed)
+    # Route 1 mit geänderten Zeiten, die letzte Route entfällt
+    _change_feed(new_feed, 1, routes)
+    for feed_dir in (old_feed, new_feed):
+        parser.extract_stop_routes_departures_gtfs(feed_dir)
+
+    db = _build(incremental, old_feed)
+    start = time.perf_counter()
+    added, removed, changed = db.update_gtfs_feed(new_feed)
+    graph = model.update_ptc4gtfs_graph(db, str(incremental / "ptc4gtfs_graph.pkl"))
+    update_seconds = time.perf_counter() - start
+    click.echo(f"{'Update':<28}{update_seconds:>10.3f} s ({len(added)} neue, {len(removed)} entfernte, {len(changed)} geänderte Routen)")
+
+    start = time.perf_counter()
+    rebuilt_db = _build(rebuilt, new_feed)
+    rebuilt_graph = model.load_networkx_ptc4gtfs_graph(str(rebuilt / "ptc4gtfs_graph.pkl"))
+    click.echo(f"{'Neuaufbau':<28}{time.perf_counter() - start:>10.3f} s")
+
+    mismatches = 0
+    for name in COMPARED_TABLES:
+        equal = _decoded_table(db, name).equals(_decoded_table(rebuilt_db, name))
+        mismatches += not equal
+        click.echo(f"{'Tabelle ' + name:<28}{'gleich' if equal else 'abweichend':>10}")
+    edges, rebuilt_edges = _decoded_edges(db, graph), _decoded_edges(rebuilt_db, rebuilt_graph)
+    missing = rebuilt_edges.keys() - edges.keys()
+    extra = edges.keys() - rebuilt_edges.keys()
+    weights = [key for key in edges.keys() & rebuilt_edges.keys() if edges[key] != rebuilt_edges[key]]
+    mismatches += len(missing) + len(extra) + len(weights)
+    click.echo(f"{'Kanten':<28}{len(edges):>10} ({len(missing)} fehlen, {len(extra)} zu viel, {len(weights)} mit anderem Gewicht)")
+    for key in sorted(weights)[:5]:
+        click.echo(f"  {key}: {edges[key]} statt {rebuilt_edges[key]}")
+    if mismatches:
+        click.echo(f"{utils.RED}Update weicht vom Neuaufbau ab{utils.RESET}")
+        sys.exit(1)
+    click.echo(f"{utils.GREEN}Update entspricht dem Neuaufbau{utils.RESET}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import click
+import logging
+import random
+import time
+import numpy as np
+from datetime import datetime
+from ptc4gtfs import utils
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.realtime import RealtimeDepartures, StopTimeUpdate, TripUpdate
+
+# Durchsatz der Echtzeit-Überlagerung: synthetische TripUpdates (vollständiger Feed, jede Runde neue
+# Verspätungen) auf den Abfahrtsindex eines Betriebstages anwenden. Eine Runde muss deutlich unter dem
+# Abrufintervall bleiben (Standard 30 s), sonst kommt die Aktualisierung nicht hinterher.
+#
+#   python -m benchmarks.realtime_updates --db benchmark_work/gtfs.db --date 20260114 --rounds 10
+
+# Ende des Betriebstages in GTFS-Sekunden (Fahrten nach Mitternacht bis 48:00)
+DAY_END = 48 * 3600
+
+def synthetic_trip_updates(realtime: RealtimeDepartures, rng: random.Random, share=1.0, cancel_share=0.01, max_delay=600):
+    # Ein TripUpdate pro Trip: Verspätung ab einer zufälligen Haltestelle, einzelne Ausfälle
+    updates = []
+    for trip_id in realtime.departures.trip_ids():
+        if rng.random() >= share:
+            continue
+        scheduled = realtime.schedule(trip_id)
+        if rng.random() < cancel_share:
+            updates.append(TripUpdate(trip_id, True, []))
+            continue
+        _, stop_id, _ = scheduled[rng.randrange(len(scheduled))]
+        updates.append(TripUpdate(trip_id, False, [StopTimeUpdate(stop_id, rng.randrange(-60, max_delay), None, False)]))
+    return updates
+
+@click.command()
+@click.option('--db', 'db_path', default='benchmark_work/gtfs.db', help='Pfad zur SQLite-DB-Datei')
+@click.option('--date', 'service_date', default=None, help='Betriebstag als YYYYMMDD (Standard: heute)')
+@click.option('--rounds', default=10, help='Anzahl Aktualisierungen')
+@click.option('--share', default=1.0, help='Anteil der Trips mit Meldung pro Runde')
+@click.option('--interval', default=30.0, help='Abrufintervall in Sekunden (Budget pro Runde)')
+@click.option('--seed', default=42, help='Seed für die Verspätungen')
+def main(db_path, service_date, rounds, share, interval, seed):
+    logging.basicConfig(level=logging.WARNING)
+    db = GTFSDatabase(f"sqlite:///{db_path}")
+    service_date = datetime.strptime(service_date, "%Y%m%d").date() if service_date else db.get_service_date_today()
+    start = time.perf_counter()
+    realtime = RealtimeDepartures.from_db(db, service_date)
+    trips = len(realtime.departures.trip_ids())
+    click.echo(f"{'Index des Betriebstages':<28}{time.perf_counter() - start:>10.3f} s ({trips} Trips)")
+    # Abfahrten einiger (stop_id, route_id)-Paare über den ganzen Tag, um den alten Snapshot zu prüfen
+    sample_pairs = list(realtime.departures.stop_patterns)[:100]
+
+    rng = random.Random(seed)
+    seconds = []
+    changed = []
+    for _ in range(rounds):
+        updates = synthetic_trip_updates(realtime, rng, share)
+        before = realtime.snapshot()
+        before_times = {key: before.departures.departures_between(*key, 0, DAY_END) for key in sample_pairs}
+        result = realtime.apply(updates)
+        # Der alte Snapshot darf sich nicht verändert haben (laufende Suchen)
+        assert all(before.departures.departures_between(*key, 0, DAY_END) == times for key, times in before_times.items())
+        seconds.append(result["seconds"])
+        changed.append(result["changed_entries"])
+    seconds = np.asarray(seconds)
+    color = utils.GREEN if seconds.max() < interval else utils.RED
+    click.echo(f"{'Aktualisierung (Mittel)':<28}{seconds.mean():>10.3f} s ({np.mean(changed):.0f} geänderte Abfahrten)")
+    click.echo(f"{color}{'Aktualisierung (Max)':<28}{seconds.max():>10.3f} s (Budget {interval} s){utils.RESET}")
+    click.echo(f"{'Trips pro Sekunde':<28}{trips * share / seconds.mean():>10.0f}")
+    if seconds.max() >= interval:
+        raise click.ClickException("Echtzeit-Aktualisierung langsamer als das Abrufintervall")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import click
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.departures import DepartureIndex
+from ptc4gtfs import dijkstra, model, parser, ptc, utils
+from ptc4gtfs.stats import QueryStats
+from benchmarks.synthetic_feed import generate_feed
+
+# Reproduzierbare End-to-End-Messung: synthetischer Feed -> Abfahrten extrahieren -> init-db ->
+# generate-graph -> Abfahrtsindex -> find_path_in_ptc4gtfs_graph für feste Start/Ziel-Paare.
+# Ergebnis als JSON (Laufzeiten, Durchsatz, Latenz-Perzentile, Speicherspitzen) zum Vergleich
+# zwischen Commits, siehe benchmarks.compare.
+#
+#   python -m benchmarks.routing_suite -o results.json --stations 400 --routes 40 --queries 200
+
+# Schema-Version der Ergebnisdatei
+# 2: Suchaufwand pro Suche (abgearbeitete Knoten, Heap-Pushes, ...) und find_path_contracted
+# 3: find_path_bidirectional und long_trips (längstes Viertel der Paare, normal und bidirektional)
+# 4: find_path_contracted zählt in nodes_settled auch die ohne Heap expandierten Plattformen/Stationen
+# 5: find_path_bidirectional_warm (dieselben Paare erneut, Schranken-Suchen aus dem Cache)
+# 6: departure_index ist der PatternTimetable des Betriebstages, prepare_departures entfällt
+RESULT_VERSION = 6
+# Anteil der Paare mit der größten statischen Entfernung, die als lange Fahrten gemessen werden
+LONG_TRIP_SHARE = 0.25
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _max_rss_bytes():
+    # ru_maxrss ist unter Linux in KiB, unter macOS in Bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+@contextlib.contextmanager
+def _quiet():
+    # Banner und Fortschrittsbalken der Bibliothek nicht mitmessen
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+def _run_stage(stages, name, func, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with _quiet():
+        result = func()
+    seconds = time.perf_counter() - start
+    stage = {"seconds": round(seconds, 4)}
+    if trace_memory:
+        stage["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stages[name] = stage
+    click.echo(f"{name:<24}{seconds:>10.3f} s")
+    return result
+
+def _latency_summary(latencies):
+    latencies_ms = np.asarray(latencies) * 1000
+    summary = {f"p{p}": round(float(np.percentile(latencies_ms, p)), 3) for p in LATENCY_PERCENTILES}
+    summary["mean"] = round(float(latencies_ms.mean()), 3)
+    summary["max"] = round(float(latencies_ms.max()), 3)
+    return summary
+
+def _run_queries(name, db, graph, departure_time, departures, pairs, **options):
+    # Feste Start/Ziel-Paare nacheinander, Latenz pro Suche und Suchaufwand im Mittel
+    latencies = []
+    found = 0
+    stats = QueryStats()
+    rss_before = _max_rss_bytes()
+    start = time.perf_counter()
+    with _quiet():
+        for a_stop_id, b_stop_id in pairs:
+            query_start = time.perf_counter()
+            result = ptc.find_path_in_ptc4gtfs_graph(db, a_stop_id, b_stop_id, graph, departure_time, departures, stats=stats, **options)
+            latencies.append(time.perf_counter() - query_start)
+            if result and result[3]:
+                found += 1
+    total = time.perf_counter() - start
+    click.echo(f"{name:<24}{total:>10.3f} s ({len(pairs)} Suchen)")
+    return {
+        "queries": len(pairs),
+        "found": found,
+        "seconds": round(total, 4),
+        "throughput_qps": round(len(pairs) / total, 3) if total else None,
+        "latency_ms": _latency_summary(latencies),
+        "per_query": {counter: round(getattr(stats, counter) / len(pairs), 2) for counter in QueryStats.COUNTERS if counter != "searches"},
+        "max_rss_growth_bytes": _max_rss_bytes() - rss_before,
+    }
+
+def _long_trip_pairs(graph, pairs, share=LONG_TRIP_SHARE):
+    # Paare mit der größten statischen Entfernung (minimale Fahrzeiten ohne Warten), z.B. quer durch die Stadt
+    bounds_by_target = {}
+    def static_distance(pair):
+        a_stop_id, b_stop_id = pair
+        if b_stop_id not in bounds_by_target:
+            bounds_by_target[b_stop_id] = dijkstra.lower_bound_distances(graph, b_stop_id)[0]
+        return bounds_by_target[b_stop_id].get(a_stop_id, -1)
+    ranked = sorted(pairs, key=static_distance, reverse=True)
+    return ranked[:max(1, int(len(pairs) * share))]
+
+def run_suite(workdir, stations=400, routes=40, stops_per_route=12, trips_per_route=80, queries=200,
+              departure="2026-01-14T08:00", seed=42, trace_memory=True):
+    """
+    Führt alle Stufen in workdir aus und gibt das Ergebnis als Dict zurück.
+    Start/Ziel-Paare werden aus seed gezogen, die Abfahrtszeit ist fest.
+    """
+    workdir = Path(workdir)
+    feed_dir = workdir / "feed"
+    db_path = workdir / "gtfs.db"
+    graph_path = workdir / "ptc4gtfs_graph.pkl"
+    for path in (db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-shm"), graph_path):
+        if path.exists():
+            path.unlink()
+    stages = {}
+
+    counts = _run_stage(stages, "generate_feed", lambda: generate_feed(
+        feed_dir, stations=stations, routes=routes, stops_per_route=stops_per_route,
+        trips_per_route=trips_per_route, seed=seed,
+    ), trace_memory)
+    _run_stage(stages, "extract_departures", lambda: parser.extract_stop_routes_departures_gtfs(feed_dir), trace_memory)
+    db = GTFSDatabase(f"sqlite:///{db_path}")
+    _run_stage(stages, "init_db", lambda: db.load_gtfs_feed(feed_dir), trace_memory)
+    graph = _run_stage(stages, "generate_graph", lambda: model.generate_ptc4gtfs_graph(db, file_name=str(graph_path)), trace_memory)
+
+    departure_time = utils.parse_departure_time(departure, tz=db.get_agency_timezone())
+    departures = _run_stage(stages, "departure_index", lambda: DepartureIndex.for_service_date(db, departure_time.date()), trace_memory)
+
+    # Feste Start/Ziel-Paare aus den Stationen im Graphen
+    rng = random.Random(seed)
+    station_ids = sorted(int(stop['stop_id']) for stop in db.get_all_parent_station() if graph.has_node(int(stop['stop_id'])))
+    pairs = [tuple(rng.sample(station_ids, 2)) for _ in range(queries)]
+
+    find_path = _run_queries("find_path", db, graph, departure_time, departures, pairs)
+    find_path_contracted = _run_queries("find_path_contracted", db, graph, departure_time, departures, pairs, contracted=True)
+    find_path_bidirectional = _run_queries("find_path_bidirectional", db, graph, departure_time, departures, pairs, bidirectional=True)
+    # Zweiter Durchlauf: Ziele wiederholen sich, die Schranken-Suchen kommen aus dem Cache (dijkstra.cached_lower_bounds)
+    find_path_bidirectional_warm = _run_queries("find_path_bidirectional_warm", db, graph, departure_time, departures, pairs, bidirectional=True)
+    long_pairs = _long_trip_pairs(graph, pairs)
+    long_trips = {
+        "pairs": len(long_pairs),
+        "find_path": _run_queries("long_trips.find_path", db, graph, departure_time, departures, long_pairs),
+        "find_path_bidirectional": _run_queries("long_trips.bidirectional", db, graph, departure_time, departures, long_pairs, bidirectional=True),
+    }
+
+    return {
+        "version": RESULT_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "params": {
+            "stations": stations,
+            "routes": routes,
+            "stops_per_route": stops_per_route,
+            "trips_per_route": trips_per_route,
+            "queries": queries,
+            "departure": departure,
+            "seed": seed,
+        },
+        "feed": counts,
+        "graph": {"nodes": graph.number_of_nodes(), "edges": graph.number_of_edges()},
+        "stages": stages,
+        "find_path": find_path,
+        "find_path_contracted": find_path_contracted,
+        "find_path_bidirectional": find_path_bidirectional,
+        "find_path_bidirectional_warm": find_path_bidirectional_warm,
+        "long_trips": long_trips,
+        "max_rss_bytes": _max_rss_bytes(),
+    }
+
+@click.command()
+@click.option('-o', '--output', default='benchmark_results.json', help='Ergebnisdatei (JSON)')
+@click.option('-w', '--workdir', default='benchmark_work', help='Arbeitsordner für Feed, DB und Graph')
+@click.option('--stations', default=400, help='Anzahl Stationen')
+@click.option('--routes', default=40, help='Anzahl Routen')
+@click.option('--stops-per-route', default=12, help='Stationen pro Route')
+@click.option('--trips-per-route', default=80, help='Fahrten pro Route und Tag')
+@click.option('-q', '--queries', default=200, help='Anzahl Pfadsuchen')
+@click.option('-t', '--departure', default='2026-01-14T08:00', help='Feste Abfahrtszeit (Ortszeit der Agentur)')
+@click.option('--seed', default=42, help='Seed für Feed und Start/Ziel-Paare')
+@click.option('--no-trace-memory', is_flag=True, help='Speicherspitzen nicht per tracemalloc messen (schneller)')
+def main(output, workdir, stations, routes, stops_per_route, trips_per_route, queries, departure, seed, no_trace_memory):
+    # Logging der Bibliothek nur für Warnungen, damit Ausgaben nicht mitgemessen werden
+    logging.basicConfig(level=logging.WARNING)
+    result = run_suite(workdir, stations, routes, stops_per_route, trips_per_route, queries, departure, seed, not no_trace_memory)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    latency = result["find_path"]["latency_ms"]
+    click.echo(f"{utils.GREEN}find_path: {result['find_path']['throughput_qps']} Suchen/s, p50={latency['p50']} ms, p99={latency['p99']} ms -> {output}{utils.RESET}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import click
+import os
+import numpy as np
+import pandas as pd
+from ptc4gtfs import utils
+
+# Synthetischer GTFS-Feed fester Größe für reproduzierbare Benchmarks.
+# Stationen liegen auf einem Raster, jede Station hat mehrere Bahnsteige; Routen fahren
+# zufällige, aber zusammenhängende Wege über benachbarte Stationen. Gleicher Seed = gleicher Feed.
+#
+#   python -m benchmarks.synthetic_feed -o ./synthetic --stations 400 --routes 40 --trips-per-route 80
+
+# Abstand benachbarter Rasterpunkte in Grad (~1 km)
+GRID_SPACING = 0.01
+# Mittelpunkt des Rasters
+GRID_ORIGIN = (48.137, 11.575)
+SERVICE_START_DATE = 20200101
+SERVICE_END_DATE = 20301231
+
+def _hms(seconds):
+    # Sekunden ab Mitternacht als GTFS-Zeit HH:MM:SS (auch > 24:00)
+    seconds = pd.Series(np.asarray(seconds, dtype=np.int64))
+    return (seconds // 3600).astype(str).str.zfill(2) + ":" + \
+        (seconds % 3600 // 60).astype(str).str.zfill(2) + ":" + \
+        (seconds % 60).astype(str).str.zfill(2)
+
+def _route_station_sequence(rng, side, stations, length):
+    # Zufallsweg über Nachbarn im Raster ohne direkte Wiederholung einer Station
+    current = int(rng.integers(stations))
+    sequence = [current]
+    while len(sequence) < length:
+        row, col = divmod(current, side)
+        neighbors = [
+            r * side + c
+            for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1))
+            if 0 <= r < side and 0 <= c < side and r * side + c < stations and r * side + c not in sequence
+        ]
+        if not neighbors:
+            break
+        current = int(rng.choice(neighbors))
+        sequence.append(current)
+    return sequence
+
+def generate_feed(target_dir, stations=400, platforms_per_station=2, routes=40, stops_per_route=12, trips_per_route=80,
+                  first_departure=5 * 3600, last_departure=24 * 3600, seed=42, timezone="Europe/Berlin"):
+    """
+    Schreibt einen synthetischen Feed (agency, stops, routes, trips, stop_times, calendar, calendar_dates)
+    nach target_dir. trips_per_route Fahrten pro Route und Tag, gleichmäßig zwischen first_departure
+    und last_departure (Sekunden ab Mitternacht), abwechselnd in beide Richtungen.
+    Gibt die Anzahl der Zeilen pro Datei zurück.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(target_dir, exist_ok=True)
+    side = int(np.ceil(np.sqrt(stations)))
+
+    # Stationen (Parent) und Bahnsteige (Child)
+    station_ids = 100000 + np.arange(stations)
+    rows, cols = np.divmod(np.arange(stations), side)
+    lat = GRID_ORIGIN[0] + (rows - side / 2) * GRID_SPACING
+    lon = GRID_ORIGIN[1] + (cols - side / 2) * GRID_SPACING
+    stops = [pd.DataFrame({
+        "stop_id": station_ids,
+        "stop_name": [f"Station {i}" for i in range(stations)],
+        "parent_station": pd.array([None] * stations, dtype="Int64"),
+        "stop_lat": lat,
+        "stop_lon": lon,
+        "location_type": 1,
+    })]
+    for platform in range(platforms_per_station):
+        stops.append(pd.DataFrame({
+            "stop_id": station_ids * 10 + platform,
+            "stop_name": [f"Station {i}" for i in range(stations)],
+            "parent_station": pd.array(station_ids, dtype="Int64"),
+            "stop_lat": lat,
+            "stop_lon": lon,
+            "location_type": 0,
+        }))
+    stops_df = pd.concat(stops, ignore_index=True)
+
+    route_ids = 1 + np.arange(routes)
+    route_types = rng.choice([0, 1, 2, 3], size=routes)
+    routes_df = pd.DataFrame({
+        "route_id": route_ids,
+        "agency_id": 1,
+        "route_short_name": [f"L{route_id}" for route_id in route_ids],
+        "route_long_name": [f"Linie {route_id}" for route_id in route_ids],
+        "route_type": route_types,
+    })
+
+    trips = []
+    # Spalten von stop_times, am Ende einmal zusammengefügt
+    st_trip_ids, st_arrivals, st_stop_ids, st_sequences = [], [], [], []
+    trip_id = 1
+    departures = np.linspace(first_departure, last_departure - 1, trips_per_route).astype(np.int64)
+    for route_id in route_ids:
+        sequence = _route_station_sequence(rng, side, stations, stops_per_route)
+        # Ein Bahnsteig pro Richtung, Fahrzeit je Abschnitt 1-4 Minuten, 30 s Haltezeit
+        platform_forward = int(rng.integers(platforms_per_station))
+        platform_backward = (platform_forward + 1) % platforms_per_station
+        hop_seconds = rng.integers(60, 241, size=max(len(sequence) - 1, 0))
+        for n, start in enumerate(departures):
+            forward = n % 2 == 0
+            seq = sequence if forward else sequence[::-1]
+            hops = hop_seconds if forward else hop_seconds[::-1]
+            platform = platform_forward if forward else platform_backward
+            arrival = start + np.concatenate(([0], np.cumsum(hops + 30)))
+            trips.append((route_id, 1, trip_id))
+            st_trip_ids.append(np.full(len(seq), trip_id))
+            st_arrivals.append(arrival)
+            st_stop_ids.append(station_ids[seq] * 10 + platform)
+            st_sequences.append(np.arange(1, len(seq) + 1))
+            trip_id += 1
+    arrivals = np.concatenate(st_arrivals)
+    stop_times_df = pd.DataFrame({
+        "trip_id": np.concatenate(st_trip_ids),
+        "arrival_time": _hms(arrivals),
+        "departure_time": _hms(arrivals + 30),
+        "stop_id": np.concatenate(st_stop_ids),
+        "stop_sequence": np.concatenate(st_sequences),
+    })
+
+    files = {
+        "agency.txt": pd.DataFrame([{
+            "agency_id": 1, "agency_name": "Synthetic Transit", "agency_url": "http://example.org",
+            "agency_timezone": timezone, "agency_lang": "de",
+        }]),
+        "stops.txt": stops_df,
+        "routes.txt": routes_df,
+        "trips.txt": pd.DataFrame(trips, columns=["route_id", "service_id", "trip_id"]),
+        "stop_times.txt": stop_times_df,
+        "calendar.txt": pd.DataFrame([{
+            "service_id": 1, "monday": 1, "tuesday": 1, "wednesday": 1, "thursday": 1, "friday": 1,
+            "saturday": 1, "sunday": 1, "start_date": SERVICE_START_DATE, "end_date": SERVICE_END_DATE,
+        }]),
+        "calendar_dates.txt": pd.DataFrame(columns=["service_id", "date", "exception_type"]),
+    }
+    counts = {}
+    for name, df in files.items():
+        df.to_csv(os.path.join(target_dir, name), index=False)
+        counts[name] = len(df)
+    return counts
+
+@click.command()
+@click.option('-o', '--output', 'target_dir', default='synthetic_gtfs', help='Zielordner des Feeds')
+@click.option('--stations', default=400, help='Anzahl Stationen (Parent)')
+@click.option('--platforms', default=2, help='Bahnsteige pro Station')
+@click.option('--routes', default=40, help='Anzahl Routen')
+@click.option('--stops-per-route', default=12, help='Stationen pro Route')
+@click.option('--trips-per-route', default=80, help='Fahrten pro Route und Tag')
+@click.option('--seed', default=42, help='Seed des Zufallsgenerators')
+def main(target_dir, stations, platforms, routes, stops_per_route, trips_per_route, seed):
+    counts = generate_feed(target_dir, stations, platforms, routes, stops_per_route, trips_per_route, seed=seed)
+    for name, count in counts.items():
+        click.echo(f"{name:<20}{count:>10}")
+    click.echo(f"{utils.GREEN}Synthetischer Feed geschrieben: {target_dir}{utils.RESET}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import click
+import gc
+import random
+import logging
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime
+from ptc4gtfs import utils
+from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.departures import DepartureIndex
+from ptc4gtfs.timetable import PatternTimetable
+
+# Speicherbedarf des Tagesfahrplans, den Routing und Abfahrtstafeln nutzen: DepartureIndex über dem
+# PatternTimetable (Muster + Startzeiten, Takt-Läufe) gegen die frühere Ablage mit einer Liste pro
+# (stop_id, route_id) und einer Haltemenge pro Trip (eine Zeile pro Halt wie departures_today), dazu
+# Aufbauzeit und Zeit pro Lookup (next_departure, trip_serves_stop, Ankunft/Abfahrt eines Trips).
+#
+#   python -m benchmarks.timetable_memory --db benchmark_work/gtfs.db --date 20260114
+
+def _allocated(func):
+    # Aufbauzeit und von func belegter Speicher (tracemalloc, ohne die Rohdaten der Datenbank)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, current, result
+
+def _per_stop_lists(stop_ids, route_ids, trip_ids, dep_seconds):
+    # Frühere Ablage des Abfahrtsindex: (stop_id, route_id) -> sortierte Zeiten/trip_ids, trip_id -> Halte
+    times, trips, trip_stops = defaultdict(list), defaultdict(list), defaultdict(set)
+    for stop_id, route_id, trip_id, dep in sorted(zip(stop_ids.tolist(), route_ids.tolist(), trip_ids.tolist(), dep_seconds.tolist()), key=lambda row: row[3]):
+        times[(stop_id, route_id)].append(dep)
+        trips[(stop_id, route_id)].append(trip_id)
+        trip_stops[trip_id].add(stop_id)
+    return dict(times), dict(trips), dict(trip_stops)
+
+def _per_query(func, args):
+    # Mittlere Zeit pro Aufruf in µs
+    start = time.perf_counter()
+    for arg in args:
+        func(*arg)
+    return (time.perf_counter() - start) / max(len(args), 1) * 1e6
+
+@click.command()
+@click.option('--db', 'db_path', default='benchmark_work/gtfs.db', help='Pfad zur SQLite-DB-Datei')
+@click.option('--date', 'service_date', default=None, help='Betriebstag als YYYYMMDD (Standard: heute)')
+@click.option('-n', 'lookups', default=100000, help='Anzahl Lookups für die Zeitmessung')
+def main(db_path, service_date, lookups):
+    logging.basicConfig(level=logging.WARNING)
+    db = GTFSDatabase(f"sqlite:///{db_path}")
+    service_date = datetime.strptime(service_date, "%Y%m%d").date() if service_date else db.get_service_date_today()
+    trips, stop_times = db.get_service_day_frames(service_date)
+
+    timetable_seconds, timetable_bytes, timetable = _allocated(lambda: PatternTimetable.from_frames(trips, stop_times))
+    index_seconds, index_bytes, index = _allocated(lambda: DepartureIndex.from_timetable(timetable))
+    arrays = timetable.departure_arrays()
+    lists_seconds, lists_bytes, (times, trip_lists, trip_stops) = _allocated(lambda: _per_stop_lists(*arrays))
+    stats = timetable.stats()
+    events = max(stats["stop_events"], 1)
+    total_bytes = timetable_bytes + index_bytes
+    click.echo(f"{'Betriebstag':<28}{service_date}: {stats['trips']} Trips, {stats['stop_events']} Halte")
+    click.echo(f"{'Muster / Läufe':<28}{stats['patterns']:>10} / {stats['runs']}")
+    click.echo(f"{'DepartureIndex':<28}{total_bytes / 2**20:>10.1f} MiB ({total_bytes / events:.1f} B/Halt, {timetable_seconds + index_seconds:.3f} s)")
+    click.echo(f"{'  davon PatternTimetable':<28}{timetable_bytes / 2**20:>10.1f} MiB (Arrays {stats['bytes'] / 2**20:.1f} MiB)")
+    click.echo(f"{'  davon (stop, route)':<28}{index_bytes / 2**20:>10.1f} MiB ({len(index.stop_patterns)} Paare)")
+    click.echo(f"{'Listen pro (stop, route)':<28}{lists_bytes / 2**20:>10.1f} MiB ({lists_bytes / events:.1f} B/Halt, {lists_seconds:.3f} s)")
+
+    # Stichprobe aus den Abfahrten des Tages (Werte als Python-int)
+    rng = random.Random(42)
+    rows = [rng.randrange(len(arrays[0])) for _ in range(lookups)] if len(arrays[0]) else []
+    stop_ids, route_ids, trip_ids, dep_seconds = (column.tolist() for column in arrays)
+    departure_args = [(stop_ids[row], route_ids[row], dep_seconds[row] - rng.randrange(3600)) for row in rows]
+    serves_args = [(trip_ids[row], stop_ids[rng.choice(rows)]) for row in rows]
+
+    def list_next_departure(stop_id, route_id, after_seconds):
+        key_times = times[(stop_id, route_id)]
+        idx = bisect_left(key_times, after_seconds)
+        return (key_times[idx], trip_lists[(stop_id, route_id)][idx]) if idx < len(key_times) else None
+
+    click.echo(f"{'next_departure':<28}{_per_query(index.next_departure, departure_args):>10.2f} µs (Listen {_per_query(list_next_departure, departure_args):.2f} µs)")
+    click.echo(f"{'trip_serves_stop':<28}{_per_query(index.trip_serves_stop, serves_args):>10.2f} µs (Listen {_per_query(lambda trip_id, stop_id: stop_id in trip_stops.get(trip_id, ()), serves_args):.2f} µs)")
+    pairs = [(trip_ids[row], stop_ids[row]) for row in rows]
+    lookup = _per_query(lambda trip_id, stop_id: (timetable.arrival(trip_id, stop_id), timetable.departure(trip_id, stop_id)), pairs)
+    click.echo(f"{'Lookup Ankunft+Abfahrt':<28}{lookup:>10.2f} µs")
+    click.echo(f"{utils.GREEN}Speicher DepartureIndex / Listen pro (stop, route): {total_bytes / max(lists_bytes, 1):.1%}{utils.RESET}")
+
+if __name__ == '__main__':
+    main()
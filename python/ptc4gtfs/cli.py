@@ -1,13 +1,16 @@
 import click
 import logging
+from datetime import datetime
 from . import utils
-from . import db as gtfs_db
 import os
-from . import parser
 from pathlib import Path
-from . import ptc
-from . import model
-from . import plot as pl
+from . import columnar
+from .ids import IdKind
+import shutil
+
+# db (SQLAlchemy), model/ptc (networkx), parser (pandas, requests) und plot (matplotlib) werden erst
+# im jeweiligen Befehl importiert, damit z.B. prepare-today und find-shortes-path schnell starten.
+# Importzeit pro Befehl: python -m benchmarks.import_time
 
 logger = logging.getLogger(__name__)
 
@@ -15,11 +18,13 @@ logger = logging.getLogger(__name__)
 @click.group()
 @click.option('--db', default='gtfs.db', help='Pfad zur SQLite-DB-Datei (z.B. gtfs.db)')
 @click.option('--verbose', is_flag=True, help='Aktiviere ausführliche Ausgabe (Debug-Logging)')
+@click.option('--columnar', is_flag=True, help='Tabellen zusätzlich als Parquet neben der DB ablegen (<db>.parquet/, benötigt pyarrow)')
 @click.pass_context
-def cli(ctx, db, verbose):
+def cli(ctx, db, verbose, columnar):
     """GTFS CLI-Tool zur Verwaltung und Abfrage von GTFS-Daten."""
     ctx.ensure_object(dict)
     ctx.obj['DB'] = db
+    ctx.obj['COLUMNAR'] = columnar
     if verbose:
         utils.logger_config("gtfs_cli", logging.DEBUG)
         logger.debug("Verbose-Modus aktiviert (Debug-Logging)")
@@ -30,17 +35,33 @@ def cli(ctx, db, verbose):
 
 # Erstellt die Tabelle departures_today für den aktuellen Tag
 @cli.command('prepare-today')
+@click.option("--date", "service_date", default=None, help="Betriebstag als YYYYMMDD (Standard: heute in der Agentur-Zeitzone)")
 @click.pass_context
-def prepare_today(ctx):
+def prepare_today(ctx, service_date):
     """Erstellt die Tabelle departures_today für den aktuellen Tag."""
     db = get_db(ctx)
-    db.create_departures_today()
+    db.create_departures_today(datetime.strptime(service_date, "%Y%m%d").date() if service_date else None)
     click.echo("Tabelle departures_today wurde erstellt.")
 
 # Hilfsfunktion: Erstellt eine GTFSDatabase-Instanz
 def get_db(ctx):
     """Hilfsfunktion: Erstellt eine GTFSDatabase-Instanz."""
-    return gtfs_db.GTFSDatabase(f"sqlite:///{ctx.obj['DB']}")
+    from . import db as gtfs_db
+    # Spaltenablage verwenden, wenn angefordert oder bereits vorhanden
+    columnar_dir = columnar.default_columnar_dir(ctx.obj['DB'])
+    use_columnar = ctx.obj.get('COLUMNAR') or os.path.isdir(columnar_dir)
+    return gtfs_db.GTFSDatabase(f"sqlite:///{ctx.obj['DB']}", columnar_dir=columnar_dir if use_columnar else None)
+
+# Hilfsfunktion: GTFS-IDs der Kommandozeile in die Codes der Datenbank übersetzen (ids.IdDictionary)
+def encode_ids(db, kind, gtfs_ids, param_hint):
+    id_dictionary = db.get_id_dictionary()
+    codes = []
+    for gtfs_id in gtfs_ids:
+        code = id_dictionary.encode(kind, gtfs_id)
+        if code is None:
+            raise click.BadParameter(f"Unbekannte ID {gtfs_id}", param_hint=param_hint)
+        codes.append(code)
+    return codes
 
 # Initialisiert die Datenbank mit GTFS-Daten aus einem Verzeichnis
 @cli.command('init-db')
@@ -52,11 +73,28 @@ def init_db(ctx, gtfs_dir):
     if os.path.exists(db_path):
         os.remove(db_path)
         logger.info("Alte Datenbank gelöscht.")
+    # WAL- und Shared-Memory-Dateien der alten Datenbank gehören nicht zur neuen
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    # Alte Parquet-Ablage ebenfalls entfernen (wird mit --columnar neu geschrieben)
+    if os.path.isdir(columnar.default_columnar_dir(db_path)):
+        shutil.rmtree(columnar.default_columnar_dir(db_path))
     db = get_db(ctx)
     db.load_gtfs_feed(gtfs_dir)
     logger.info("GTFS-Daten erfolgreich geladen.")
     click.echo("Datenbank erfolgreich initialisiert.")
 
+# Aktualisiert die Datenbank inkrementell aus einem neuen GTFS-Feed
+@cli.command('update-db')
+@click.argument('gtfs_dir', type=click.Path(exists=True, file_okay=False))
+@click.pass_context
+def update_db(ctx, gtfs_dir):
+    """Ersetzt nur die Routen, deren Fahrplan sich im neuen Feed geändert hat."""
+    db = get_db(ctx)
+    added, removed, changed = db.update_gtfs_feed(gtfs_dir)
+    click.echo(f"Datenbank aktualisiert: {len(added)} neue, {len(removed)} entfernte, {len(changed)} geänderte Routen.")
+
 # Zeigt Struktur und Tabellen der Datenbank an
 @cli.command('inspect-db')
 @click.pass_context
@@ -66,12 +104,17 @@ def inspect_db(ctx):
     db.inspect_db()
     logger.info("Datenbankstruktur inspiziert.")
 
-# Plottet den GTFS-Graphen, optional als SVG speichern
+# Plottet den GTFS-Graphen, optional als SVG/PNG speichern (ohne Fenster)
 @cli.command('plot-ptc4gtfs')
-@click.option('-s', '--save', is_flag=True)
+@click.option('-s', '--save', is_flag=True, help="Als plot.svg speichern statt anzuzeigen")
+@click.option('-o', '--output', default=None, help="Ausgabedatei, Format aus der Endung (z.B. netz.svg oder netz.png), ohne Fenster")
+@click.option('--density', is_flag=True, help="Liniendichte als Rasterbild statt einzelner Kanten (für landesweite Netze)")
+@click.option('--dpi', default=300, help="Auflösung beim Speichern (PNG und gerasterte Teile im SVG)")
 @click.argument('graph-pkl-file-path')
 @click.pass_context
-def plot_ptc4gtfs(ctx, save, graph_pkl_file_path):
+def plot_ptc4gtfs(ctx, save, output, density, dpi, graph_pkl_file_path):
+    from . import model
+    from . import plot as pl
     db = get_db(ctx)
     # Graph laden
     path = Path(graph_pkl_file_path).expanduser().resolve()
@@ -79,24 +122,38 @@ def plot_ptc4gtfs(ctx, save, graph_pkl_file_path):
     if not gtfs_graph:    
         logger.fatal(f"Graph couldn't be loaded because graph.pkl not exists for {path}")
         return
-    if save:
-        pl.plot_graph(db, gtfs_graph, export_path="plot.svg")
-    else: 
-        pl.plot_graph(db, gtfs_graph)
+    if save and not output:
+        output = "plot.svg"
+    pl.plot_graph(db, gtfs_graph, export_path=output, density=density, dpi=dpi)
 
 # Findet den kürzesten Pfad zwischen zwei Haltestellen und plottet ihn optional
 @cli.command('find-shortes-path')
+@click.option("--departure", "-t", default=None, help="Abfahrtszeit als HH:MM (heute) oder ISO-Zeitstempel, Standard: jetzt")
+@click.option("--arrive-by", "-a", default=None, help="Späteste Ankunft als HH:MM (heute) oder ISO-Zeitstempel; sucht die späteste passende Abfahrt")
 @click.option('-p', '--plot', is_flag=True)
 @click.option('-ps', '--plot-save', is_flag=True)
+@click.option('--profile', is_flag=True, help="Messwerte der Suche ausgeben (Knoten, Kanten, Heap, Lookups, DB-Aufrufe, Zeiten)")
+@click.option('--contracted', is_flag=True, help="Stationen als Routing-Einheit (Umstiege ohne Teleport-Kanten im Heap)")
+@click.option('--realtime', default=None, help="GTFS-Realtime TripUpdates (Datei .pb/.json oder HTTP-URL) vor der Suche übernehmen")
+@click.option('--bidirectional', is_flag=True, help="Vorwärtssuche mit unteren Schranken vom Ziel, endet am Ziel (nicht mit --contracted)")
+@click.option('--exclude-mode', '-x', multiple=True, help="Verkehrsmittel ausschließen, z.B. bus oder tram (kann mehrfach angegeben werden)")
 @click.argument('stop_a_id')
 @click.argument('stop_b_id')
 @click.argument('graph-pkl-file-path')
 @click.pass_context
-def find_shortes_path(ctx, plot, plot_save, stop_a_id, stop_b_id, graph_pkl_file_path):
+def find_shortes_path(ctx, departure, arrive_by, plot, plot_save, profile, contracted, realtime, bidirectional, exclude_mode, stop_a_id, stop_b_id, graph_pkl_file_path):
+    from . import db as gtfs_db
+    from . import model
+    from . import ptc
+    if contracted and bidirectional:
+        raise click.UsageError("--contracted und --bidirectional können nicht kombiniert werden")
+    try:
+        excluded_route_types = [gtfs_db.str_conv_route_type(mode) for mode in exclude_mode]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--exclude-mode")
     db = get_db(ctx)
-    db.create_departures_today()
-    stop_a_id = int(stop_a_id)
-    stop_b_id = int(stop_b_id)
+    departure_time = utils.parse_departure_time(departure, tz=db.get_agency_timezone()) if departure else None
+    stop_a_id, stop_b_id = encode_ids(db, IdKind.STOP, [stop_a_id, stop_b_id], "STOP_A_ID/STOP_B_ID")
     # Graph laden
     path = Path(graph_pkl_file_path).expanduser().resolve()
     gtfs_graph = model.load_networkx_ptc4gtfs_graph(path)
@@ -104,26 +161,141 @@ def find_shortes_path(ctx, plot, plot_save, stop_a_id, stop_b_id, graph_pkl_file
     if not gtfs_graph:    
         logger.fatal(f"Graph couldn't be loaded because graph.pkl not exists for {path}")
         return
-    result = ptc.find_path_in_ptc4gtfs_graph(db, stop_a_id, stop_b_id, gtfs_graph)
+    arrival_time = utils.parse_departure_time(arrive_by, tz=db.get_agency_timezone()) if arrive_by else None
+    departures = None
+    if realtime:
+        # Abfahrtsindex des Betriebstages mit den Verspätungen und Ausfällen aus dem Echtzeit-Feed
+        from .realtime import RealtimeDepartures
+        search_time = utils.resolve_departure_time(arrival_time or departure_time, db.get_agency_timezone())
+        realtime_departures = RealtimeDepartures.from_db(db, search_time.date())
+        update = realtime_departures.refresh(realtime)
+        if update:
+            logger.info("Echtzeit: %d Trips, %d Abfahrten geändert", update["trip_updates"], update["changed_entries"])
+        departures = realtime_departures.departures
+    if arrive_by:
+        # Rückwärtssuche vom Ziel statt vieler Vorwärtssuchen mit verschiedenen Abfahrtszeiten
+        result = ptc.find_path_arrive_by_in_ptc4gtfs_graph(db, stop_a_id, stop_b_id, gtfs_graph, arrival_time, departures, excluded_route_types=excluded_route_types)
+    else:
+        result = ptc.find_path_in_ptc4gtfs_graph(db, stop_a_id, stop_b_id, gtfs_graph, departure_time, departures, contracted=contracted, bidirectional=bidirectional, excluded_route_types=excluded_route_types)
     if result:
         distances, predecessors, arrival_times, path = result
+        if profile:
+            click.echo(result.stats.format_table())
         if plot or plot_save:
+            from . import plot as pl
             if plot_save:
-                pl.plot_path_only_from_predecessors_networkx_ptc4gtfs_graph(db, arrival_times, predecessors, stop_a_id, stop_b_id, "plot.svg")
+                pl.plot_path_only_from_predecessors_networkx_ptc4gtfs_graph(db, arrival_times, predecessors, stop_a_id, stop_b_id, export_path="plot.svg")
             else:
                 pl.plot_path_only_from_predecessors_networkx_ptc4gtfs_graph(db, arrival_times, predecessors, stop_a_id, stop_b_id)    
 
+# Zeigt die nächsten Abfahrten an einer Station (alle Steige) aus dem Abfahrtsindex
+@cli.command('departures')
+@click.option("--departure", "-t", default=None, help="Ab Zeitpunkt HH:MM (heute) oder ISO-Zeitstempel, Standard: jetzt")
+@click.option("-n", "count", default=10, help="Anzahl Abfahrten")
+@click.argument('stop_id')
+@click.pass_context
+def departures(ctx, departure, count, stop_id):
+    """Zeigt die nächsten Abfahrten an einer Station."""
+    from . import ptc
+    db = get_db(ctx)
+    departure_time = utils.parse_departure_time(departure, tz=db.get_agency_timezone()) if departure else None
+    code = db.get_id_dictionary().encode(IdKind.STOP, stop_id)
+    if code is None or not db.get_station_platforms(code):
+        raise click.ClickException(f"Unbekannte Station {stop_id}")
+    for entry in ptc.departure_board(db, code, departure_time, count):
+        platform = f" Steig {entry['platform_code']}" if entry["platform_code"] else ""
+        click.echo(f"{entry['departure_time']:%H:%M}  {entry['route_name'] or entry['route_id']:<10} {entry['stop_name']}{platform}")
+
+# Zeigt Kennzahlen des Tagesfahrplans pro Fahrtmuster, optional die Halte eines Trips
+@cli.command('timetable')
+@click.option("--date", "service_date", default=None, help="Betriebstag als YYYYMMDD (Standard: heute in der Agentur-Zeitzone)")
+@click.option("--trip", "trip_id", default=None, help="Ankunft und Abfahrt dieses Trips an allen Halten ausgeben")
+@click.pass_context
+def timetable(ctx, service_date, trip_id):
+    """Tagesfahrplan als Fahrtmuster (Haltfolge + Offsets, Startzeiten, Takt-Läufe)."""
+    from .timetable import PatternTimetable
+    db = get_db(ctx)
+    service_date = datetime.strptime(service_date, "%Y%m%d").date() if service_date else db.get_service_date_today()
+    pattern_timetable = PatternTimetable.from_db(db, service_date)
+    stats = pattern_timetable.stats()
+    click.echo(f"{service_date}: {stats['trips']} Trips, {stats['stop_events']} Halte in {stats['patterns']} Mustern, "
+               f"{stats['runs']} Läufe, {stats['bytes'] / 2**20:.1f} MiB")
+    if trip_id is None:
+        return
+    ids = db.get_id_dictionary()
+    stop_times = pattern_timetable.stop_times(encode_ids(db, IdKind.TRIP, [trip_id], "--trip")[0])
+    if not stop_times:
+        raise click.ClickException(f"Trip {trip_id} fährt am {service_date} nicht")
+    names = {stop_id: stop['stop_name'] for stop_id, stop in db.get_stops_by_ids([stop_id for stop_id, _, _ in stop_times]).items()}
+    for stop_id, arrival, departure in stop_times:
+        click.echo(f"{utils.format_gtfs_time(arrival)}  {utils.format_gtfs_time(departure)}  {ids.decode(IdKind.STOP, stop_id):<12} {names.get(stop_id, '')}")
+
 # Generiert einen GTFS-Graphen, optional gefiltert nach RouteIDs und Typen
 @cli.command('generate-graph')
 @click.option("--route-ids", "-r", multiple=True, help="Filtere nach bestimmten RouteIDs (kann mehrfach angegeben werden)")
 @click.option("--route-type", "-rt", multiple=True, help="Filtere nach bestimmten RouteIDs (kann mehrfach angegeben werden)")
+@click.option("--incremental", "-i", is_flag=True, help="Vorhandenen Graphen nur für geänderte Routen aktualisieren (Filter aus dem Graphen)")
+@click.option("--output", "-o", default="ptc4gtfs_graph.pkl", help="Graph-Datei (Standard: ptc4gtfs_graph.pkl)")
 @click.pass_context
-def generate_graph(ctx, route_ids, route_type):
+def generate_graph(ctx, route_ids, route_type, incremental, output):
+    from . import db as gtfs_db
+    from . import model
     db = get_db(ctx)
+    if incremental:
+        model.update_ptc4gtfs_graph(db, output)
+        return
     route_types = []
     for rt in route_type:
         route_types.append(gtfs_db.str_conv_route_type(rt))
-    model.generate_ptc4gtfs_graph(db, route_ids, route_types)
+    route_ids = encode_ids(db, IdKind.ROUTE, route_ids, "--route-ids")
+    model.generate_ptc4gtfs_graph(db, route_ids, route_types, output)
+
+# Fasst doppelte Kanten eines gespeicherten Graphen zusammen
+@cli.command('compact-graph')
+@click.option("--output", "-o", default=None, help="Zieldatei (Standard: Graph-Datei überschreiben)")
+@click.argument('graph-pkl-file-path')
+def compact_graph(output, graph_pkl_file_path):
+    """Doppelte Teleport-Kanten und parallele Transit-Kanten derselben Route zusammenfassen."""
+    from . import model
+    path = Path(graph_pkl_file_path).expanduser().resolve()
+    gtfs_graph = model.load_networkx_ptc4gtfs_graph(path)
+    if not gtfs_graph:
+        logger.fatal(f"Graph couldn't be loaded because graph.pkl not exists for {path}")
+        return
+    edges_before, edges_after = model.compact_ptc4gtfs_graph(gtfs_graph)
+    model.serialize_networkx_graph(gtfs_graph, output or path)
+    click.echo(f"Kanten vorher: {edges_before}, nachher: {edges_after} ({edges_before - edges_after} entfernt) -> {output or path}")
+
+# Berechnet eine Reisezeitmatrix zwischen allen Parent-Stationen (oder ausgewählten Stops)
+@cli.command('travel-time-matrix')
+@click.option("--departure", "-t", default=None, help="Abfahrtszeit als HH:MM (heute) oder ISO-Zeitstempel, Standard: jetzt")
+@click.option("--stop-ids", "-s", multiple=True, help="Nur diese Stop-IDs als Start und Ziel (kann mehrfach angegeben werden)")
+@click.option("--output", "-o", default="travel_time_matrix.npy", help="Zieldatei der Matrix (.npy, uint32 Sekunden)")
+@click.option("--workers", "-w", type=int, default=None, help="Anzahl Worker-Prozesse (Standard: alle CPUs)")
+@click.option("--no-resume", is_flag=True, help="Vorhandene Teilergebnisse verwerfen und neu beginnen")
+@click.argument('graph-pkl-file-path')
+@click.pass_context
+def travel_time_matrix(ctx, departure, stop_ids, output, workers, no_resume, graph_pkl_file_path):
+    from . import model
+    from . import ptc
+    db = get_db(ctx)
+    # Graph laden
+    path = Path(graph_pkl_file_path).expanduser().resolve()
+    gtfs_graph = model.load_networkx_ptc4gtfs_graph(path)
+    if not gtfs_graph:
+        logger.fatal(f"Graph couldn't be loaded because graph.pkl not exists for {path}")
+        return
+    departure_time = utils.parse_departure_time(departure, tz=db.get_agency_timezone()) if departure else None
+    ptc.compute_travel_time_matrix(
+        db,
+        gtfs_graph,
+        output,
+        departure_time=departure_time,
+        stop_ids=encode_ids(db, IdKind.STOP, stop_ids, "--stop-ids") if stop_ids else None,
+        workers=workers,
+        resume=not no_resume
+    )
+    click.echo(f"Reisezeitmatrix gespeichert: {output}")
 
 # Lädt und filtert GTFS-Daten, optional nach Routen und Agenturen
 @cli.command('download-filter-gtfs')
@@ -135,6 +307,7 @@ def generate_graph(ctx, route_ids, route_type):
 @click.argument('agencies', nargs=-1, required=True)
 @click.pass_context
 def parser_cli(ctx, directory, route_ids, url, no_departures, no_cleanup, agencies):
+    from . import parser
     # Zielverzeichnis und Agenturen verarbeiten
     path = Path(directory).expanduser().resolve()
     target_dir_path = path 
@@ -0,0 +1,106 @@
+import importlib.util
+import logging
+import os
+import shutil
+from datetime import date
+from . import utils
+
+# pyarrow ist optional: ohne pyarrow bleibt es bei SQLite für alle Zugriffe.
+# Geladen wird es erst mit dem ersten ColumnarStore (Importzeit der CLI).
+pa = None
+pq = None
+
+logger = logging.getLogger(__name__)
+
+# Endung des Parquet-Ordners neben der Datenbankdatei (gtfs.db -> gtfs.db.parquet/)
+COLUMNAR_SUFFIX = ".parquet"
+
+def default_columnar_dir(db_path):
+    return f"{db_path}{COLUMNAR_SUFFIX}"
+
+def is_available():
+    return pa is not None or importlib.util.find_spec("pyarrow") is not None
+
+def _load_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+class ColumnarStore:
+    """
+    Spaltenorientierte Ablage der GTFS-Tabellen als Parquet-Dateien (eine Datei pro Tabelle).
+    Für Full-Table-Scans (Graph-Aufbau, Abfahrtsindex) gedacht; Punktabfragen bleiben in SQLite.
+    Dateien werden per Memory-Map gelesen, numerische Spalten ohne Kopie nach numpy/pandas übernommen.
+    """
+
+    def __init__(self, directory):
+        if not _load_pyarrow():
+            raise ImportError("pyarrow ist nicht installiert (pip install pyarrow)")
+        self.directory = str(directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.parquet")
+
+    def has_table(self, name):
+        return os.path.exists(self.path(name))
+
+    def write_table(self, name, df: "pd.DataFrame"):
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # Erst in temporäre Datei schreiben, damit Leser nie eine halbe Datei sehen
+        tmp_path = self.path(name) + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.path(name))
+        logger.debug(f"{name}.parquet geschrieben: {table.num_rows} Zeilen")
+
+    def write_feed(self, frames):
+        # Schreibt alle Tabellen eines eingelesenen Feeds (Tabellenname -> DataFrame)
+        for name, df in frames.items():
+            self.write_table(name, df)
+        self._remove_departures_today()
+        logger.info(f"{utils.GREEN}Spaltenablage geschrieben: {self.directory} ({len(frames)} Tabellen){utils.RESET}")
+
+    def read_arrow(self, name, columns=None, filters=None):
+        return pq.read_table(self.path(name), columns=columns, filters=filters, memory_map=True)
+
+    def read_frame(self, name, columns=None, filters=None):
+        # split_blocks/self_destruct: Spalten einzeln übernehmen statt in einen gemeinsamen Block zu kopieren
+        return self.read_arrow(name, columns, filters).to_pandas(split_blocks=True, self_destruct=True)
+
+    def remove(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+    def departures_today_frame(self, service_date: date, active_services):
+        """
+        Abfahrten eines Betriebstages aus departures/trips, gleiche Logik wie GTFSDatabase.create_departures_today.
+        active_services: an service_date aktive service_ids (ServiceCalendar.active_services).
+        Ergebnis wird pro Betriebstag als Parquet zwischengespeichert.
+        """
+        cache_name = f"departures_today_{service_date.strftime('%Y%m%d')}"
+        if self.has_table(cache_name):
+            return self.read_frame(cache_name)
+
+        active = set(active_services)
+        trips = self.read_frame('trips', columns=['trip_id', 'service_id'])
+        trips = trips[trips['service_id'].isin(active)]
+        departures = self.read_frame('departures').merge(trips, on='trip_id', how='inner')
+
+        # Es wird immer nur ein Betriebstag benötigt
+        self._remove_departures_today()
+        self.write_table(cache_name, departures)
+        return departures
+
+    def _remove_departures_today(self):
+        # Zwischengespeicherte Tagesabfahrten löschen (neuer Betriebstag oder geänderter Feed)
+        if not os.path.isdir(self.directory):
+            return
+        for file in os.listdir(self.directory):
+            if file.startswith("departures_today_") and file.endswith(".parquet"):
+                os.remove(os.path.join(self.directory, file))
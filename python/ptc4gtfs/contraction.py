@@ -0,0 +1,75 @@
+import logging
+import weakref
+from collections import defaultdict
+import networkx as nx
+from .model import EdgeAttr, EdgeType, GRAPH_MODE_MASKS
+
+logger = logging.getLogger(__name__)
+
+# Umstiegszeit (Sekunden) zwischen zwei Plattformen derselben Station. 0 entspricht den
+# Teleport-Kanten des Graphen und liefert dieselben Ergebnisse wie die Suche ohne Kontraktion.
+TRANSFER_SECONDS = 0
+
+class ContractedGraph:
+    """
+    Stationen als Routing-Einheit: Station und Plattformen, die über Teleport-Kanten verbunden sind,
+    bilden eine Einheit. Die Suche (dijkstra.dijkstra_ptc4gtfs_contracted) legt Umstiege innerhalb einer
+    Einheit nicht mehr über den Heap, sondern behandelt sie direkt beim Abarbeiten einer Plattform
+    mit der Umstiegszeit transfer_seconds. Vorgänger werden weiterhin auf Plattform-Ebene gespeichert,
+    sodass Pfadrekonstruktion und Ausgabe unverändert bleiben.
+    """
+
+    def __init__(self, graph: nx.MultiDiGraph, transfer_seconds=TRANSFER_SECONDS):
+        self.transfer_seconds = transfer_seconds
+        # node -> [(neighbor, route_id, weight, mode_mask)], Reihenfolge wie im Graphen
+        self.transit = {}
+        # node -> Station (Mittelpunkt der Einheit), node -> alle Knoten der Einheit
+        self.hub = {}
+        self.members = {}
+        teleports = defaultdict(set)
+        for node in graph:
+            edges = []
+            for neighbor, edge_list in graph[node].items():
+                for edge in edge_list.values():
+                    if edge[EdgeAttr.TYPE.value] == EdgeType.TELEPORT.value:
+                        if neighbor != node:
+                            teleports[node].add(neighbor)
+                    elif edge[EdgeAttr.TYPE.value] == EdgeType.TRANSIT.value:
+                        edges.append((neighbor, edge.get(EdgeAttr.ROUTE_ID.value), edge.get(EdgeAttr.WEIGHT.value, 1), edge.get(EdgeAttr.MODE_MASK.value, 0)))
+            self.transit[node] = edges
+
+        # Einheiten = Zusammenhangskomponenten der Teleport-Kanten
+        for node in graph:
+            if node in self.hub:
+                continue
+            unit = [node]
+            seen = {node}
+            for member in unit:
+                for neighbor in teleports[member]:
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        unit.append(neighbor)
+            hub = self._find_hub(unit, teleports)
+            members = tuple(unit)
+            for member in unit:
+                self.hub[member] = hub
+                self.members[member] = members
+        self.edges = graph.number_of_edges()
+        self.mode_masks = bool(graph.graph.get(GRAPH_MODE_MASKS))
+        logger.debug("Kontrahierter Graph: %d Knoten in %d Einheiten", len(self.hub), len({id(m) for m in self.members.values()}))
+
+    def _find_hub(self, unit, teleports):
+        # Station = Knoten ohne eigene Transit-Kanten mit den meisten Teleport-Nachbarn
+        return max(unit, key=lambda node: (not self.transit[node], len(teleports[node])))
+
+# Kontrahierte Darstellung pro Graph-Objekt (wird nur einmal gebaut, verfällt mit dem Graphen)
+_contracted_cache = weakref.WeakKeyDictionary()
+
+def contract(graph: nx.MultiDiGraph, transfer_seconds=TRANSFER_SECONDS):
+    # Gibt die (gecachte) kontrahierte Darstellung von graph zurück; neu gebaut, wenn sich die Kantenzahl geändert hat
+    # oder die Verkehrsmittel-Masken erst nachträglich ergänzt wurden (model.annotate_mode_masks)
+    contracted = _contracted_cache.get(graph)
+    if contracted is None or contracted.transfer_seconds != transfer_seconds or contracted.edges != graph.number_of_edges() or contracted.mode_masks != bool(graph.graph.get(GRAPH_MODE_MASKS)):
+        contracted = ContractedGraph(graph, transfer_seconds)
+        _contracted_cache[graph] = contracted
+    return contracted
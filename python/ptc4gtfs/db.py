@@ -1,13 +1,17 @@
 import os
 import logging
-import pandas as pd
-from sqlalchemy import create_engine, MetaData, select, func, text, bindparam
-from datetime import datetime
+from sqlalchemy import create_engine, MetaData, select, func, text, bindparam, event
+from datetime import datetime, date
+from zoneinfo import ZoneInfo
 from . import utils
+from . import columnar
+from . import stats as query_stats
 from enum import IntEnum
 from enum import StrEnum
 from collections import defaultdict, OrderedDict
-import networkx as nx
+
+# pandas und feed_diff werden erst in den Methoden geladen, die DataFrames brauchen (Feed laden,
+# Bulk-Zugriffe); Punktabfragen und prepare-today kommen so ohne den pandas-Import aus.
 
 # for better and safer db tables properties access
 class TB_StopsAttr(StrEnum):
@@ -101,10 +105,119 @@ def str_conv_route_type(s: str) -> RouteType:
     else:
         raise ValueError(f"Unbekannter RouteType: '{s}'")
 
+# Höchster GTFS-route_type mit eigenem Bit in der Verkehrsmittel-Maske (Basistypen 0-12)
+MAX_MODE_BIT = 63
+
+def route_type_bit(route_type) -> int:
+    """
+    Bit eines GTFS-route_type in der Verkehrsmittel-Maske der Transit-Kanten (1 << route_type).
+    Erweiterte Typen (z.B. 700 = Bus) haben kein eigenes Bit (0) und werden nie ausgeschlossen.
+    """
+    try:
+        route_type = int(route_type)
+    except (TypeError, ValueError):
+        return 0
+    return 1 << route_type if 0 <= route_type <= MAX_MODE_BIT else 0
+
+def route_type_mask(route_types) -> int:
+    # Maske aus mehreren RouteTypes, z.B. der ausgeschlossenen Verkehrsmittel einer Suche
+    mask = 0
+    for route_type in route_types or ():
+        mask |= route_type_bit(route_type)
+    return mask
+
 logger = logging.getLogger(__name__)
 
 CHUNK_SIZE = 100
 
+# Fallback, falls agency.txt keine (gültige) agency_timezone enthält
+DEFAULT_TIMEZONE = "Europe/Berlin"
+
+# Vorbereitete Statements der häufigen Punktabfragen: einmal erzeugt, damit SQLAlchemy die
+# kompilierte Form aus dem Statement-Cache nimmt und sqlite3 das Prepared Statement wiederverwendet
+SQL_TRIP_BY_TRIP_AND_STOP_ID = text("""
+    SELECT * 
+    FROM stop_times
+    WHERE trip_id =:trip_id AND stop_id =:stop_id
+    LIMIT 1;
+""")
+SQL_ROUTE_BY_ID = text("""
+    SELECT * FROM routes
+    WHERE route_id = :route_id;
+""")
+SQL_STOP_BY_ID = text("SELECT * FROM stops WHERE stop_id = :stop_id LIMIT 1")
+# Gebündelte Abfragen für viele IDs auf einmal (z.B. alle Haltestellen eines Pfades)
+SQL_STOPS_BY_IDS = text("SELECT * FROM stops WHERE stop_id IN :stop_ids").bindparams(bindparam("stop_ids", expanding=True))
+SQL_ROUTES_BY_IDS = text("SELECT * FROM routes WHERE route_id IN :route_ids").bindparams(bindparam("route_ids", expanding=True))
+# Trips und stop_times der aktiven Services eines Tages; service_ids als Parameter (in Blöcken, siehe _chunks),
+# damit die Abfragen auch auf schreibgeschützten Verbindungen (read_only) laufen
+SQL_TRIPS_OF_SERVICES = text("""
+    SELECT trip_id, route_id, service_id FROM trips
+    WHERE service_id IN :service_ids
+""").bindparams(bindparam("service_ids", expanding=True))
+SQL_STOP_TIMES_OF_SERVICES = text("""
+    SELECT st.trip_id, st.stop_id, st.stop_sequence, st.arrival_time, st.departure_time
+    FROM stop_times st
+    JOIN trips t ON st.trip_id = t.trip_id
+    WHERE t.service_id IN :service_ids
+""").bindparams(bindparam("service_ids", expanding=True))
+SQL_STOP_TIMES_BY_TRIP_IDS = text("""
+    SELECT trip_id, stop_id, arrival_time, departure_time, stop_sequence
+    FROM stop_times
+    WHERE trip_id IN :trip_ids
+    ORDER BY trip_id, stop_sequence
+""").bindparams(bindparam("trip_ids", expanding=True))
+SQL_STOP_TIMES_BY_ROUTE_ID = text("""
+    SELECT st.trip_id, st.stop_id, st.arrival_time, st.departure_time
+    FROM stop_times st
+    JOIN trips t ON st.trip_id = t.trip_id
+    WHERE t.route_id = :route_id
+    ORDER BY st.trip_id, st.stop_sequence
+""")
+SQL_PARENT_STOP_BY_ID = text("""
+    SELECT * FROM stops
+    WHERE stop_id = :parent_stop_id;
+""")
+SQL_CHILD_STOPS = text("""
+    SELECT * FROM stops
+    WHERE parent_station = :parent_station;
+""")
+SQL_ROUTES_FOR_STOP_ID = text("""
+    SELECT DISTINCT trips.route_id
+    FROM stop_times
+    JOIN trips ON stop_times.trip_id = trips.trip_id
+    WHERE stop_times.stop_id = :stop_id
+    ORDER BY trips.route_id
+""")
+SQL_NEXT_DEPARTURE_TODAY = text("""
+    SELECT * FROM departures_today
+    WHERE route_id = :route_id
+      AND stop_id = :stop_id
+      AND departure_time > :current_time
+    ORDER BY departure_time ASC
+    LIMIT 1
+""")
+
+# SQLite-Einstellungen für lesende Last im Serverbetrieb
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024     # Bytes, Datenbankdatei per Memory-Map lesen
+SQLITE_CACHE_SIZE_KIB = 64 * 1024        # Page-Cache pro Verbindung in KiB
+SQLITE_POOL_SIZE = 8                     # offene Verbindungen im Pool (je Prozess)
+SQLITE_CACHED_STATEMENTS = 256           # Prepared-Statement-Cache von sqlite3 pro Verbindung
+
+def configure_sqlite_connection(dbapi_conn, mmap_size=SQLITE_MMAP_SIZE, cache_size_kib=SQLITE_CACHE_SIZE_KIB, read_only=False):
+    # Setzt die PRAGMAs für jede neue Verbindung im Pool
+    cursor = dbapi_conn.cursor()
+    # WAL: Leser blockieren sich nicht gegenseitig und nicht durch einen Schreiber
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    # Negativer Wert = Größe in KiB statt in Pages
+    cursor.execute(f"PRAGMA cache_size=-{int(cache_size_kib)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
 class GTFSFileType(StrEnum):
     AGENCY_FILE = "agency.txt"
     ROUTES_FILE = "routes.txt"
@@ -122,33 +235,88 @@ files = [
     'stops.txt', 'calendar.txt', 'calendar_dates.txt', 'departures.txt'
 ]
 
+# Tabellen, deren Zeilen an einer Route hängen und bei update_gtfs_feed pro Route ersetzt werden
+ROUTE_SCOPED_TABLES = ['trips', 'stop_times', 'departures']
+# Kleine Tabellen, die bei update_gtfs_feed zeilenweise über ihren Schlüssel abgeglichen werden
+UPSERT_KEYS = {'agency': 'agency_id', 'routes': 'route_id', 'stops': 'stop_id', 'calendar': 'service_id'}
+# Höchstzahl gebundener Parameter pro IN-Abfrage (SQLite-Limit älterer Versionen: 999)
+SQLITE_MAX_IN_PARAMS = 900
+
+def read_gtfs_feed(gtfs_dir):
+    # Liest alle bekannten GTFS-Dateien eines Ordners, Ergebnis als Tabellenname -> DataFrame.
+    # ID-Spalten immer als Strings (sonst z.B. parent_station als float), Codes vergibt ids.IdDictionary.
+    import pandas as pd
+    from .ids import ID_COLUMNS
+    frames = {}
+    for file in files:
+        file_path = os.path.join(gtfs_dir, file)
+        table_name = os.path.splitext(file)[0]
+        if os.path.exists(file_path):
+            frames[table_name] = pd.read_csv(file_path, dtype={column: str for column in ID_COLUMNS.get(table_name, {})})
+        else:
+            logger.warning(f"Datei {file} nicht gefunden – übersprungen.")
+    return frames
+
+def _frame_to_records(df: "pd.DataFrame"):
+    # DataFrame-Zeilen als Dicts wie bei SQLite-Abfragen (fehlende Werte als None statt NaN)
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def _chunks(values, size=SQLITE_MAX_IN_PARAMS):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
 class GTFSDatabase:
     """
     Klasse zur Verwaltung einer GTFS-Datenbank (General Transit Feed Specification).
     Bietet Methoden zum Laden, Exportieren, Abfragen und Analysieren von GTFS-Daten.
     """
 
-    def __init__(self, db_url):
+    def __init__(self, db_url, tuned=True, read_only=False, pool_size=SQLITE_POOL_SIZE, mmap_size=SQLITE_MMAP_SIZE, cache_size_kib=SQLITE_CACHE_SIZE_KIB, columnar_dir=None):
         """
         Initialisiert die GTFS-Datenbank mit gegebener Verbindungs-URL.
 
         :param db_url: Datenbank-URL (z. B. sqlite:///gtfs.db)
+        :param tuned: Bei SQLite Verbindungspool mit WAL, mmap und großem Page-Cache verwenden
+                      (False = SQLAlchemy-Standard, z. B. für Vergleichsmessungen)
+        :param read_only: Verbindungen nur lesend öffnen (PRAGMA query_only), z. B. für Serverprozesse
+        :param pool_size: Anzahl gepoolter Verbindungen; die Instanz ist über Threads hinweg nutzbar
+        :param mmap_size: PRAGMA mmap_size in Bytes
+        :param cache_size_kib: PRAGMA cache_size in KiB
+        :param columnar_dir: Ordner mit Parquet-Kopien der Tabellen für Bulk-Zugriffe (benötigt pyarrow);
+                             None = alle Zugriffe über SQLite
         """
-        self.engine = create_engine(db_url)
+        if tuned and db_url.startswith("sqlite"):
+            self.engine = create_engine(
+                db_url,
+                pool_size=pool_size,
+                max_overflow=pool_size,
+                connect_args={"check_same_thread": False, "cached_statements": SQLITE_CACHED_STATEMENTS},
+            )
+            event.listen(
+                self.engine,
+                "connect",
+                lambda dbapi_conn, _: configure_sqlite_connection(dbapi_conn, mmap_size, cache_size_kib, read_only),
+            )
+        else:
+            self.engine = create_engine(db_url)
+        # Jede SQL-Anweisung zählt als DB-Aufruf der gerade laufenden Suche (QueryStats.db_calls)
+        event.listen(self.engine, "before_cursor_execute", lambda *_: query_stats.count_db_call())
         self.metadata = MetaData()
         self.metadata.reflect(bind=self.engine)
         self.tables = {name: table for name, table in self.metadata.tables.items()}
+        self._agency_timezone = None
+        self._service_calendar = None
+        self._id_dictionary = None
+        # Stammdaten-Cache für Abfahrtstafeln (get_station_platforms, get_route_names)
+        self._station_platforms = {}
+        self._route_names = None
+        self.columnar = columnar.ColumnarStore(columnar_dir) if columnar_dir else None
         logger.debug(f"{utils.UNDERLINE}{utils.YELLOW}GTFSDatabase initialisiert mit URL: {db_url}{utils.RESET}")
 
     # Gibt den Datensatz aus stop_times für eine bestimmte trip_id und stop_id zurück.
     def get_trip_by_trip_id_and_stop_id(self, trip_id, stop_id):
         with self.engine.connect() as conn:
-            query = text("""
-                SELECT * 
-                FROM stop_times
-                WHERE trip_id =:trip_id AND stop_id =:stop_id
-                LIMIT 1;
-            """)
+            query = SQL_TRIP_BY_TRIP_AND_STOP_ID
             result =  conn.execute(query, {
                 TB_StopTimesAttr.TRIP_ID.value: int(trip_id), 
                 TB_StopTimesAttr.STOP_ID.value: int(stop_id)
@@ -167,18 +335,16 @@ class GTFSDatabase:
             results =  conn.execute(query, {TB_RoutesAttr.ROUTE_TYPE.value: route_type.value}).fetchall()
             return [dict(row._mapping) for row in results if row is not None] 
 
-    # Gibt den Datensatz aus stop_times für eine bestimmte stop_id und route_id zurück.
+    # Gibt den Datensatz aus stop_times für eine bestimmte stop_id und route_id zurück
+    # (erster Trip der Route nach trip_id, der dort hält; unabhängig von der Zeilenreihenfolge).
     def get_trip_stop_by_stop_and_route_id(self, stop_id, route_id):
         with self.engine.connect() as conn:
             query = text("""
-                SELECT * 
-                FROM stop_times
-                WHERE trip_id = (
-                    SELECT trip_id
-                    FROM routes
-                    WHERE route_id =:route_id
-                    LIMIT 1
-                ) AND stop_id =:stop_id
+                SELECT st.*
+                FROM stop_times st
+                JOIN trips t ON st.trip_id = t.trip_id
+                WHERE t.route_id =:route_id AND st.stop_id =:stop_id
+                ORDER BY st.trip_id, st.stop_sequence
                 LIMIT 1;
             """)
             result =  conn.execute(query, {TB_RoutesAttr.ROUTE_ID.value: int(route_id), TB_StopTimesAttr.STOP_ID.value: int(stop_id)}).fetchone()
@@ -186,13 +352,24 @@ class GTFSDatabase:
                 return None
             return dict(result._mapping)
 
+    # Gibt die Halte aller Trips einer Route als trip_id -> [(stop_id, Ankunft, Abfahrt)] in Haltfolge zurück
+    # (Zeiten in GTFS-Sekunden, fehlende Zeit = die andere; Grundlage der Kantengewichte im Graphen).
+    def get_route_trip_stop_times(self, route_id):
+        with self.engine.connect() as conn:
+            rows = conn.execute(SQL_STOP_TIMES_BY_ROUTE_ID, {"route_id": int(route_id)}).fetchall()
+        trip_stop_times = defaultdict(list)
+        for trip_id, stop_id, arrival_time, departure_time in rows:
+            arrival = utils.parse_gtfs_time(arrival_time) if arrival_time else None
+            departure = utils.parse_gtfs_time(departure_time) if departure_time else None
+            if arrival is None and departure is None:
+                continue
+            trip_stop_times[trip_id].append((stop_id, arrival if arrival is not None else departure, departure if departure is not None else arrival))
+        return dict(trip_stop_times)
+
     # Gibt die Routendetails für eine bestimmte route_id zurück.
     def get_route_by_id(self, route_id):
         with self.engine.connect() as conn:
-            query = text("""
-                SELECT * FROM routes
-                WHERE route_id = :route_id;
-            """)
+            query = SQL_ROUTE_BY_ID
             result =  conn.execute(query, {TB_RoutesAttr.ROUTE_ID.value: int(route_id)}).fetchone()
             return dict(result._mapping) if result else None   
 
@@ -206,8 +383,18 @@ class GTFSDatabase:
             results =  conn.execute(query, {TB_TripsAttr.ROUTE_ID.value: int(route_id)}).fetchall()
             return [dict(row._mapping) for row in results if row is not None]        
 
+    # Gibt eine ganze Tabelle als DataFrame zurück, aus der Spaltenablage falls vorhanden.
+    def get_table_frame(self, name, columns=None):
+        if self.columnar and self.columnar.has_table(name):
+            return self.columnar.read_frame(name, columns)
+        import pandas as pd
+        with self.engine.connect() as conn:
+            return pd.read_sql_table(name, conn, columns=columns)
+
     # Gibt alle Haltestellen der Datenbank zurück.
     def get_all_stops(self):
+        if self.columnar and self.columnar.has_table('stops'):
+            return _frame_to_records(self.columnar.read_frame('stops'))
         with self.engine.connect() as conn:
             query = text("""
                 SELECT * FROM stops;
@@ -272,25 +459,21 @@ class GTFSDatabase:
                     logger.warning(f"stop-{stop_id} is already parent station")
                     return stop
                 else:
-                    query = text("""
-                        SELECT * FROM stops
-                        WHERE stop_id = :parent_stop_id;
-                    """)
+                    query = SQL_PARENT_STOP_BY_ID
                     result =  conn.execute(query, {"parent_stop_id": int(stop['parent_station'])}).fetchone()
             return dict(result._mapping) if result else None     
 
     # Gibt alle Child-Stops für eine parent_station_id zurück.
-    def get_all_child_stops(self, parent_station_id: float):
+    def get_all_child_stops(self, parent_station_id: int):
         with self.engine.connect() as conn:
-            query = text("""
-                SELECT * FROM stops
-                WHERE parent_station = :parent_station;
-            """)
+            query = SQL_CHILD_STOPS
             results =  conn.execute(query, {"parent_station": parent_station_id}).fetchall()
             return [dict(row._mapping) for row in results if row is not None]
 
     # Gibt alle Routen der Datenbank zurück.
     def get_all_routes(self):
+        if self.columnar and self.columnar.has_table('routes'):
+            return _frame_to_records(self.columnar.read_frame('routes'))
         with self.engine.connect() as conn:
             query = text("""
                 SELECT * FROM routes
@@ -313,38 +496,278 @@ class GTFSDatabase:
 
     # Lädt GTFS-Daten aus Textdateien in die Datenbank.
     def load_gtfs_feed(self, gtfs_dir):
+        from .ids import IdDictionary
+        frames = self._encode_ids(read_gtfs_feed(gtfs_dir), IdDictionary.from_frames)
         with self.engine.connect() as conn:
-            for file in files:
-                file_path = os.path.join(gtfs_dir, file)
-                if os.path.exists(file_path):
-                    df = pd.read_csv(file_path)
-                    table_name = os.path.splitext(file)[0]
-                    df.to_sql(table_name, conn, if_exists='replace', index=False)
-                    logger.info(f"{file} erfolgreich geladen.")
-                else:
-                    logger.warning(f"Datei {file} nicht gefunden – übersprungen.")
-    
-       # Gibt ein SQLAlchemy-Tabellenobjekt zurück.
+            for table_name, df in frames.items():
+                df.to_sql(table_name, conn, if_exists='replace', index=False)
+                logger.info(f"{table_name}.txt erfolgreich geladen.")
+        if self.columnar:
+            self.columnar.write_feed(frames)
+        self._store_route_hashes(frames)
+        self._store_service_days()
+        self._clear_metadata_cache()
+        self._reflect()
+
+    # Aktualisiert die Datenbank inkrementell aus einem neuen Feed: nur Routen, deren Inhalts-Hash
+    # (Route, Trips, stop_times) sich geändert hat, werden ersetzt; übrige Tabellen zeilenweise abgeglichen.
+    # Gibt (neue, entfernte, geänderte) route_ids zurück.
+    def update_gtfs_feed(self, gtfs_dir):
+        from . import feed_diff
+        old_hashes = self.get_route_hashes()
+        # Bestehende Codes bleiben, neue IDs bekommen neue Codes (Hashes unveränderter Routen bleiben gleich)
+        frames = self._encode_ids(read_gtfs_feed(gtfs_dir), self.get_id_dictionary().extended)
+        if not old_hashes or not {'routes', 'trips', 'stop_times'} <= set(frames):
+            logger.warning(f"{utils.YELLOW}Keine Routen-Hashes in der Datenbank, Feed wird vollständig geladen{utils.RESET}")
+            self.load_gtfs_feed(gtfs_dir)
+            return set(self.get_route_hashes()), set(), set()
+
+        new_hashes = feed_diff.route_content_hashes(frames['routes'], frames['trips'], frames['stop_times'])
+        added, removed, changed = feed_diff.diff_route_hashes(old_hashes, new_hashes)
+        changed_tables = self._tables_with_changed_columns({name: frames[name] for name in ROUTE_SCOPED_TABLES if name in frames})
+        if changed_tables:
+            logger.warning(f"{utils.YELLOW}Spalten geändert ({', '.join(changed_tables)}), Feed wird vollständig geladen{utils.RESET}")
+            self.load_gtfs_feed(gtfs_dir)
+            return added, removed, changed
+        logger.info(f"Feed-Vergleich: {len(added)} neue, {len(removed)} entfernte, {len(changed)} geänderte Routen von {len(new_hashes)}")
+        dirty_routes = list(added | removed | changed)
+        fresh_routes = added | changed
+
+        with self.engine.begin() as conn:
+            # Tabellen, die an Routen hängen: alte Zeilen der betroffenen Routen raus, neue rein
+            if dirty_routes:
+                old_trip_ids = [
+                    row[0] for chunk in _chunks(dirty_routes)
+                    for row in conn.execute(text("SELECT trip_id FROM trips WHERE route_id IN :ids").bindparams(bindparam("ids", expanding=True)), {"ids": chunk})
+                ]
+                trips = frames['trips']
+                new_trips = trips[trips['route_id'].isin(fresh_routes)]
+                stop_times = frames['stop_times']
+                self._replace_rows(conn, 'stop_times', 'trip_id', old_trip_ids, stop_times[stop_times['trip_id'].isin(set(new_trips['trip_id']))])
+                self._replace_rows(conn, 'trips', 'route_id', dirty_routes, new_trips)
+                if 'departures' in frames:
+                    departures = frames['departures']
+                    self._replace_rows(conn, 'departures', 'route_id', dirty_routes, departures[departures['route_id'].isin(fresh_routes)])
+            # Kleine Tabellen über ihren Schlüssel abgleichen
+            for table_name, key in UPSERT_KEYS.items():
+                if table_name in frames:
+                    self._upsert_changed_rows(conn, table_name, key, frames[table_name])
+            if 'calendar_dates' in frames:
+                frames['calendar_dates'].to_sql('calendar_dates', conn, if_exists='replace', index=False)
+            # departures_today beim nächsten Zugriff neu erstellen
+            conn.execute(text("DROP TABLE IF EXISTS departures_today_info"))
+        if self.columnar:
+            # Parquet-Dateien werden immer ganz geschrieben
+            self.columnar.write_feed(frames)
+        self._store_route_hashes(frames, new_hashes)
+        self._store_service_days()
+        self._clear_metadata_cache()
+        self._reflect()
+        return added, removed, changed
+
+    # Ersetzt alle Zeilen mit column IN values durch die Zeilen aus df.
+    def _replace_rows(self, conn, table_name, column, values, df):
+        for chunk in _chunks(list(values)):
+            conn.execute(
+                text(f"DELETE FROM {table_name} WHERE {column} IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": [v.item() if hasattr(v, 'item') else v for v in chunk]},
+            )
+        if not df.empty:
+            df.to_sql(table_name, conn, if_exists='append', index=False)
+        logger.debug(f"{table_name}: {len(df)} Zeilen für {len(values)} Schlüssel ersetzt")
+
+    # Gibt die Tabellen zurück, deren Spalten im Feed anders sind als in der Datenbank.
+    def _tables_with_changed_columns(self, frames):
+        changed = []
+        with self.engine.connect() as conn:
+            for table_name, df in frames.items():
+                existing = [row[1] for row in conn.execute(text(f"PRAGMA table_info({table_name})"))]
+                if set(existing) != set(df.columns):
+                    changed.append(table_name)
+        return changed
+
+    # Gleicht eine kleine Tabelle über ihren Schlüssel ab: geänderte/neue Zeilen ersetzen, entfernte löschen.
+    def _upsert_changed_rows(self, conn, table_name, key, df):
+        import pandas as pd
+        try:
+            old = pd.read_sql_table(table_name, conn)
+        except ValueError:
+            old = None
+        if old is None or set(old.columns) != set(df.columns):
+            df.to_sql(table_name, conn, if_exists='replace', index=False)
+            return
+        merged = df.merge(old[df.columns], how='left', indicator=True)
+        changed_rows = df[(merged['_merge'] == 'left_only').to_numpy()]
+        removed_keys = set(old[key]) - set(df[key])
+        dirty_keys = set(changed_rows[key]) | removed_keys
+        if dirty_keys:
+            self._replace_rows(conn, table_name, key, dirty_keys, changed_rows)
+            logger.info(f"{table_name}: {len(changed_rows)} Zeilen aktualisiert, {len(removed_keys)} entfernt")
+
+    # Vergibt die ID-Codes (build: frames -> IdDictionary), speichert das Wörterbuch (Tabelle id_map)
+    # und gibt die Tabellen mit Codes statt GTFS-IDs zurück.
+    def _encode_ids(self, frames, build):
+        import pandas as pd
+        id_dictionary = build(frames)
+        if not id_dictionary.is_identity:
+            df = pd.DataFrame(id_dictionary.to_records(), columns=["kind", "code", "gtfs_id"])
+            with self.engine.begin() as conn:
+                df.to_sql('id_map', conn, if_exists='replace', index=False)
+            logger.info(f"ID-Wörterbuch: {', '.join(f'{kind}={id_dictionary.size(kind)}' for kind in id_dictionary.gtfs_ids)}")
+        else:
+            logger.warning(f"{utils.YELLOW}Datenbank ohne ID-Wörterbuch (id_map), IDs müssen numerisch sein; init-db legt es an{utils.RESET}")
+        self._id_dictionary = id_dictionary
+        return id_dictionary.encode_frames(frames)
+
+    # Gibt das ID-Wörterbuch (GTFS-ID <-> Code) zurück; ohne Tabelle id_map die Identität.
+    def get_id_dictionary(self):
+        if self._id_dictionary is None:
+            from .ids import IdDictionary
+            try:
+                with self.engine.connect() as conn:
+                    rows = conn.execute(text("SELECT kind, code, gtfs_id FROM id_map")).fetchall()
+                self._id_dictionary = IdDictionary.from_records([dict(row._mapping) for row in rows])
+            except Exception:
+                logger.debug("Keine Tabelle id_map, IDs werden unverändert verwendet")
+                self._id_dictionary = IdDictionary.identity()
+        return self._id_dictionary
+
+    # Speichert die Inhalts-Hashes pro Route (Grundlage für update_gtfs_feed und inkrementelle Graphen).
+    def _store_route_hashes(self, frames, hashes=None):
+        import pandas as pd
+        from . import feed_diff
+        if hashes is None:
+            if not {'routes', 'trips', 'stop_times'} <= set(frames):
+                return
+            hashes = feed_diff.route_content_hashes(frames['routes'], frames['trips'], frames['stop_times'])
+        df = pd.DataFrame({"route_id": list(hashes.keys()), "content_hash": list(hashes.values())})
+        with self.engine.begin() as conn:
+            df.to_sql('route_hashes', conn, if_exists='replace', index=False)
+
+    # Gibt route_id -> Inhalts-Hash zurück (leer, falls die Datenbank ohne Hashes geladen wurde).
+    def get_route_hashes(self):
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(text("SELECT route_id, content_hash FROM route_hashes")).fetchall()
+        except Exception:
+            return {}
+        return {int(route_id): content_hash for route_id, content_hash in rows}
+
+    # Expandiert calendar und calendar_dates einmalig zu Bitsets der Betriebstage (Tabelle service_days).
+    def _store_service_days(self):
+        import pandas as pd
+        service_calendar = self._build_service_calendar()
+        df = pd.DataFrame(service_calendar.to_records(), columns=["service_id", "start_date", "num_days", "bitset"])
+        with self.engine.begin() as conn:
+            df.to_sql('service_days', conn, if_exists='replace', index=False)
+        self._service_calendar = service_calendar
+        logger.info(f"Betriebstage für {len(service_calendar.bits)} Services vorberechnet ({service_calendar.start_date} + {service_calendar.num_days} Tage).")
+
+    def _build_service_calendar(self):
+        import pandas as pd
+        from .service_days import ServiceCalendar
+        frames = {}
+        with self.engine.connect() as conn:
+            for name in ('calendar', 'calendar_dates'):
+                try:
+                    frames[name] = pd.read_sql_query(text(f"SELECT * FROM {name}"), conn)
+                except Exception:
+                    frames[name] = None
+        return ServiceCalendar.from_frames(frames['calendar'], frames['calendar_dates'])
+
+    # Gibt die Betriebstage aller Services als ServiceCalendar zurück (einmal geladen, danach aus dem Speicher).
+    # Datenbanken ohne Tabelle service_days werden beim ersten Zugriff aus calendar/calendar_dates expandiert.
+    def get_service_calendar(self):
+        if self._service_calendar is None:
+            from .service_days import ServiceCalendar
+            try:
+                with self.engine.connect() as conn:
+                    rows = conn.execute(text("SELECT service_id, start_date, num_days, bitset FROM service_days")).fetchall()
+                self._service_calendar = ServiceCalendar.from_records([dict(row._mapping) for row in rows])
+            except Exception:
+                logger.debug("Keine Tabelle service_days, Betriebstage werden aus calendar/calendar_dates berechnet")
+                self._service_calendar = self._build_service_calendar()
+        return self._service_calendar
+
+    def _reflect(self):
+        self.metadata = MetaData()
+        self.metadata.reflect(bind=self.engine)
+        self.tables = {name: table for name, table in self.metadata.tables.items()}
+
+    # Gibt ein SQLAlchemy-Tabellenobjekt zurück.
     def get_table(self, name):
         return self.tables.get(name)
 
     # Holt Details einer Haltestelle anhand ihrer ID.
     def get_stop_by_id(self, stop_id):
         with self.engine.connect() as conn:
-            query = text("SELECT * FROM stops WHERE stop_id = :stop_id LIMIT 1")
+            query = SQL_STOP_BY_ID
             result = conn.execute(query, {TB_StopsAttr.STOP_ID.value: stop_id}).fetchone()
         return dict(result._mapping) if result else None
 
+    # Holt die Details mehrerer Haltestellen mit einer Abfrage, Ergebnis als stop_id -> Haltestelle.
+    def get_stops_by_ids(self, stop_ids):
+        stop_ids = list({int(stop_id) for stop_id in stop_ids})
+        if not stop_ids:
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(SQL_STOPS_BY_IDS, {"stop_ids": stop_ids}).fetchall()
+        return {int(row._mapping[TB_StopsAttr.STOP_ID.value]): dict(row._mapping) for row in rows}
+
+    # Gibt die Steige einer Station zurück (stop_id, Anzeigename, platform_code); eine Haltestelle ohne
+    # Kinder ist ihr eigener Steig, eine unbekannte hat keine. Pro Station nur einmal aus der Datenbank geladen.
+    def get_station_platforms(self, stop_id):
+        stop_id = int(stop_id)
+        platforms = self._station_platforms.get(stop_id)
+        if platforms is None:
+            stop = self.get_stop_by_id(stop_id)
+            stops = (self.get_all_child_stops(stop_id) or [stop]) if stop else []
+            platforms = [
+                (int(stop[TB_StopsAttr.STOP_ID.value]), stop.get(TB_StopsAttr.STOP_NAME.value), stop.get("platform_code") or None)
+                for stop in stops
+            ]
+            self._station_platforms[stop_id] = platforms
+        return platforms
+
+    # Gibt route_id -> Anzeigename (Kurzname, sonst Langname) aller Routen zurück, einmal geladen.
+    def get_route_names(self):
+        if self._route_names is None:
+            routes = self.get_table('routes')
+            stmt = select(routes.c.route_id, routes.c.route_short_name, routes.c.route_long_name)
+            with self.engine.connect() as conn:
+                rows = conn.execute(stmt).fetchall()
+            self._route_names = {int(route_id): short or long_name for route_id, short, long_name in rows}
+        return self._route_names
+
+    def _clear_metadata_cache(self):
+        self._station_platforms = {}
+        self._route_names = None
+
+    # Holt die Details mehrerer Routen mit einer Abfrage, Ergebnis als route_id -> Route.
+    def get_routes_by_ids(self, route_ids):
+        route_ids = list({int(route_id) for route_id in route_ids})
+        if not route_ids:
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(SQL_ROUTES_BY_IDS, {"route_ids": route_ids}).fetchall()
+        return {int(row._mapping[TB_RoutesAttr.ROUTE_ID.value]): dict(row._mapping) for row in rows}
+
+    # Holt die Halte mehrerer Trips mit einer Abfrage, Ergebnis als trip_id -> Halte sortiert nach stop_sequence.
+    def get_stop_times_by_trip_ids(self, trip_ids):
+        trip_ids = list({int(trip_id) for trip_id in trip_ids})
+        if not trip_ids:
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(SQL_STOP_TIMES_BY_TRIP_IDS, {"trip_ids": trip_ids}).fetchall()
+        stop_times = defaultdict(list)
+        for row in rows:
+            stop_times[int(row._mapping[TB_StopTimesAttr.TRIP_ID.value])].append(dict(row._mapping))
+        return dict(stop_times)
+
     # Gibt alle Routen zurück, die eine bestimmte Haltestelle bedienen.
     def get_routes_for_stop_id(self, stop_id):
         with self.engine.connect() as conn:
-            query = text("""
-                SELECT DISTINCT trips.route_id
-                FROM stop_times
-                JOIN trips ON stop_times.trip_id = trips.trip_id
-                WHERE stop_times.stop_id = :stop_id
-                ORDER BY trips.route_id
-            """)
+            query = SQL_ROUTES_FOR_STOP_ID
             result = conn.execute(query, {TB_StopTimesAttr.STOP_ID.value: stop_id}).fetchall()
         return [row[0] for row in result]
 
@@ -352,7 +775,7 @@ class GTFSDatabase:
     def get_stops_id_by_route_id(self, route_id):
         trips = self.get_table('trips')
         stop_times = self.get_table('stop_times')
-        subq = select(trips.c.trip_id).where(trips.c.route_id == str(route_id))
+        subq = select(trips.c.trip_id).where(trips.c.route_id == int(route_id))
         stmt = select(func.distinct(stop_times.c.stop_id)).where(stop_times.c.trip_id.in_(subq))
         with self.engine.connect() as conn:
             results = sorted([row[0] for row in conn.execute(stmt).fetchall()])
@@ -362,7 +785,7 @@ class GTFSDatabase:
     def get_route_name_by_id(self, route_id):
         routes = self.get_table('routes')
         stmt = select(routes.c.route_short_name, routes.c.route_long_name).where(
-            routes.c.route_id == str(route_id)
+            routes.c.route_id == int(route_id)
         )
         with self.engine.connect() as conn:
             row = conn.execute(stmt).first()
@@ -372,7 +795,7 @@ class GTFSDatabase:
         return short or long_name
 
     # Gibt alle Haltestellen ohne Parent-Station zurück.
-    def get_all_parent_station(self, graph: nx.MultiDiGraph = None):
+    def get_all_parent_station(self, graph: "nx.MultiDiGraph" = None):
         with self.engine.connect() as conn:
             query = text("""
                 SELECT * FROM stops
@@ -392,16 +815,9 @@ class GTFSDatabase:
     # Gibt die nächste Abfahrt für eine Haltestelle und Route heute zurück.
     def get_next_departure_today(self, stop_id, route_id, current_time=None):
         if current_time is None:
-            current_time = datetime.now().strftime("%H:%M:%S")
+            current_time = datetime.now(self.get_agency_timezone()).strftime("%H:%M:%S")
         with self.engine.connect() as conn:
-            query = text("""
-                SELECT * FROM departures_today
-                WHERE route_id = :route_id
-                  AND stop_id = :stop_id
-                  AND departure_time > :current_time
-                ORDER BY departure_time ASC
-                LIMIT 1
-            """)
+            query = SQL_NEXT_DEPARTURE_TODAY
             result = conn.execute(query, {
                 TB_DeparturesTodayAttr.ROUTE_ID.value: route_id,
                 TB_DeparturesTodayAttr.STOP_ID.value: stop_id,
@@ -409,36 +825,113 @@ class GTFSDatabase:
             }).fetchone()
             return dict(result._mapping) if result else None
 
-    # Erstellt die Tabelle departures_today für alle gültigen Abfahrten heute.
-    def create_departures_today(self):
-        today = datetime.now().strftime('%Y%m%d')
-        weekday = datetime.now().strftime('%A').lower()
-        with self.engine.connect() as conn:
+    # Gibt die Zeitzone der (ersten) Agentur als ZoneInfo zurück.
+    def get_agency_timezone(self):
+        if self._agency_timezone is None:
+            tz_name = None
+            try:
+                with self.engine.connect() as conn:
+                    tz_name = conn.execute(text(f"SELECT {TB_AgencyAttr.AGENCY_TIMEZONE.value} FROM agency LIMIT 1")).scalar()
+            except Exception as e:
+                logger.warning(f"agency_timezone konnte nicht gelesen werden: {e}")
+            try:
+                self._agency_timezone = ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+            except Exception:
+                logger.warning(f"Ungültige agency_timezone '{tz_name}', verwende {DEFAULT_TIMEZONE}")
+                self._agency_timezone = ZoneInfo(DEFAULT_TIMEZONE)
+        return self._agency_timezone
+
+    # Gibt den aktuellen Betriebstag in der Agentur-Zeitzone zurück.
+    def get_service_date_today(self):
+        return datetime.now(self.get_agency_timezone()).date()
+
+    # Gibt den Betriebstag zurück, für den departures_today zuletzt erstellt wurde (oder None).
+    def get_departures_today_service_date(self):
+        try:
+            with self.engine.connect() as conn:
+                value = conn.execute(text("SELECT service_date FROM departures_today_info LIMIT 1")).scalar()
+        except Exception:
+            return None
+        return datetime.strptime(str(value), '%Y%m%d').date() if value else None
+
+    # Erstellt die Tabelle departures_today für alle gültigen Abfahrten eines Betriebstages (Standard: heute in der Agentur-Zeitzone).
+    def create_departures_today(self, service_date: date = None):
+        if service_date is None:
+            service_date = self.get_service_date_today()
+        today = service_date.strftime('%Y%m%d')
+        active_services = self.get_service_calendar().active_services(service_date)
+        with self.engine.begin() as conn:
             conn.execute(text("DROP TABLE IF EXISTS departures_today"))
-            conn.execute(text(f"""
+            # Aktive Services aus den Bitsets statt Unterabfragen über calendar/calendar_dates
+            conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS active_services (service_id PRIMARY KEY)"))
+            conn.execute(text("DELETE FROM active_services"))
+            if active_services:
+                conn.execute(text("INSERT INTO active_services (service_id) VALUES (:service_id)"), [{"service_id": service_id} for service_id in active_services])
+            conn.execute(text("""
                 CREATE TABLE departures_today AS
                 SELECT d.*, t.service_id
                 FROM departures d
                 JOIN trips t ON d.trip_id = t.trip_id
-                WHERE t.service_id IN (
-                    SELECT service_id FROM calendar
-                    WHERE {weekday} = 1
-                      AND start_date <= :today
-                      AND end_date >= :today
-                    UNION
-                    SELECT service_id FROM calendar_dates
-                    WHERE date = :today AND exception_type = 1
-                )
-                AND t.service_id NOT IN (
-                    SELECT service_id FROM calendar_dates
-                    WHERE date = :today AND exception_type = 2
-                )
-            """), {"today": int(today)})
+                WHERE t.service_id IN (SELECT service_id FROM temp.active_services)
+            """))
+            conn.execute(text("DROP TABLE temp.active_services"))
             conn.execute(text("CREATE INDEX IF NOT EXISTS idx_dep_today_stop_route_time ON departures_today (stop_id, route_id, departure_time)"))
+            # Betriebstag merken, damit die Tabelle nicht bei jeder Anfrage neu erstellt werden muss
+            conn.execute(text("CREATE TABLE IF NOT EXISTS departures_today_info (service_date INTEGER)"))
+            conn.execute(text("DELETE FROM departures_today_info"))
+            conn.execute(text("INSERT INTO departures_today_info (service_date) VALUES (:today)"), {"today": int(today)})
+        logger.debug(f"departures_today für Betriebstag {today} erstellt")
+
+    # Erstellt departures_today nur, wenn die Tabelle nicht bereits für service_date existiert.
+    # Gibt True zurück, wenn die Tabelle neu erstellt wurde.
+    def ensure_departures_today(self, service_date: date = None):
+        if service_date is None:
+            service_date = self.get_service_date_today()
+        if self.get_departures_today_service_date() == service_date:
+            return False
+        self.create_departures_today(service_date)
+        return True
     
     # Gibt alle Abfahrten aus departures_today zurück.
     def get_all_departures_today(self):
+        if self.columnar:
+            return _frame_to_records(self.get_departures_today_frame())
         with self.engine.connect() as conn:
             query = text("SELECT * FROM departures_today")
             result = conn.execute(query).fetchall()
-        return [dict(row._mapping) for row in result]
\ No newline at end of file
+        return [dict(row._mapping) for row in result]
+
+    # Gibt die Abfahrten des vorbereiteten Betriebstages als DataFrame zurück (Bulk-Zugriff für den Abfahrtsindex).
+    def get_departures_today_frame(self):
+        if self.columnar:
+            service_date = self.get_departures_today_service_date() or self.get_service_date_today()
+            return self.columnar.departures_today_frame(service_date, self.get_service_calendar().active_services(service_date))
+        import pandas as pd
+        with self.engine.connect() as conn:
+            return pd.read_sql_query(text("SELECT * FROM departures_today"), conn)
+
+    # Gibt (trips, stop_times) aller an service_date fahrenden Trips als DataFrames zurück
+    # (Grundlage für timetable.PatternTimetable, mit Ankunfts- und Abfahrtszeiten).
+    def get_service_day_frames(self, service_date: date):
+        import pandas as pd
+        active_services = sorted(self.get_service_calendar().active_services(service_date))
+        trip_columns = [TB_TripsAttr.TRIP_ID.value, TB_TripsAttr.ROUTE_ID.value, TB_TripsAttr.SERVICE_ID.value]
+        stop_time_columns = [
+            TB_StopTimesAttr.TRIP_ID.value, TB_StopTimesAttr.STOP_ID.value, TB_StopTimesAttr.STOP_SEQUENCE.value,
+            TB_StopTimesAttr.ARRIVAL_TIME.value, TB_StopTimesAttr.DEPARTURE_TIME.value,
+        ]
+        if self.columnar and self.columnar.has_table('trips') and self.columnar.has_table('stop_times'):
+            trips = self.columnar.read_frame('trips', columns=trip_columns)
+            trips = trips[trips[TB_TripsAttr.SERVICE_ID.value].isin(active_services)]
+            stop_times = self.columnar.read_frame('stop_times', columns=stop_time_columns)
+            stop_times = stop_times[stop_times[TB_StopTimesAttr.TRIP_ID.value].isin(trips[TB_TripsAttr.TRIP_ID.value])]
+            return trips, stop_times
+        if not active_services:
+            return pd.DataFrame(columns=trip_columns), pd.DataFrame(columns=stop_time_columns)
+        # Nur lesend (keine temporäre Tabelle wie bei create_departures_today): Serverprozesse öffnen die
+        # Datenbank mit read_only und bauen den Index jedes Tages hierüber (DepartureIndex.for_service_date)
+        with self.engine.connect() as conn:
+            chunks = list(_chunks(active_services))
+            trips = pd.concat([pd.read_sql_query(SQL_TRIPS_OF_SERVICES, conn, params={"service_ids": chunk}) for chunk in chunks], ignore_index=True)
+            stop_times = pd.concat([pd.read_sql_query(SQL_STOP_TIMES_OF_SERVICES, conn, params={"service_ids": chunk}) for chunk in chunks], ignore_index=True)
+        return trips, stop_times
@@ -0,0 +1,312 @@
+import heapq
+import logging
+from datetime import timedelta
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from itertools import islice
+import numpy as np
+from . import utils
+from . import db as gtfs_db
+from .timetable import PatternTimetable
+
+logger = logging.getLogger(__name__)
+
+class DepartureIndex:
+    """
+    Abfahrtsindex eines Betriebstages über dem Fahrplan pro Fahrtmuster (timetable.PatternTimetable).
+    Pro (stop_id, route_id) steht nur, in welchen Mustern an welcher Haltposition die Route dort hält; die
+    Abfahrten selbst werden bei jeder Anfrage aus Startzeiten, Takt-Läufen und Offsets der Arrays berechnet.
+    Echtzeit-Änderungen (patched) liegen als kleine Überlagerung darüber. Fahrten des Vortages mit GTFS-Zeiten
+    ab 24:00 kommen als zweite Ebene hinzu (set_previous_day), sonst fehlen sie bei Anfragen kurz nach Mitternacht.
+    Wird einmal aufgebaut und kann von beliebig vielen Suchen (auch in Worker-Prozessen) geteilt werden.
+    """
+
+    def __init__(self, departures_list):
+        # Aus Zeilen im Format von departures_today (Liste von Dicts)
+        columns = ([], [], [], [])
+        for dep in departures_list:
+            columns[0].append(int(dep[gtfs_db.TB_DeparturesTodayAttr.STOP_ID.value]))
+            columns[1].append(int(dep[gtfs_db.TB_DeparturesTodayAttr.ROUTE_ID.value]))
+            columns[2].append(int(dep[gtfs_db.TB_DeparturesTodayAttr.TRIP_ID.value]))
+            columns[3].append(utils.parse_gtfs_time(dep[gtfs_db.TB_DeparturesTodayAttr.DEPARTURE_TIME.value]))
+        self._attach(PatternTimetable.from_departures(*(np.asarray(column, dtype=np.int64) for column in columns)))
+
+    def _attach(self, timetable: PatternTimetable):
+        self.timetable = timetable
+        # (stop_id, route_id) -> ((Muster, Haltposition), ...); bei Ringlinien mehrere Positionen im selben Muster
+        stop_patterns = defaultdict(list)
+        stops = timetable.stops.tolist()
+        stop_ptr = timetable.pattern_stop_ptr.tolist()
+        for pattern, route_id in enumerate(timetable.pattern_routes.tolist()):
+            for position, stop_id in enumerate(stops[stop_ptr[pattern]:stop_ptr[pattern + 1]]):
+                stop_patterns[(stop_id, route_id)].append((pattern, position))
+        self.stop_patterns = {key: tuple(entries) for key, entries in stop_patterns.items()}
+        # Echtzeit-Überlagerung (patched), im reinen Fahrplan leer:
+        # (stop_id, route_id) -> (Zeiten, trip_ids) zusätzlicher Abfahrten, nach Zeit sortiert
+        self._extra = {}
+        # (stop_id, route_id) -> {(dep_seconds, trip_id)} ausgeblendeter Abfahrten des Fahrplans
+        self._masked = {}
+        # (trip_id, stop_id) -> bedient / entfällt, abweichend vom Fahrplan
+        self._served = {}
+        # stop_id -> route_ids, wird bei der ersten Abfahrtstafel aufgebaut (routes_at)
+        self._stop_routes = None
+        # Vortag als zweite Ebene (set_previous_day): Index, Verschiebung in Sekunden, letzte verschobene Abfahrt
+        self.previous_day = None
+        self.previous_day_offset = 0
+        self._previous_day_until = -1
+        logger.debug("DepartureIndex aufgebaut: %d (stop, route)-Paare, %d Trips", len(self.stop_patterns), len(timetable.trips))
+
+    @classmethod
+    def from_db(cls, db: gtfs_db.GTFSDatabase):
+        # Baut den Index aus departures_today der Datenbank (bzw. der Spaltenablage)
+        return cls.from_frame(db.get_departures_today_frame())
+
+    @classmethod
+    def for_service_date(cls, db: gtfs_db.GTFSDatabase, service_date):
+        # Baut den Index eines Betriebstages direkt aus stop_times und den aktiven Services (db.get_service_day_frames).
+        # Liest nur und lässt departures_today unverändert: mehrere Prozesse auf derselben Datenbank können
+        # gleichzeitig Indizes verschiedener Tage bauen, ohne sich die gemeinsame Tabelle zu überschreiben.
+        # Dazu die Trips des Vortages, die nach Mitternacht noch fahren (GTFS-Zeiten ab 24:00).
+        index = cls.from_timetable(PatternTimetable.from_db(db, service_date))
+        tz = db.get_agency_timezone()
+        previous_date = service_date - timedelta(days=1)
+        # Abstand der Betriebstag-Beginne, an Tagen mit Zeitumstellung 23 oder 25 Stunden
+        offset = int((utils.service_day_start(previous_date, tz) - utils.service_day_start(service_date, tz)).total_seconds())
+        index.set_previous_day(cls.from_timetable(PatternTimetable.from_db(db, previous_date, min_last_departure=-offset)), offset)
+        return index
+
+    @classmethod
+    def from_frame(cls, df):
+        # Wie __init__, aber spaltenweise mit numpy statt über eine Liste von Dicts
+        if df.empty:
+            return cls.from_arrays(*(np.zeros(0, dtype=np.int64) for _ in range(4)))
+        stop_ids = df[gtfs_db.TB_DeparturesTodayAttr.STOP_ID.value].to_numpy(dtype=np.int64)
+        route_ids = df[gtfs_db.TB_DeparturesTodayAttr.ROUTE_ID.value].to_numpy(dtype=np.int64)
+        trip_ids = df[gtfs_db.TB_DeparturesTodayAttr.TRIP_ID.value].to_numpy(dtype=np.int64)
+        hms = df[gtfs_db.TB_DeparturesTodayAttr.DEPARTURE_TIME.value].astype(str).str.split(":", expand=True)
+        dep_seconds = (hms[0].astype(np.int64) * 3600 + hms[1].astype(np.int64) * 60 + hms[2].astype(np.int64)).to_numpy()
+        return cls.from_arrays(stop_ids, route_ids, trip_ids, dep_seconds)
+
+    @classmethod
+    def from_timetable(cls, timetable: PatternTimetable):
+        # Index über einem bereits gebauten Fahrplan (der Fahrplan wird geteilt, nicht kopiert)
+        index = cls.__new__(cls)
+        index._attach(timetable)
+        return index
+
+    @classmethod
+    def from_arrays(cls, stop_ids, route_ids, trip_ids, dep_seconds):
+        # Baut den Index aus gleich langen int-Arrays (eine Abfahrt pro Position)
+        return cls.from_timetable(PatternTimetable.from_departures(stop_ids, route_ids, trip_ids, dep_seconds))
+
+    def set_previous_day(self, previous, offset):
+        """
+        Hängt den Index des Vortages als zweite Ebene an: seine Zeiten zählen um offset Sekunden verschoben
+        (Beginn des Vortages minus Beginn dieses Betriebstages, ca. -86400). Es zählen nur Abfahrten, die danach
+        ab 0 liegen, also GTFS-Zeiten ab 24:00. Echtzeit-Änderungen (patched) betreffen nur diesen Betriebstag.
+        """
+        dep_seconds = previous.timetable.departure_arrays()[3]
+        until = int(dep_seconds.max()) + offset if len(dep_seconds) else -1
+        self.previous_day = previous if until >= 0 else None
+        self.previous_day_offset = offset
+        self._previous_day_until = until
+        self._stop_routes = None
+        logger.debug("Vortag angehängt: %d Trips nach Mitternacht bis %d s", len(previous.timetable.trips), until)
+
+    # Gibt die nächste Abfahrt (dep_seconds, trip_id) ab after_seconds (inklusive) zurück oder None.
+    def next_departure(self, stop_id, route_id, after_seconds):
+        key = (int(stop_id), int(route_id))
+        timetable = self.timetable
+        masked = self._masked.get(key) if self._masked else None
+        best = None
+        for pattern, position in self.stop_patterns.get(key, ()):
+            if masked:
+                departure = next((dep for dep in timetable.iter_departures(pattern, position, after_seconds) if dep not in masked), None)
+            else:
+                departure = timetable.next_departure(pattern, position, after_seconds)
+            if departure is not None and (best is None or departure < best):
+                best = departure
+        extra = self._extra.get(key) if self._extra else None
+        if extra:
+            times, trips = extra
+            idx = bisect_left(times, after_seconds)
+            if idx < len(times) and (best is None or (times[idx], trips[idx]) < best):
+                best = times[idx], trips[idx]
+        previous = self.previous_day
+        if previous is not None and after_seconds <= self._previous_day_until:
+            offset = self.previous_day_offset
+            departure = previous.next_departure(stop_id, route_id, max(after_seconds, 0) - offset)
+            if departure is not None and (best is None or (departure[0] + offset, departure[1]) < best):
+                best = departure[0] + offset, departure[1]
+        return best
+
+    # Gibt die letzte Abfahrt (dep_seconds, trip_id) bis before_seconds (inklusive) zurück oder None (Rückwärtssuche).
+    def previous_departure(self, stop_id, route_id, before_seconds):
+        key = (int(stop_id), int(route_id))
+        timetable = self.timetable
+        masked = self._masked.get(key) if self._masked else None
+        best = None
+        for pattern, position in self.stop_patterns.get(key, ()):
+            if masked:
+                departure = next((dep for dep in timetable.iter_departures_before(pattern, position, before_seconds) if dep not in masked), None)
+            else:
+                departure = timetable.previous_departure(pattern, position, before_seconds)
+            if departure is not None and (best is None or departure > best):
+                best = departure
+        extra = self._extra.get(key) if self._extra else None
+        if extra:
+            times, trips = extra
+            idx = bisect_right(times, before_seconds)
+            if idx and (best is None or (times[idx - 1], trips[idx - 1]) > best):
+                best = times[idx - 1], trips[idx - 1]
+        previous = self.previous_day
+        if previous is not None and before_seconds >= 0:
+            offset = self.previous_day_offset
+            departure = previous.previous_departure(stop_id, route_id, before_seconds - offset)
+            if departure is not None and departure[0] + offset >= 0 and (best is None or (departure[0] + offset, departure[1]) > best):
+                best = departure[0] + offset, departure[1]
+        return best
+
+    # Gibt die trip_ids aller Trips des Fahrplans zurück.
+    def trip_ids(self):
+        return self.timetable.trips.tolist()
+
+    # Gibt die Soll-Abfahrten eines Trips als [(dep_seconds, stop_id, route_id)] (nach Zeit sortiert) zurück, leer wenn er nicht fährt.
+    def trip_schedule(self, trip_id):
+        pattern = self.timetable.trip_pattern(trip_id)
+        if pattern is None:
+            return []
+        route_id = self.timetable.pattern_route(pattern)
+        return sorted((dep_seconds, stop_id, route_id) for stop_id, _, dep_seconds in self.timetable.stop_times(trip_id))
+
+    def patched(self, changes):
+        """
+        Gibt einen neuen Index mit geänderten Abfahrten zurück, der bestehende bleibt unverändert
+        (laufende Suchen sehen weiter ihren Stand). changes: Liste (trip_id, stop_id, route_id, alte Zeit, neue Zeit),
+        alte Zeit None = neu einfügen, neue Zeit None = entfernen. Fahrplan und Muster-Zuordnung werden geteilt;
+        entfernte Fahrplan-Abfahrten werden ausgeblendet, neue Zeiten als zusätzliche Abfahrten geführt. Nur die
+        Einträge der betroffenen (stop_id, route_id)-Paare werden kopiert.
+        """
+        index = DepartureIndex.__new__(DepartureIndex)
+        index.timetable = self.timetable
+        index.stop_patterns = self.stop_patterns
+        index._extra = dict(self._extra)
+        index._masked = dict(self._masked)
+        index._served = dict(self._served)
+        index.previous_day = self.previous_day
+        index.previous_day_offset = self.previous_day_offset
+        index._previous_day_until = self._previous_day_until
+        # Echtzeit-Änderungen verschieben nur Zeiten bestehender Paare; neue Paare erzwingen einen Neuaufbau
+        index._stop_routes = self._stop_routes if all((stop_id, route_id) in self.stop_patterns or (stop_id, route_id) in self._extra for _, stop_id, route_id, _, _ in changes) else None
+        copied_extra = set()
+        copied_masked = set()
+
+        def extra_lists(key):
+            if key not in copied_extra:
+                times, trips = index._extra.get(key, ((), ()))
+                index._extra[key] = (list(times), list(trips))
+                copied_extra.add(key)
+            return index._extra[key]
+
+        def masked_set(key):
+            if key not in copied_masked:
+                index._masked[key] = set(index._masked.get(key, ()))
+                copied_masked.add(key)
+            return index._masked[key]
+
+        for trip_id, stop_id, route_id, old_seconds, new_seconds in changes:
+            key = (stop_id, route_id)
+            if old_seconds is not None:
+                # Zuerst unter den zusätzlichen Abfahrten suchen, sonst die Abfahrt des Fahrplans ausblenden
+                times, trips = index._extra.get(key, ((), ()))
+                idx = bisect_left(times, old_seconds)
+                while idx < len(times) and times[idx] == old_seconds and trips[idx] != trip_id:
+                    idx += 1
+                if idx < len(times) and times[idx] == old_seconds:
+                    times, trips = extra_lists(key)
+                    del times[idx]
+                    del trips[idx]
+                else:
+                    masked_set(key).add((old_seconds, trip_id))
+            if new_seconds is not None:
+                # Zurück auf die Fahrplanzeit: nur wieder einblenden
+                if (new_seconds, trip_id) in index._masked.get(key, ()):
+                    masked_set(key).discard((new_seconds, trip_id))
+                else:
+                    times, trips = extra_lists(key)
+                    idx = bisect_right(times, new_seconds)
+                    times.insert(idx, new_seconds)
+                    trips.insert(idx, trip_id)
+            # Entfallener Halt (SKIPPED): der Trip bedient ihn nicht mehr, Aussteigen dort ist nicht möglich
+            if (old_seconds is None) != (new_seconds is None):
+                index._served[(trip_id, stop_id)] = new_seconds is not None
+        return index
+
+    # Gibt alle route_ids mit Abfahrten an einer Haltestelle zurück.
+    def routes_at(self, stop_id):
+        if self._stop_routes is None:
+            stop_routes = defaultdict(list)
+            keys = self.stop_patterns.keys() | self._extra.keys()
+            if self.previous_day is not None:
+                keys |= self.previous_day.stop_patterns.keys()
+            for stop, route_id in keys:
+                stop_routes[stop].append(route_id)
+            self._stop_routes = dict(stop_routes)
+        return self._stop_routes.get(int(stop_id), [])
+
+    def _departure_streams(self, key, after_seconds):
+        # Aufsteigende Ströme (dep_seconds, trip_id) eines (stop_id, route_id)-Paares ab after_seconds: ein Strom pro
+        # Muster und Haltposition (ohne ausgeblendete Abfahrten), dazu die zusätzlichen Abfahrten der Überlagerung
+        # und die verschobenen Ströme des Vortages
+        masked = self._masked.get(key)
+        streams = []
+        for pattern, position in self.stop_patterns.get(key, ()):
+            departures = self.timetable.iter_departures(pattern, position, after_seconds)
+            streams.append((dep for dep in departures if dep not in masked) if masked else departures)
+        extra = self._extra.get(key)
+        if extra:
+            times, trips = extra
+            idx = bisect_left(times, after_seconds)
+            streams.append(zip(times[idx:], trips[idx:]))
+        previous = self.previous_day
+        if previous is not None and after_seconds <= self._previous_day_until:
+            offset = self.previous_day_offset
+            for departures in previous._departure_streams(key, max(after_seconds, 0) - offset):
+                streams.append((dep_seconds + offset, trip_id) for dep_seconds, trip_id in departures)
+        return streams
+
+    def next_departures(self, stop_ids, after_seconds, n):
+        """
+        Die nächsten n Abfahrten ab after_seconds (inklusive) über alle Routen der Haltestellen stop_ids,
+        z.B. aller Steige einer Station. Pro Muster und Haltposition werden höchstens n Einträge ab der
+        Binärsuche genommen und k-fach gemischt (heapq.merge).
+        Rückgabe: Liste (dep_seconds, stop_id, route_id, trip_id) nach Abfahrt sortiert.
+        """
+        streams = []
+        for stop_id in stop_ids:
+            stop_id = int(stop_id)
+            for route_id in self.routes_at(stop_id):
+                for departures in self._departure_streams((stop_id, route_id), after_seconds):
+                    streams.append([(dep_seconds, stop_id, route_id, trip_id) for dep_seconds, trip_id in islice(departures, n)])
+        return list(islice(heapq.merge(*streams), n))
+
+    # Prüft, ob ein Trip heute (oder als Fahrt des Vortages nach Mitternacht) an einer Haltestelle hält.
+    def trip_serves_stop(self, trip_id, stop_id):
+        if self._served:
+            served = self._served.get((int(trip_id), int(stop_id)))
+            if served is not None:
+                return served
+        if self.timetable.serves_stop(trip_id, stop_id):
+            return True
+        return self.previous_day is not None and self.previous_day.trip_serves_stop(trip_id, stop_id)
+
+    # Gibt alle Abfahrtszeiten in Sekunden im Intervall [start_seconds, end_seconds] zurück.
+    def departures_between(self, stop_id, route_id, start_seconds, end_seconds):
+        times = []
+        for departures in self._departure_streams((int(stop_id), int(route_id)), start_seconds):
+            for dep_seconds, _ in departures:
+                if dep_seconds > end_seconds:
+                    break
+                times.append(dep_seconds)
+        times.sort()
+        return times
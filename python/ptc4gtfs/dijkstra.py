@@ -4,22 +4,109 @@ from . import model
 import logging
 from . import db as gtfs_db
 import heapq
+import threading
+import weakref
+from collections import OrderedDict
 import networkx as nx
+from .departures import DepartureIndex
+from .stats import QueryStats
+from .contraction import ContractedGraph, contract
+import time
 
 logger = logging.getLogger(__name__)
 
-def dijkstra_ptc4gtfs(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, start):
-    print(f"{utils.BRIGHT_YELLOW}------------dijkstra_ptc4model_db(start={start}, graph=({graph}))------------")
+# Attributname der Verkehrsmittel-Maske, einmal aufgelöst statt pro Kante über die Enum
+MODE_MASK = model.EdgeAttr.MODE_MASK.value
+EDGE_TYPE = model.EdgeAttr.TYPE.value
+TRANSIT = model.EdgeType.TRANSIT.value
+TELEPORT = model.EdgeType.TELEPORT.value
+
+def _new_counts():
+    # Zähler einer Vorwärtssuche, lokal geführt (Hot Path) und am Ende mit _finish_search in stats übernommen
+    return {"nodes_settled": 0, "edges_relaxed": 0, "heap_pushes": 0, "departure_lookups": 0, "no_departure": 0, "negative_wait": 0}
+
+def _transit_wait(departures: DepartureIndex, day_start, curr_node, neighbor, edge_route_id, arrival_time, curr_route_id, curr_trip_id, counts):
+    # Relaxierung einer Transit-Kante curr_node -> neighbor, gemeinsam für alle Vorwärtssuchen: Weiterfahrt im
+    # aktuellen Trip ohne Wartezeit, falls er neighbor bedient, sonst Einstieg in die nächste Abfahrt der Route.
+    # Gibt (Wartezeit in Sekunden, trip_id) zurück, None falls keine Abfahrt erreichbar ist.
+    if edge_route_id == curr_route_id and not (curr_trip_id and not departures.trip_serves_stop(curr_trip_id, neighbor)):
+        return 0, curr_trip_id
+    arrival_seconds = (arrival_time - day_start).total_seconds()
+    next_dep = departures.next_departure(curr_node, edge_route_id, arrival_seconds)
+    counts["departure_lookups"] += 1
+    if next_dep is None:
+        counts["no_departure"] += 1
+        return None
+    dep_seconds, trip_id = next_dep
+    wait_seconds = dep_seconds - arrival_seconds
+    if wait_seconds < 0:
+        counts["negative_wait"] += 1
+        return None
+    return wait_seconds, trip_id
+
+def _edge_cost(edge, departures: DepartureIndex, day_start, curr_node, neighbor, arrival_time, curr_route_id, curr_trip_id, excluded_mask, counts):
+    # Kosten einer Kante des Graphen: (Gewicht inkl. Wartezeit, route_id, trip_id), None falls nicht nutzbar.
+    # Geh-Kanten kosten ihr Gewicht, Teleport-Kanten nichts, Transit-Kanten Fahrzeit plus Wartezeit (_transit_wait).
+    edge_type = edge[EDGE_TYPE]
+    if edge_type == TRANSIT:
+        if excluded_mask and edge.get(MODE_MASK, 0) & excluded_mask:
+            return None
+        weight = edge.get('weight', 1)
+        edge_route_id = edge.get('route_id', None)
+        if not edge_route_id:
+            return weight, edge_route_id, None
+        step = _transit_wait(departures, day_start, curr_node, neighbor, edge_route_id, arrival_time, curr_route_id, curr_trip_id, counts)
+        if step is None:
+            return None
+        return weight + step[0], edge_route_id, step[1]
+    if edge_type == TELEPORT:
+        return 0, None, None
+    return edge.get('weight', 1), None, None
+
+def _finish_search(stats: QueryStats, counts, search_start, start):
+    # Zähler in stats übernehmen; übersprungene Kanten nur zählen und einmal pro Suche (rate-limitiert) melden
+    stats.searches += 1
+    stats.nodes_settled += counts["nodes_settled"]
+    stats.edges_relaxed += counts["edges_relaxed"]
+    stats.heap_pushes += counts["heap_pushes"]
+    stats.departure_lookups += counts["departure_lookups"]
+    stats.search_seconds += time.perf_counter() - search_start
+    if counts["no_departure"]:
+        utils.log_rate_limited(logger, "dijkstra.no_departure", logging.WARNING, "%d Kanten übersprungen: keine Abfahrt (start=%s)", counts["no_departure"], start)
+    if counts["negative_wait"]:
+        utils.log_rate_limited(logger, "dijkstra.negative_wait", logging.WARNING, "%d Kanten übersprungen: negative Wartezeit (start=%s)", counts["negative_wait"], start)
+
+def dijkstra_ptc4gtfs(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, start, departure_time: datetime = None, departures: DepartureIndex = None, arrival_bounds: dict = None, stats: QueryStats = None, excluded_mask=0, day_start=None):
+    # arrival_bounds (optional): node -> früheste bekannte Ankunftszeit aus einer Suche mit späterer Abfahrt.
+    # Labels, die diese Ankunft nicht unterbieten, sind dominiert und werden verworfen (Profilsuche).
+    # stats (optional): QueryStats, in das Zähler und Zeiten dieser Suche addiert werden.
+    # excluded_mask (optional): ausgeschlossene Verkehrsmittel (db.route_type_mask); Transit-Kanten, deren
+    # EdgeAttr.MODE_MASK ein Bit davon trägt, werden mit einem einzigen bitweisen Test übersprungen.
+    # day_start (optional): Beginn des Betriebstages von departures, wenn er schon feststeht (Profilsuche);
+    # sonst aus dem Datum der Abfahrt in ihrer Zeitzone.
+    logger.debug("dijkstra_ptc4gtfs(start=%s, graph=%s)", start, graph)
+    if stats is None:
+        stats = QueryStats()
+    setup_start = time.perf_counter()
     # setup
-    deparutes_dict = utils.build_departures_dict(db.get_all_departures_today())
+    # Ein bereits aufgebauter DepartureIndex kann über viele Suchen geteilt werden
+    if departures is None:
+        departures = DepartureIndex.from_db(db)
+    if departure_time is None:
+        departure_time = datetime.now()
+    # Referenz für GTFS-Zeiten ist der Beginn des Betriebstages in der Zeitzone der Abfahrt
+    departure_time, day_start = utils.search_time_reference(departure_time, day_start)
     arrival_times = {node: None for node in graph}
-    arrival_times[start] = datetime.now()
+    arrival_times[start] = departure_time
     
     # standart setup
     distances = {node: float('inf') for node in graph}
     distances[start] = 0
     predecessors = {}
     queue = [(0, start, None, None, arrival_times[start] )]
+    counts = _new_counts()
+    search_start = time.perf_counter()
+    stats.setup_seconds += search_start - setup_start
     # Dijkstra-Algorithmus
     while queue:
         curr_dist, curr_node, curr_route_id, curr_trip_id, arrival_time  = heapq.heappop(queue)
@@ -27,67 +114,374 @@ def dijkstra_ptc4gtfs(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, start):
         # Verhindert, dass veraltete (schlechte) Einträge aus der Priority Queue verarbeitet werden.
         if curr_dist > distances[curr_node]:
             continue
+        counts["nodes_settled"] += 1
 
         for neighbor, edge_list in graph[curr_node].items():
-            for _, edge in edge_list.items():
-                # Normales Gewicht ist die Dauer für eine Geh-Kante  
-                weight = edge.get('weight', 1)
-                distance = curr_dist
-                edge_route_id = None
-                edge_trip_id = None
-                # Behandlung der Kantengewichte:
-                if edge[model.EdgeAttr.TYPE.value] == model.EdgeType.TRANSIT.value:
-                    edge_route_id = edge.get('route_id', None)
-                    # Prüfe, ob die Kante zur aktuellen Route gehört
-                    # Falls nicht, muss ggf. Wartezeit zum Gewicht addiert werden
-                    if edge_route_id:
-                        # Hole nächste Abfahrt für Haltestelle und Route
-                        next_dep = utils.get_next_departure_today_dict(deparutes_dict, curr_node, edge_route_id, arrival_time.strftime("%H:%M:%S"))
-
-                        # Falls keine passende Fahrt gefunden, suche nächste Abfahrt
-                        # Prüfe, ob der Trip zur Kante passt
-                        if edge_route_id != curr_route_id or (curr_trip_id and not db.get_trip_by_trip_id_and_stop_id(curr_trip_id, neighbor)):
-                            
-                            # Prüfe, ob Abfahrt existiert    
-                            if next_dep is None:
-                                logger.warning(f"Next Departure for route({edge_route_id}) by stop({curr_node}) does not exist")
-                                continue
-                            
-                            # Berechne Wartezeit in Sekunden
-                            edge_trip_id = next_dep[gtfs_db.TB_DeparturesTodayAttr.TRIP_ID.value]
-                            dep_time = next_dep[gtfs_db.TB_DeparturesTodayAttr.DEPARTURE_TIME.value]
-                            dep_dt = utils.parse_gtfs_time_ref_date(dep_time, arrival_time.date())
-                            wait_seconds = (dep_dt - arrival_time).total_seconds()
-
-                            # Prüfe, ob Wartezeit gültig ist
-                            if wait_seconds < 0:
-                                logger.warning(f"Wait seconds({wait_seconds}) for next Departure for route({edge_route_id}) by stop({curr_node}) is < 0")
-                                continue
-                            
-                            # Addiere Wartezeit zum Gewicht
-                            weight += wait_seconds
-                        else:
-                            edge_trip_id = curr_trip_id
-                    
-                # Bei Teleportation ist das Gewicht immer 0
-                elif edge[model.EdgeAttr.TYPE.value] == model.EdgeType.TELEPORT.value:
-                    weight = 0
- 
-                # Berechne neue Ankunftszeit und Distanz
-                arrival_time_to_neighbor = arrival_time + timedelta(seconds=weight)
-                distance += weight
+            for edge in edge_list.values():
+                counts["edges_relaxed"] += 1
+                cost = _edge_cost(edge, departures, day_start, curr_node, neighbor, arrival_time, curr_route_id, curr_trip_id, excluded_mask, counts)
+                if cost is None:
+                    continue
+                weight, edge_route_id, edge_trip_id = cost
+                distance = curr_dist + weight
 
                 # Wenn das Gehen über eine Kante den Nachbarknoten schneller erreicht,
                 # setze diesen Knoten als Vorgänger
                 if distance < distances[neighbor]:
+                    arrival_time_to_neighbor = arrival_time + timedelta(seconds=weight)
+                    if arrival_bounds is not None and neighbor in arrival_bounds and arrival_time_to_neighbor >= arrival_bounds[neighbor]:
+                        continue
                     distances[neighbor] = distance
                     predecessors[neighbor] = (curr_node, edge_route_id, edge_trip_id)
                     arrival_times[neighbor] = arrival_time_to_neighbor
                     heapq.heappush(queue, (distance, neighbor, edge.get('route_id', None), edge_trip_id, arrival_time_to_neighbor))
+                    counts["heap_pushes"] += 1
+
+    _finish_search(stats, counts, search_start, start)
+    logger.debug("dijkstra_ptc4gtfs(start=%s) beendet: %d Knoten abgearbeitet, %d erreicht", start, counts["nodes_settled"], len(predecessors))
+    return distances, predecessors, arrival_times
+
+def dijkstra_ptc4gtfs_contracted(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, start, departure_time: datetime = None, departures: DepartureIndex = None, arrival_bounds: dict = None, stats: QueryStats = None, excluded_mask=0, contracted: ContractedGraph = None, day_start=None):
+    """
+    Wie dijkstra_ptc4gtfs, aber Station und Plattformen bilden eine Einheit (siehe contraction.ContractedGraph):
+    Umstiege über die Teleport-Kanten werden beim Abarbeiten einer Plattform direkt ausgeführt statt
+    über den Heap. Rückgabe (distances, predecessors, arrival_times) auf Plattform-Ebene wie bisher.
+    nodes_settled zählt jede Expansion eines Knotens, auch die ohne Heap über transfer() erreichten,
+    damit der Aufwand mit dijkstra_ptc4gtfs vergleichbar bleibt. day_start wie bei dijkstra_ptc4gtfs.
+    """
+    logger.debug("dijkstra_ptc4gtfs_contracted(start=%s, graph=%s)", start, graph)
+    if stats is None:
+        stats = QueryStats()
+    setup_start = time.perf_counter()
+    if contracted is None:
+        contracted = contract(graph)
+    if departures is None:
+        departures = DepartureIndex.from_db(db)
+    if departure_time is None:
+        departure_time = datetime.now()
+    departure_time, day_start = utils.search_time_reference(departure_time, day_start)
+    arrival_times = {node: None for node in graph}
+    arrival_times[start] = departure_time
+    distances = {node: float('inf') for node in graph}
+    distances[start] = 0
+    predecessors = {}
+    queue = []
+    transit = contracted.transit
+    hub_of = contracted.hub
+    members_of = contracted.members
+    transfer_seconds = contracted.transfer_seconds
+    counts = _new_counts()
+
+    def improve(node, distance, arrival_time, predecessor):
+        # Setzt node auf distance, falls besser und nicht durch arrival_bounds dominiert
+        if distance >= distances[node]:
+            return False
+        if arrival_bounds is not None and node in arrival_bounds and arrival_time >= arrival_bounds[node]:
+            return False
+        distances[node] = distance
+        predecessors[node] = predecessor
+        arrival_times[node] = arrival_time
+        return True
 
-    print(f"------------dijkstra_ptc4model_db({start}, graph=({graph}), distances_len={len(distances)}, predecessors_len={len(predecessors)}, arrival_times_len={len(arrival_times)})------------{utils.RESET}")
+    def board(curr_node, curr_dist, arrival_time, curr_route_id, curr_trip_id):
+        # Knoten expandieren: Transit-Kanten von curr_node relaxieren (_transit_wait wie in dijkstra_ptc4gtfs)
+        counts["nodes_settled"] += 1
+        for neighbor, edge_route_id, weight, mode_mask in transit[curr_node]:
+            counts["edges_relaxed"] += 1
+            if mode_mask & excluded_mask:
+                continue
+            edge_trip_id = None
+            if edge_route_id:
+                step = _transit_wait(departures, day_start, curr_node, neighbor, edge_route_id, arrival_time, curr_route_id, curr_trip_id, counts)
+                if step is None:
+                    continue
+                wait_seconds, edge_trip_id = step
+                weight += wait_seconds
+            distance = curr_dist + weight
+            arrival_time_to_neighbor = arrival_time + timedelta(seconds=weight)
+            if improve(neighbor, distance, arrival_time_to_neighbor, (curr_node, edge_route_id, edge_trip_id)):
+                heapq.heappush(queue, (distance, neighbor, edge_route_id, edge_trip_id, arrival_time_to_neighbor))
+                counts["heap_pushes"] += 1
+
+    def transfer(curr_node, curr_dist, arrival_time):
+        # Umstieg innerhalb der Einheit: Plattform -> Station -> übrige Plattformen, ohne Heap
+        hub = hub_of[curr_node]
+        if hub != curr_node:
+            counts["edges_relaxed"] += 1
+            if not improve(hub, curr_dist, arrival_time, (curr_node, None, None)):
+                return
+            board(hub, curr_dist, arrival_time, None, None)
+        transfer_distance = curr_dist + transfer_seconds
+        transfer_arrival = arrival_time + timedelta(seconds=transfer_seconds)
+        for member in members_of[curr_node]:
+            if member == curr_node or member == hub:
+                continue
+            counts["edges_relaxed"] += 1
+            if improve(member, transfer_distance, transfer_arrival, (hub, None, None)):
+                board(member, transfer_distance, transfer_arrival, None, None)
+
+    search_start = time.perf_counter()
+    stats.setup_seconds += search_start - setup_start
+    board(start, 0, departure_time, None, None)
+    transfer(start, 0, departure_time)
+    while queue:
+        curr_dist, curr_node, curr_route_id, curr_trip_id, arrival_time = heapq.heappop(queue)
+        if curr_dist > distances[curr_node]:
+            continue
+        board(curr_node, curr_dist, arrival_time, curr_route_id, curr_trip_id)
+        transfer(curr_node, curr_dist, arrival_time)
+
+    _finish_search(stats, counts, search_start, start)
+    logger.debug("dijkstra_ptc4gtfs_contracted(start=%s) beendet: %d Knoten abgearbeitet, %d erreicht", start, counts["nodes_settled"], len(predecessors))
     return distances, predecessors, arrival_times
 
+class LowerBounds:
+    """
+    Fortsetzbare statische Rückwärtssuche vom Ziel: untere Schranke der Restfahrzeit pro Knoten aus den minimalen
+    Kantengewichten (Transit = Fahrzeit ohne Wartezeit, Teleport = 0), ohne Abfahrts-Lookups.
+    Ausgeschlossene Verkehrsmittel (excluded_mask) zählen nicht, die Schranken bleiben so scharf wie möglich.
+    extend(graph, stop_node) rechnet nur, bis stop_node abgearbeitet ist; eine spätere Anfrage zum selben Ziel
+    setzt dort fort (cached_lower_bounds). bounds ist für abgearbeitete Knoten exakt, alle übrigen Knoten
+    sind mindestens radius vom Ziel entfernt. Hält keine Referenz auf den Graphen (Schlüssel im WeakKeyDictionary).
+    """
+    def __init__(self, target, excluded_mask=0):
+        self.target = target
+        self.excluded_mask = excluded_mask
+        self.bounds = {target: 0}
+        self.settled = set()
+        self.radius = 0
+        self._queue = [(0, target)]
+        self._lock = threading.Lock()
+
+    def extend(self, graph: nx.MultiDiGraph, stop_node=None):
+        # Setzt die Suche fort, bis stop_node abgearbeitet ist (None = vollständig); gibt die Zahl der dabei
+        # neu abgearbeiteten Knoten zurück (0, wenn stop_node schon bekannt ist)
+        with self._lock:
+            if stop_node in self.settled:
+                return 0
+            bounds = self.bounds
+            settled = self.settled
+            queue = self._queue
+            excluded_mask = self.excluded_mask
+            newly_settled = 0
+            while queue:
+                bound, node = heapq.heappop(queue)
+                if node in settled:
+                    continue
+                settled.add(node)
+                newly_settled += 1
+                self.radius = bound
+                for predecessor, edge_list in graph.pred[node].items():
+                    weight = min((
+                        0 if edge[EDGE_TYPE] == TELEPORT else edge.get('weight', 1)
+                        for edge in edge_list.values() if not edge.get(MODE_MASK, 0) & excluded_mask
+                    ), default=None)
+                    if weight is None:
+                        continue
+                    if bound + weight < bounds.get(predecessor, float('inf')):
+                        bounds[predecessor] = bound + weight
+                        heapq.heappush(queue, (bound + weight, predecessor))
+                if node == stop_node:
+                    break
+            return newly_settled
+
+def lower_bound_distances(graph: nx.MultiDiGraph, target, stop_node=None, excluded_mask=0):
+    # Einmalige Rückwärtssuche (LowerBounds) bis stop_node. Gibt (bounds, radius, settled) zurück: Knoten außerhalb
+    # der abgearbeiteten sind mindestens radius vom Ziel entfernt.
+    lower = LowerBounds(target, excluded_mask)
+    settled = lower.extend(graph, stop_node)
+    return lower.bounds, lower.radius, settled
+
+# Obergrenze für die Schranken aller gecachten Ziele eines Graphen (Summe der bounds-Einträge); darüber werden
+# die am längsten nicht genutzten Ziele verworfen (LRU)
+LOWER_BOUNDS_CACHE_NODES = 500_000
+# Graph -> ((Kantenzahl, Masken vorhanden), OrderedDict (Ziel, excluded_mask) -> LowerBounds), verfällt mit dem Graphen
+_lower_bounds_cache = weakref.WeakKeyDictionary()
+_lower_bounds_lock = threading.Lock()
+
+def cached_lower_bounds(graph: nx.MultiDiGraph, target, excluded_mask=0) -> LowerBounds:
+    # Gibt die (gecachte) Schranken-Suche zum Ziel zurück; wie contraction.contract neu, wenn sich die Kantenzahl
+    # geändert hat oder die Verkehrsmittel-Masken erst nachträglich ergänzt wurden
+    version = (graph.number_of_edges(), bool(graph.graph.get(model.GRAPH_MODE_MASKS)))
+    key = (target, excluded_mask)
+    with _lower_bounds_lock:
+        cached = _lower_bounds_cache.get(graph)
+        if cached is None or cached[0] != version:
+            cached = (version, OrderedDict())
+            _lower_bounds_cache[graph] = cached
+        entries = cached[1]
+        lower = entries.get(key)
+        if lower is None:
+            lower = entries[key] = LowerBounds(target, excluded_mask)
+        else:
+            entries.move_to_end(key)
+        cached_nodes = sum(len(entry.bounds) for entry in entries.values())
+        while cached_nodes > LOWER_BOUNDS_CACHE_NODES and len(entries) > 1:
+            _, evicted = entries.popitem(last=False)
+            cached_nodes -= len(evicted.bounds)
+    return lower
+
+def dijkstra_ptc4gtfs_bidirectional(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, start, target, departure_time: datetime = None, departures: DepartureIndex = None, stats: QueryStats = None, excluded_mask=0):
+    """
+    Punkt-zu-Punkt-Suche: zuerst eine statische Rückwärtssuche vom Ziel mit minimalen Kantengewichten
+    (LowerBounds, bis der Start erreicht ist; pro Ziel gecacht und bei späteren Anfragen nur fortgesetzt), dann die zeitabhängige Vorwärtssuche wie
+    dijkstra_ptc4gtfs, aber geordnet nach Distanz + unterer Schranke bis zum Ziel (A*).
+    Die Schranke min(Rückwärtsdistanz, radius) ist konsistent, weil jede echte Kante mindestens ihr
+    statisches Gewicht kostet; die Suche darf daher enden, sobald das Ziel aus dem Heap kommt.
+    Rückgabe wie dijkstra_ptc4gtfs, Einträge nur für die abgearbeiteten Knoten.
+    """
+    logger.debug("dijkstra_ptc4gtfs_bidirectional(start=%s, target=%s, graph=%s)", start, target, graph)
+    if stats is None:
+        stats = QueryStats()
+    setup_start = time.perf_counter()
+    if departures is None:
+        departures = DepartureIndex.from_db(db)
+    if departure_time is None:
+        departure_time = datetime.now()
+    departure_time, day_start = utils.search_time_reference(departure_time)
+    search_start = time.perf_counter()
+    stats.setup_seconds += search_start - setup_start
+
+    lower = cached_lower_bounds(graph, target, excluded_mask)
+    backward_settled = lower.extend(graph, start)
+    bounds = lower.bounds
+    # radius nur einmal lesen: setzt eine andere Anfrage die Suche fort, bleibt min(Schranke, radius) unverändert
+    radius = lower.radius
+    if start not in bounds:
+        # Ziel vom Start aus nicht erreichbar (auch nicht mit statischen Gewichten)
+        stats.searches += 1
+        stats.bound_nodes_settled += backward_settled
+        stats.search_seconds += time.perf_counter() - search_start
+        return {node: float('inf') for node in graph} | {start: 0}, {}, {node: None for node in graph} | {start: departure_time}
+
+    arrival_times = {node: None for node in graph}
+    arrival_times[start] = departure_time
+    distances = {node: float('inf') for node in graph}
+    distances[start] = 0
+    predecessors = {}
+    queue = [(bounds[start], 0, start, None, None, departure_time)]
+    counts = _new_counts()
+    while queue:
+        _, curr_dist, curr_node, curr_route_id, curr_trip_id, arrival_time = heapq.heappop(queue)
+        if curr_dist > distances[curr_node]:
+            continue
+        counts["nodes_settled"] += 1
+        # Schranke konsistent: das Ziel ist beim ersten Abarbeiten endgültig
+        if curr_node == target:
+            break
+
+        for neighbor, edge_list in graph[curr_node].items():
+            for edge in edge_list.values():
+                counts["edges_relaxed"] += 1
+                cost = _edge_cost(edge, departures, day_start, curr_node, neighbor, arrival_time, curr_route_id, curr_trip_id, excluded_mask, counts)
+                if cost is None:
+                    continue
+                weight, edge_route_id, edge_trip_id = cost
+                distance = curr_dist + weight
+                if distance < distances[neighbor]:
+                    arrival_time_to_neighbor = arrival_time + timedelta(seconds=weight)
+                    distances[neighbor] = distance
+                    predecessors[neighbor] = (curr_node, edge_route_id, edge_trip_id)
+                    arrival_times[neighbor] = arrival_time_to_neighbor
+                    heapq.heappush(queue, (distance + min(bounds.get(neighbor, radius), radius), distance, neighbor, edge.get('route_id', None), edge_trip_id, arrival_time_to_neighbor))
+                    counts["heap_pushes"] += 1
+
+    stats.bound_nodes_settled += backward_settled
+    _finish_search(stats, counts, search_start, start)
+    logger.debug("dijkstra_ptc4gtfs_bidirectional(start=%s, target=%s) beendet: %d + %d Knoten abgearbeitet", start, target, backward_settled, counts["nodes_settled"])
+    return distances, predecessors, arrival_times
+
+def dijkstra_ptc4gtfs_reverse(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, target, arrival_time: datetime = None, departures: DepartureIndex = None, stats: QueryStats = None, excluded_mask=0):
+    """
+    Rückwärtssuche für Ankunft-bis-Anfragen: läuft vom Ziel über die eingehenden Kanten und bestimmt für jeden
+    Knoten die späteste Abfahrt, mit der das Ziel bis arrival_time erreicht wird.
+    Zustände sind (Knoten, None) = an der Haltestelle, Umstieg möglich, und (Knoten, route_id) = in einem Fahrzeug
+    der Route, das ohne Wartezeit weiterfährt (gespiegelt zur Weiterfahrt im selben Trip in dijkstra_ptc4gtfs).
+    Einsteigen nutzt die letzte Abfahrt vor "späteste Ankunft am Nachbarn minus Fahrzeit" (DepartureIndex.previous_departure).
+    Gibt (distances, successors, departure_times) zurück: distances = Sekunden vor arrival_time, departure_times =
+    späteste Abfahrt pro Knoten, successors: Zustand -> (Folgezustand, route_id, trip_id beim Einsteigen, Fahrzeit).
+    """
+    logger.debug("dijkstra_ptc4gtfs_reverse(target=%s, graph=%s)", target, graph)
+    if stats is None:
+        stats = QueryStats()
+    setup_start = time.perf_counter()
+    if departures is None:
+        departures = DepartureIndex.from_db(db)
+    if arrival_time is None:
+        arrival_time = datetime.now()
+    arrival_time, day_start = utils.search_time_reference(arrival_time)
+    arrival_seconds = (arrival_time - day_start).total_seconds()
+    # Zustand -> späteste Zeit in Sekunden ab Betriebstag-Beginn
+    latest = {(target, None): arrival_seconds}
+    successors = {}
+    queue = [(0, 0, target, None)]
+    counts = _new_counts()
+    search_start = time.perf_counter()
+    stats.setup_seconds += search_start - setup_start
+
+    def relax(state, seconds, successor):
+        # Übernimmt seconds für state, falls später als bisher (und als der Haltestellen-Zustand desselben Knotens)
+        if seconds <= latest.get(state, float('-inf')) or (state[1] is not None and seconds <= latest.get((state[0], None), float('-inf'))):
+            return
+        latest[state] = seconds
+        successors[state] = successor
+        counts["heap_pushes"] += 1
+        heapq.heappush(queue, (arrival_seconds - seconds, counts["heap_pushes"], state[0], state[1]))
+
+    while queue:
+        curr_dist, _, curr_node, curr_route_id = heapq.heappop(queue)
+        curr_state = (curr_node, curr_route_id)
+        curr_seconds = latest[curr_state]
+        if curr_dist > arrival_seconds - curr_seconds:
+            continue
+        # An der Haltestelle ist man mindestens so flexibel wie im Fahrzeug
+        if curr_route_id is not None and curr_seconds <= latest.get((curr_node, None), float('-inf')):
+            continue
+        counts["nodes_settled"] += 1
+
+        # Eingehende Kanten: predecessor -> curr_node; gezählt wird jede betrachtete Kante wie in der Vorwärtssuche
+        for predecessor, edge_list in graph.pred[curr_node].items():
+            for edge in edge_list.values():
+                counts["edges_relaxed"] += 1
+                edge_type = edge[EDGE_TYPE]
+                edge_route_id = edge.get('route_id', None) if edge_type == TRANSIT else None
+                if curr_route_id is not None and edge_route_id != curr_route_id:
+                    # Im Fahrzeug kommt man nur über Kanten derselben Route an
+                    continue
+                if excluded_mask and edge.get(MODE_MASK, 0) & excluded_mask:
+                    continue
+                if edge_type == TELEPORT:
+                    relax((predecessor, None), curr_seconds, (curr_state, None, None, 0))
+                    continue
+                weight = edge.get('weight', 1)
+                if not edge_route_id:
+                    relax((predecessor, None), curr_seconds - weight, (curr_state, None, None, weight))
+                    continue
+                # Späteste Ankunft an curr_node im Fahrzeug -> spätestens hier am Vorgänger
+                ride_seconds = curr_seconds - weight
+                # Im selben Fahrzeug sitzen bleiben
+                relax((predecessor, edge_route_id), ride_seconds, (curr_state, edge_route_id, None, weight))
+                # Oder am Vorgänger einsteigen: letzte Abfahrt, die rechtzeitig ankommt
+                prev_dep = departures.previous_departure(predecessor, edge_route_id, ride_seconds)
+                counts["departure_lookups"] += 1
+                if prev_dep is None:
+                    counts["no_departure"] += 1
+                    continue
+                dep_seconds, trip_id = prev_dep
+                relax((predecessor, None), dep_seconds, (curr_state, edge_route_id, trip_id, weight))
+
+    # Ergebnis auf Knoten-Ebene (Haltestellen-Zustände)
+    distances = {node: float('inf') for node in graph}
+    departure_times = {node: None for node in graph}
+    for (node, route_id), seconds in latest.items():
+        if route_id is None:
+            distances[node] = arrival_seconds - seconds
+            departure_times[node] = day_start + timedelta(seconds=seconds)
+
+    _finish_search(stats, counts, search_start, target)
+    logger.debug("dijkstra_ptc4gtfs_reverse(target=%s) beendet: %d Knoten abgearbeitet, %d erreicht", target, counts["nodes_settled"], len(successors))
+    return distances, successors, departure_times
+
 def get_shortest_path_ptc4gtfs(predecessors, arrival_times, start_node, end_node):
     path = []
     current_node = end_node
@@ -102,4 +496,25 @@ def get_shortest_path_ptc4gtfs(predecessors, arrival_times, start_node, end_node
     # Startknoten hinzufügen (keine Route ID, da Startpunkt)
     path.append((start_node, None, arrival_times[start_node]))
 
-    return path[::-1]  # Pfad umkehren
\ No newline at end of file
+    return path[::-1]  # Pfad umkehren
+
+def get_shortest_path_ptc4gtfs_reverse(successors, departure_times, start_node, end_node):
+    # Pfad aus dijkstra_ptc4gtfs_reverse im selben Format wie get_shortest_path_ptc4gtfs. Die Zeiten werden wie in der
+    # Vorwärtssuche ab der spätesten Abfahrt fortgeschrieben: Einsteigen zur Fahrplanzeit, danach reine Fahrzeiten.
+    state = (start_node, None)
+    if start_node != end_node and state not in successors:
+        return []  # Kein Pfad gefunden
+    current_time = departure_times[start_node]
+    path = [(start_node, None, current_time)]
+    trip_id = None
+    while state != (end_node, None):
+        next_state, route_id, boarded_trip_id, travel_seconds = successors[state]
+        if boarded_trip_id is not None:
+            trip_id = boarded_trip_id
+            current_time = departure_times[state[0]]
+        elif route_id is None:
+            trip_id = None
+        current_time = current_time + timedelta(seconds=travel_seconds)
+        path.append((next_state[0], route_id, trip_id, current_time))
+        state = next_state
+    return path
@@ -0,0 +1,57 @@
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+def _row_hashes(df: pd.DataFrame):
+    # 64-Bit-Hash pro Zeile, unabhängig von der Spaltenreihenfolge der Datei
+    if df.empty:
+        return np.zeros(0, dtype=np.uint64)
+    return pd.util.hash_pandas_object(df[sorted(df.columns)], index=False).to_numpy()
+
+def _hashes_by_route(df: pd.DataFrame, sort_by):
+    # Sortiert nach route_id (+ sort_by) und gibt route_id -> Zeilen-Hashes (Bytes) zurück
+    df = df.sort_values(["route_id", *sort_by], kind="stable")
+    route_ids = df["route_id"].to_numpy()
+    hashes = _row_hashes(df)
+    result = {}
+    if len(route_ids) == 0:
+        return result
+    unique_ids, starts = np.unique(route_ids, return_index=True)
+    ends = list(starts[1:]) + [len(route_ids)]
+    for route_id, start, end in zip(unique_ids, starts, ends):
+        result[int(route_id)] = hashes[start:end].tobytes()
+    return result
+
+def route_content_hashes(routes: pd.DataFrame, trips: pd.DataFrame, stop_times: pd.DataFrame):
+    """
+    Berechnet pro Route einen Inhalts-Hash über die Route selbst, ihre Trips und deren stop_times.
+    Zwei Feeds mit gleichem Hash für eine Route haben für diese Route denselben Fahrplan.
+    Gibt route_id -> SHA1-Hexstring zurück.
+    """
+    trip_routes = trips[["trip_id", "route_id"]]
+    route_stop_times = stop_times.merge(trip_routes, on="trip_id", how="inner")
+    parts = (
+        _hashes_by_route(routes, []),
+        _hashes_by_route(trips, ["trip_id"]),
+        _hashes_by_route(route_stop_times, ["trip_id", "stop_sequence"]),
+    )
+    hashes = {}
+    for route_id in routes["route_id"]:
+        route_id = int(route_id)
+        sha = hashlib.sha1()
+        for part in parts:
+            sha.update(part.get(route_id, b""))
+            # Trenner, damit sich Zeilen nicht zwischen den Tabellen verschieben können
+            sha.update(b"|")
+        hashes[route_id] = sha.hexdigest()
+    return hashes
+
+def diff_route_hashes(old_hashes, new_hashes):
+    # Vergleicht zwei Hash-Stände, gibt (neue, entfernte, geänderte) route_ids als Mengen zurück
+    added = set(new_hashes) - set(old_hashes)
+    removed = set(old_hashes) - set(new_hashes)
+    changed = {route_id for route_id in set(old_hashes) & set(new_hashes) if old_hashes[route_id] != new_hashes[route_id]}
+    return added, removed, changed
@@ -0,0 +1,140 @@
+import logging
+from enum import StrEnum
+
+# pandas wird nur beim Import eines Feeds gebraucht (extended, encode_frames), nicht für Abfragen
+
+logger = logging.getLogger(__name__)
+
+class IdKind(StrEnum):
+    STOP = "stop"
+    ROUTE = "route"
+    TRIP = "trip"
+    SERVICE = "service"
+
+# Tabelle -> Spalte -> Art der ID. Die erste Tabelle einer Art bestimmt die Reihenfolge der Codes.
+ID_COLUMNS = {
+    "stops": {"stop_id": IdKind.STOP, "parent_station": IdKind.STOP},
+    "routes": {"route_id": IdKind.ROUTE},
+    "trips": {"trip_id": IdKind.TRIP, "route_id": IdKind.ROUTE, "service_id": IdKind.SERVICE},
+    "calendar": {"service_id": IdKind.SERVICE},
+    "calendar_dates": {"service_id": IdKind.SERVICE},
+    "stop_times": {"trip_id": IdKind.TRIP, "stop_id": IdKind.STOP},
+    "departures": {"stop_id": IdKind.STOP, "route_id": IdKind.ROUTE, "trip_id": IdKind.TRIP},
+}
+
+class IdDictionary:
+    """
+    Wörterbuch der GTFS-IDs: jede stop/route/trip/service-ID bekommt beim Import einen dichten int32-Code
+    (1, 2, 3, ...; 0 bleibt frei, weil die Suche 0/None als "keine Route/kein Trip" behandelt).
+    Datenbank, Graph und Abfahrtsindex rechnen nur mit Codes; GTFS-IDs (auch nicht-numerische wie
+    "de:09162:6") gibt es nur an den Rändern: encode für Eingaben (CLI, HTTP, Echtzeit-Feed),
+    decode für Ausgaben. Datenbanken ohne Wörterbuch (vor der Einführung) nutzen die Identität:
+    encode = int(ID), decode = str(Code).
+    """
+
+    def __init__(self, gtfs_ids: dict = None):
+        # kind -> Liste der GTFS-IDs, Index = Code (Index 0 frei); None = Identität
+        self.gtfs_ids = gtfs_ids
+        self.codes = None
+        if gtfs_ids is not None:
+            self.codes = {kind: {gtfs_id: code for code, gtfs_id in enumerate(ids) if code} for kind, ids in gtfs_ids.items()}
+
+    @classmethod
+    def identity(cls):
+        return cls(None)
+
+    @property
+    def is_identity(self):
+        return self.gtfs_ids is None
+
+    def size(self, kind):
+        # Anzahl Codes einer Art (ohne den freien Code 0), None bei Identität
+        return None if self.is_identity else len(self.gtfs_ids[kind]) - 1
+
+    def encode(self, kind, gtfs_id):
+        # GTFS-ID -> Code, None wenn unbekannt
+        if gtfs_id is None:
+            return None
+        if self.is_identity:
+            try:
+                return int(gtfs_id)
+            except (TypeError, ValueError):
+                return None
+        return self.codes[kind].get(str(gtfs_id))
+
+    def decode(self, kind, code):
+        # Code -> GTFS-ID (immer als String)
+        if code is None:
+            return None
+        if self.is_identity:
+            return str(code)
+        return self.gtfs_ids[kind][int(code)]
+
+    def extended(self, frames):
+        """
+        Gibt ein Wörterbuch zurück, das zusätzlich alle neuen IDs aus frames (Tabellenname -> DataFrame, IDs als
+        Strings) enthält. Vorhandene Codes bleiben unverändert, damit Routen-Hashes und Graph bei einem
+        Update zusammenpassen. Die Identität bleibt Identität.
+        """
+        if self.is_identity:
+            return self
+        gtfs_ids = {kind: list(ids) for kind, ids in self.gtfs_ids.items()}
+        codes = {kind: dict(kind_codes) for kind, kind_codes in self.codes.items()}
+        for table_name, columns in ID_COLUMNS.items():
+            df = frames.get(table_name)
+            if df is None:
+                continue
+            for column, kind in columns.items():
+                if column not in df.columns:
+                    continue
+                for gtfs_id in df[column].dropna().unique().tolist():
+                    gtfs_id = str(gtfs_id)
+                    if gtfs_id not in codes[kind]:
+                        codes[kind][gtfs_id] = len(gtfs_ids[kind])
+                        gtfs_ids[kind].append(gtfs_id)
+        dictionary = IdDictionary.__new__(IdDictionary)
+        dictionary.gtfs_ids = gtfs_ids
+        dictionary.codes = codes
+        logger.debug("ID-Wörterbuch: %s", ", ".join(f"{kind}={dictionary.size(kind)}" for kind in IdKind))
+        return dictionary
+
+    @classmethod
+    def from_frames(cls, frames):
+        return cls({kind: [None] for kind in IdKind}).extended(frames)
+
+    def encode_frames(self, frames):
+        # Ersetzt die ID-Spalten aller Tabellen durch Codes (pandas Int32, fehlende Werte wie parent_station als NA)
+        import pandas as pd
+        encoded = dict(frames)
+        for table_name, columns in ID_COLUMNS.items():
+            df = frames.get(table_name)
+            if df is None:
+                continue
+            df = df.copy()
+            for column, kind in columns.items():
+                if column not in df.columns:
+                    continue
+                if self.is_identity:
+                    # Wie vor dem Wörterbuch (int64, mit fehlenden Werten float64), damit Routen-Hashes gleich bleiben
+                    df[column] = pd.to_numeric(df[column])
+                else:
+                    df[column] = df[column].map(self.codes[kind]).astype("Int32")
+            encoded[table_name] = df
+        return encoded
+
+    def to_records(self):
+        # Zeilen für die Tabelle id_map
+        return [
+            {"kind": kind.value, "code": code, "gtfs_id": gtfs_id}
+            for kind, ids in self.gtfs_ids.items() for code, gtfs_id in enumerate(ids) if code
+        ]
+
+    @classmethod
+    def from_records(cls, records):
+        gtfs_ids = {kind: [None] for kind in IdKind}
+        for record in sorted(records, key=lambda record: (record["kind"], record["code"])):
+            ids = gtfs_ids[IdKind(record["kind"])]
+            # Lücken (sollten nicht vorkommen) mit None auffüllen, damit Index = Code bleibt
+            ids.extend([None] * (int(record["code"]) - len(ids)))
+            ids.append(record["gtfs_id"])
+        return cls(gtfs_ids)
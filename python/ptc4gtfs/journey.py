@@ -0,0 +1,186 @@
+import logging
+from datetime import timedelta
+from enum import StrEnum
+from . import utils
+from . import db as gtfs_db
+from .ids import IdDictionary, IdKind
+
+logger = logging.getLogger(__name__)
+
+# Anzeigename für Kanten ohne Route (Teleport/Fußweg)
+TRANSFER_NAME = "Fußweg/Gleiswechsel"
+
+class LegType(StrEnum):
+    TRANSIT = "transit"
+    TRANSFER = "transfer"
+
+class JourneyMetadata:
+    """
+    Stammdaten (Haltestellen, Routen, Fahrpläne der Trips) für einen oder mehrere Pfade,
+    mit je einer gebündelten Datenbankabfrage geladen. Die Pfade enthalten die Codes der Datenbank,
+    ausgegeben werden die GTFS-IDs (ids).
+    """
+
+    def __init__(self, stops, routes, stop_times, ids: IdDictionary = None):
+        # stop_id -> Haltestelle, route_id -> Route, trip_id -> Halte des Trips
+        self.stops = stops
+        self.routes = routes
+        self.stop_times = stop_times
+        self.ids = ids if ids is not None else IdDictionary.identity()
+
+    @classmethod
+    def from_paths(cls, db: gtfs_db.GTFSDatabase, paths):
+        stop_ids, route_ids, trip_ids = set(), set(), set()
+        for path in paths:
+            for hop in path:
+                stop_ids.add(hop[0])
+                route_id, trip_id = _hop_route_and_trip(hop)
+                if route_id is not None:
+                    route_ids.add(route_id)
+                if trip_id is not None:
+                    trip_ids.add(trip_id)
+        return cls(
+            db.get_stops_by_ids(stop_ids),
+            db.get_routes_by_ids(route_ids),
+            db.get_stop_times_by_trip_ids(trip_ids),
+            db.get_id_dictionary(),
+        )
+
+    def stop_name(self, stop_id):
+        stop = self.stops.get(int(stop_id))
+        return stop[gtfs_db.TB_StopsAttr.STOP_NAME.value] if stop else self.stop_id(stop_id)
+
+    # GTFS-IDs zu den Codes im Pfad
+    def stop_id(self, stop_id):
+        return self.ids.decode(IdKind.STOP, stop_id)
+
+    def route_id(self, route_id):
+        return self.ids.decode(IdKind.ROUTE, route_id)
+
+    def trip_id(self, trip_id):
+        return self.ids.decode(IdKind.TRIP, trip_id)
+
+    def route_name(self, route_id):
+        route = self.routes.get(int(route_id)) if route_id is not None else None
+        if not route:
+            return None
+        return route[gtfs_db.TB_RoutesAttr.ROUTE_SHORT_NAME.value] or route[gtfs_db.TB_RoutesAttr.ROUTE_LONG_NAME.value]
+
+    # Planmäßige Abfahrt (GTFS-Sekunden) eines Trips an einer Haltestelle oder None.
+    def scheduled_departure_seconds(self, trip_id, stop_id):
+        for stop_time in self.stop_times.get(int(trip_id), ()):
+            if int(stop_time[gtfs_db.TB_StopTimesAttr.STOP_ID.value]) == int(stop_id):
+                return utils.parse_gtfs_time(stop_time[gtfs_db.TB_StopTimesAttr.DEPARTURE_TIME.value])
+        return None
+
+def _hop_route_and_trip(hop):
+    # Pfadeinträge: Start (stop_id, None, zeit), sonst (stop_id, route_id, trip_id, zeit)
+    if len(hop) < 4:
+        return None, None
+    return hop[1], hop[2]
+
+def _localize(value, tz):
+    return value.astimezone(tz) if tz is not None and value is not None and value.tzinfo is not None else value
+
+def _scheduled_departure(metadata: JourneyMetadata, trip_id, stop_id, earliest, latest, tz):
+    # Planmäßige Abfahrt als Zeitpunkt zwischen Ankunft am Einstiegshalt und am nächsten Halt.
+    # GTFS-Zeiten zählen ab Betriebstag-Beginn (auch > 24:00), daher Vortag und Tag prüfen.
+    dep_seconds = metadata.scheduled_departure_seconds(trip_id, stop_id)
+    if dep_seconds is None or earliest is None or latest is None or tz is None:
+        return None
+    local_date = earliest.astimezone(tz).date()
+    for service_date in (local_date - timedelta(days=1), local_date):
+        departure = utils.service_day_start(service_date, tz) + timedelta(seconds=dep_seconds)
+        if earliest <= departure <= latest:
+            return departure.astimezone(tz)
+    return None
+
+def _stop_entry(metadata: JourneyMetadata, stop_id, time):
+    stop = metadata.stops.get(int(stop_id))
+    return {
+        "stop_id": metadata.stop_id(stop_id),
+        "stop_name": metadata.stop_name(stop_id),
+        "lat": stop[gtfs_db.TB_StopsAttr.STOP_LAT.value] if stop else None,
+        "lon": stop[gtfs_db.TB_StopsAttr.STOP_LON.value] if stop else None,
+        "arrival_time": time,
+    }
+
+def _group_hops(path):
+    # Fasst aufeinanderfolgende Kanten desselben Trips (bzw. aufeinanderfolgende Umstiegskanten) zusammen
+    groups = []
+    for i in range(1, len(path)):
+        route_id, trip_id = _hop_route_and_trip(path[i])
+        key = (LegType.TRANSIT, trip_id) if route_id is not None else (LegType.TRANSFER, None)
+        if groups and groups[-1][0] == key:
+            groups[-1][1].append(i)
+        else:
+            groups.append((key, [i]))
+    return groups
+
+def build_itinerary(path, metadata: JourneyMetadata, tz=None):
+    """
+    Baut aus einem Pfad (Format von dijkstra.get_shortest_path_ptc4gtfs) eine serialisierbare Verbindung:
+    Abschnitte (legs) pro Fahrt bzw. Umstieg, dazu die Einzelkanten (segments) und Haltestellen (stops)
+    für die Kartenanzeige. Zeiten werden in tz ausgegeben.
+    """
+    if not path:
+        return None
+    times = [_localize(hop[-1], tz) for hop in path]
+    legs = []
+    for (leg_type, trip_id), indices in _group_hops(path):
+        first, last = indices[0] - 1, indices[-1]
+        from_stop_id, to_stop_id = path[first][0], path[last][0]
+        route_id, _ = _hop_route_and_trip(path[last])
+        departure_time = None
+        if leg_type == LegType.TRANSIT:
+            # Fahrplanabfahrt des Trips, sonst Ankunft am Einstiegshalt
+            departure_time = _scheduled_departure(metadata, trip_id, from_stop_id, path[first][-1], path[indices[0]][-1], tz)
+        elif times[first] == times[last] and (first == 0 or last == len(path) - 1):
+            # Gleiswechsel ohne Zeitbedarf am Anfang/Ende (Station <-> Bahnsteig) weglassen
+            continue
+        legs.append({
+            "type": leg_type.value,
+            "route_id": metadata.route_id(route_id),
+            "route_name": metadata.route_name(route_id) if leg_type == LegType.TRANSIT else TRANSFER_NAME,
+            "trip_id": metadata.trip_id(trip_id),
+            "from_stop_id": metadata.stop_id(from_stop_id),
+            "from_stop_name": metadata.stop_name(from_stop_id),
+            "to_stop_id": metadata.stop_id(to_stop_id),
+            "to_stop_name": metadata.stop_name(to_stop_id),
+            "departure_time": departure_time or times[first],
+            "arrival_time": times[last],
+            "stops": [_stop_entry(metadata, path[i][0], times[i]) for i in range(first, last + 1)],
+        })
+
+    # Einzelkanten wie bisher für die Anzeige
+    segments = []
+    for i in range(1, len(path)):
+        route_id, _ = _hop_route_and_trip(path[i])
+        segments.append({
+            "from_stop_name": metadata.stop_name(path[i - 1][0]),
+            "from_stop_id": metadata.stop_id(path[i - 1][0]),
+            "route_id": metadata.route_id(route_id),
+            "route_name": (metadata.route_name(route_id) if route_id is not None else None) or TRANSFER_NAME,
+            "to_stop_name": metadata.stop_name(path[i][0]),
+            "to_stop_id": metadata.stop_id(path[i][0]),
+        })
+
+    # Dauer aus den Originalzeiten (UTC), damit eine Zeitumstellung nicht mitzählt
+    start_time, end_time = path[0][-1], path[-1][-1]
+    transit_legs = sum(1 for leg in legs if leg["type"] == LegType.TRANSIT.value)
+    return {
+        "departure_time": times[0],
+        "arrival_time": times[-1],
+        "duration": (end_time - start_time).total_seconds() if start_time and end_time else None,
+        "transfers": max(transit_legs - 1, 0),
+        "legs": legs,
+        "segments": segments,
+        "stops": [_stop_entry(metadata, hop[0], time) for hop, time in zip(path, times)],
+    }
+
+def build_itineraries(db: gtfs_db.GTFSDatabase, paths, tz=None):
+    # Baut Verbindungen für mehrere Pfade mit einer gemeinsamen, gebündelten Stammdaten-Abfrage
+    metadata = JourneyMetadata.from_paths(db, [path for path in paths if path])
+    if tz is None:
+        tz = db.get_agency_timezone()
+    return [build_itinerary(path, metadata, tz) for path in paths]
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import numpy as np
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Markiert nicht erreichbare Ziele in der Reisezeitmatrix
+UNREACHABLE = np.iinfo(np.uint32).max
+
+def _meta_path(path):
+    return f"{path}.json"
+
+def _done_path(path):
+    return f"{path}.done.npy"
+
+class TravelTimeMatrixWriter:
+    """
+    Schreibt eine Reisezeitmatrix (Sekunden, uint32) zeilenweise in eine .npy-Datei per Memory-Map.
+    Zu jeder Matrix gehören eine Metadatei (<path>.json) mit Stop-IDs (Codes der Datenbank und
+    GTFS-IDs in derselben Reihenfolge) und Abfahrtszeit sowie eine
+    Fortschrittsmaske (<path>.done.npy), damit abgebrochene Läufe fortgesetzt werden können.
+    """
+
+    def __init__(self, path, stop_ids, departure_time, resume=True, gtfs_stop_ids=None):
+        self.path = str(path)
+        self.stop_ids = [int(stop_id) for stop_id in stop_ids]
+        self.index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        meta = {
+            "stop_ids": self.stop_ids,
+            "gtfs_stop_ids": list(gtfs_stop_ids) if gtfs_stop_ids is not None else [str(stop_id) for stop_id in self.stop_ids],
+            "departure_time": departure_time.isoformat(),
+            "unit": "seconds",
+            "unreachable": int(UNREACHABLE),
+        }
+        n = len(self.stop_ids)
+        if resume and self._can_resume(meta):
+            self.matrix = np.load(self.path, mmap_mode="r+")
+            self.done = np.load(_done_path(self.path), mmap_mode="r+")
+            logger.info(f"{utils.YELLOW}Setze Reisezeitmatrix {self.path} fort: {int(self.done.sum())}/{n} Zeilen fertig{utils.RESET}")
+        else:
+            self.matrix = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.uint32, shape=(n, n))
+            self.matrix[:] = UNREACHABLE
+            self.done = np.lib.format.open_memmap(_done_path(self.path), mode="w+", dtype=np.uint8, shape=(n,))
+            with open(_meta_path(self.path), "w") as f:
+                json.dump(meta, f)
+
+    def _can_resume(self, meta):
+        # Nur fortsetzen, wenn Stops und Abfahrtszeit exakt übereinstimmen
+        if not (os.path.exists(self.path) and os.path.exists(_meta_path(self.path)) and os.path.exists(_done_path(self.path))):
+            return False
+        with open(_meta_path(self.path)) as f:
+            old_meta = json.load(f)
+        return old_meta == meta
+
+    # Gibt alle Start-Stop-IDs zurück, deren Zeile noch fehlt.
+    def pending_origins(self):
+        return [stop_id for i, stop_id in enumerate(self.stop_ids) if not self.done[i]]
+
+    # Schreibt die Reisezeiten eines Starts (dict ziel_stop_id -> Sekunden) als Matrixzeile.
+    def write_row(self, origin_stop_id, travel_times):
+        i = self.index[int(origin_stop_id)]
+        row = np.full(len(self.stop_ids), UNREACHABLE, dtype=np.uint32)
+        for stop_id, seconds in travel_times.items():
+            j = self.index.get(int(stop_id))
+            if j is not None and seconds != float('inf'):
+                row[j] = int(seconds)
+        self.matrix[i] = row
+        self.done[i] = 1
+
+    def flush(self):
+        self.matrix.flush()
+        self.done.flush()
+
+def read_travel_time_matrix(path, mmap=True):
+    # Lädt eine Reisezeitmatrix samt Metadaten (stop_ids, Abfahrtszeit)
+    with open(_meta_path(path)) as f:
+        meta = json.load(f)
+    matrix = np.load(str(path), mmap_mode="r" if mmap else None)
+    return meta, matrix
@@ -1,10 +1,8 @@
 from enum import StrEnum
-from ptc4gtfs.db import GTFSDatabase
+from ptc4gtfs.db import GTFSDatabase, RouteType, route_type_bit
 from ptc4gtfs import utils
 import logging
-from tqdm import tqdm
 import pickle
-from enum import StrEnum
 import networkx as nx
 
 logger = logging.getLogger(__name__)
@@ -14,6 +12,8 @@ class EdgeAttr(StrEnum):
     TYPE = "type"
     WEIGHT = "weight"
     ROUTE_ID = 'route_id'
+    # Bit des route_type der Route (db.route_type_bit), nur Transit-Kanten
+    MODE_MASK = 'mode_mask'
 
 class NodeAttr(StrEnum):
     TYPE = "type"
@@ -32,8 +32,22 @@ class NodeType(StrEnum):
     STATION = "parent"
     PLATFORM = "child"
 
-def generate_ptc4gtfs_graph(db: GTFSDatabase, route_ids=[], route_types=[]):
-    print(f"{utils.BRIGHT_BLUE}--------generate-gtfs-graph-by-ptc(route_ids={route_ids}, route_types={route_types})--------")
+# Schlüssel in graph.graph: Filter beim Erzeugen und Inhalts-Hashes der enthaltenen Routen
+GRAPH_ROUTE_IDS = "route_ids"
+GRAPH_ROUTE_TYPES = "route_types"
+GRAPH_ROUTE_HASHES = "route_hashes"
+# True, wenn alle Transit-Kanten eine Verkehrsmittel-Maske (EdgeAttr.MODE_MASK) tragen
+GRAPH_MODE_MASKS = "mode_masks"
+
+# Kanonische Kantenschlüssel im MultiDiGraph: eine Teleport-Kante pro Richtung zwischen Station und
+# Plattform, eine Transit-Kante pro (Haltestellenpaar, Route). Erneutes add_edge mit demselben
+# Schlüssel aktualisiert die Kante, statt eine parallele Kopie anzulegen.
+def edge_key(edge_type, route_id=None):
+    if edge_type == EdgeType.TRANSIT.value:
+        return f"{EdgeType.TRANSIT.value}:{route_id}"
+    return str(edge_type)
+
+def _select_routes(db: GTFSDatabase, route_ids=[], route_types=[]):
     # Wenn route_ids angegeben sind, baue den Graphen nur für diese Routen
     logger.debug("Hole Routen für GTFS-Graph")
     routes = []
@@ -54,56 +68,222 @@ def generate_ptc4gtfs_graph(db: GTFSDatabase, route_ids=[], route_types=[]):
     if len(routes) < 1: 
         logger.info(f"Füge alle Routen aus gtfs.db hinzu")
         routes = db.get_all_routes()
+    return routes
+
+def _add_route_stop_nodes(db: GTFSDatabase, gtfs_graph: nx.MultiDiGraph, route):
+    # Hole alle Haltestellen für die Route inkl. Parent-Station
+    stop_ids = db.get_stops_id_by_route_id(route['route_id'])
+    teleport_key = edge_key(EdgeType.TELEPORT.value)
+    for stop_id in stop_ids:
+        parent_stop = db.get_parent_stop_by_stop_id(stop_id)
+        # Füge Teleport-Kante zwischen Parent und Plattform hinzu (beidseitig, einmal pro Plattform)
+        if not gtfs_graph.has_edge(parent_stop['stop_id'], stop_id, teleport_key):
+            gtfs_graph.add_edge(parent_stop['stop_id'], stop_id, key=teleport_key, weight=0, **{EdgeAttr.TYPE.value: EdgeType.TELEPORT.value})
+            gtfs_graph.add_edge(stop_id, parent_stop['stop_id'], key=teleport_key, weight=0, **{EdgeAttr.TYPE.value: EdgeType.TELEPORT.value})
+
+        # Falls Stations-Knoten noch nicht existiert, füge ihn hinzu
+        if not gtfs_graph.has_node(parent_stop['stop_id']):
+            gtfs_graph.add_node(parent_stop['stop_id'], attr={ NodeAttr.TYPE.value: NodeType.STATION.value})
+        # Füge Plattform-Knoten hinzu, falls noch nicht vorhanden
+        if not gtfs_graph.has_node(stop_id):
+            gtfs_graph.add_node(stop_id, attr={ NodeAttr.TYPE.value: NodeType.PLATFORM.value})   
+
+def _consecutive_segment_seconds(trip_stop_times):
+    # Kürzeste Fahrzeit pro Paar aufeinanderfolgender Halte über alle Trips der Route: (stop_a, stop_b) -> Sekunden
+    segments = {}
+    for stop_times in trip_stop_times.values():
+        for (stop_a, _, departure), (stop_b, arrival, _) in zip(stop_times, stop_times[1:]):
+            seconds = max(arrival - departure, 0)
+            if seconds < segments.get((stop_a, stop_b), seconds + 1):
+                segments[(stop_a, stop_b)] = seconds
+    return segments
+
+def _segment_seconds(trip_stop_times, stop_a, stop_b):
+    # Kürzeste Fahrzeit von stop_a nach stop_b über die Trips der Route, die beide in dieser Reihenfolge bedienen
+    # (Abfahrt an a bis Ankunft an b). Hängt nur vom Fahrplan der Route ab, nicht von Zeilenreihenfolge oder Codes,
+    # damit ein inkrementelles Update dieselben Gewichte liefert wie ein Neuaufbau.
+    best = None
+    for stop_times in trip_stop_times.values():
+        departure = None
+        for stop_id, arrival, dep in stop_times:
+            if stop_id == stop_a:
+                departure = dep
+            elif stop_id == stop_b and departure is not None:
+                seconds = max(arrival - departure, 0)
+                best = seconds if best is None else min(best, seconds)
+                break
+    return best
+
+def _add_route_transit_edges(db: GTFSDatabase, gtfs_graph: nx.MultiDiGraph, route):
+    trips_stops = db.get_hole_route_stops_from_stop_times_by_route_id(route['route_id'])
+    transit_key = edge_key(EdgeType.TRANSIT.value, route['route_id'])
+    mode_mask = route_type_bit(route.get('route_type'))
+    # Fahrzeiten aller Trips der Route, einmal pro Route statt zwei Abfragen pro Kante
+    trip_stop_times = db.get_route_trip_stop_times(route['route_id'])
+    segments = _consecutive_segment_seconds(trip_stop_times)
+    for trip_stops in trips_stops.items():
+        sorted_stops = sorted(trip_stops[1], key=lambda tup: tup[1])
+        # Füge Kanten zwischen aufeinanderfolgenden Haltestellen hinzu
+        for index in range(1, len(sorted_stops)):
+            # Abschnitt schon von einem anderen Muster der Route angelegt (Gewicht hängt nur von Route und Halten ab)
+            if gtfs_graph.has_edge(sorted_stops[index - 1][0], sorted_stops[index][0], transit_key):
+                continue
+            # Debug-Ausgabe für die aktuelle Verbindung
+            logger.debug(f"{utils.BRIGHT_MAGENTA}stop_a({sorted_stops[index - 1]}) ---> stop_b({sorted_stops[index]}){utils.RESET}")
+            # Berechne Gewicht (kürzeste Fahrzeit zwischen den Haltestellen über die Trips der Route)
+            weight = segments.get((sorted_stops[index - 1][0], sorted_stops[index][0]))
+            if weight is None:
+                # Nur im zusammengeführten Muster benachbart (Trips mit ausgelassenen Halten)
+                weight = _segment_seconds(trip_stop_times, sorted_stops[index - 1][0], sorted_stops[index][0])
+            if weight is None:
+                logger.debug(f"Keine Fahrzeit für stop_a({sorted_stops[index - 1][0]}) ---> stop_b({sorted_stops[index][0]}) auf route({route['route_id']})")
+                continue
+            # Füge Kante mit Attributen hinzu
+            gtfs_graph.add_edge(
+                sorted_stops[index - 1][0], 
+                sorted_stops[index][0], 
+                key=transit_key,
+                **{EdgeAttr.TYPE.value: EdgeType.TRANSIT.value}, 
+                **{EdgeAttr.ROUTE_ID.value: route['route_id']}, 
+                **{EdgeAttr.WEIGHT.value: weight},
+                **{EdgeAttr.MODE_MASK.value: mode_mask}
+            )
+    return trips_stops
+
+def _set_graph_build_info(db: GTFSDatabase, gtfs_graph: nx.MultiDiGraph, routes, route_ids, route_types):
+    # Filter und Inhalts-Hashes der enthaltenen Routen im Graphen merken (für update_ptc4gtfs_graph)
+    route_hashes = db.get_route_hashes()
+    gtfs_graph.graph[GRAPH_ROUTE_IDS] = list(route_ids)
+    gtfs_graph.graph[GRAPH_ROUTE_TYPES] = [int(route_type) for route_type in route_types]
+    gtfs_graph.graph[GRAPH_ROUTE_HASHES] = {int(route['route_id']): route_hashes.get(int(route['route_id'])) for route in routes}
+    # Neue Kanten tragen ihre Maske (_add_route_transit_edges), ältere Kanten eines Updates ggf. nicht
+    annotate_mode_masks(db, gtfs_graph)
+
+def annotate_mode_masks(db: GTFSDatabase, gtfs_graph: nx.MultiDiGraph):
+    """
+    Ergänzt die Verkehrsmittel-Maske auf Transit-Kanten ohne EdgeAttr.MODE_MASK (Graphen, die vor den
+    Masken erzeugt wurden). Einmal pro Graph-Objekt, danach merkt sich der Graph GRAPH_MODE_MASKS.
+    Gibt die Anzahl ergänzter Kanten zurück.
+    """
+    if gtfs_graph.graph.get(GRAPH_MODE_MASKS):
+        return 0
+    missing = [
+        attr for _, _, attr in gtfs_graph.edges(data=True)
+        if attr.get(EdgeAttr.TYPE.value) == EdgeType.TRANSIT.value and EdgeAttr.MODE_MASK.value not in attr
+    ]
+    routes = db.get_routes_by_ids({attr[EdgeAttr.ROUTE_ID.value] for attr in missing if attr.get(EdgeAttr.ROUTE_ID.value)})
+    for attr in missing:
+        route = routes.get(int(attr[EdgeAttr.ROUTE_ID.value])) if attr.get(EdgeAttr.ROUTE_ID.value) else None
+        attr[EdgeAttr.MODE_MASK.value] = route_type_bit(route.get('route_type')) if route else 0
+    gtfs_graph.graph[GRAPH_MODE_MASKS] = True
+    if missing:
+        logger.info(f"Verkehrsmittel-Masken für {len(missing)} Transit-Kanten ergänzt")
+    return len(missing)
+
+def generate_ptc4gtfs_graph(db: GTFSDatabase, route_ids=[], route_types=[], file_name="ptc4gtfs_graph.pkl"):
+    from tqdm import tqdm
+    print(f"{utils.BRIGHT_BLUE}--------generate-gtfs-graph-by-ptc(route_ids={route_ids}, route_types={route_types})--------")
+    routes = _select_routes(db, route_ids, route_types)
 
     # Knoten sind alle Haltestellen, Kanten sind alle Verbindungen (Routen)
     # Beginne mit Parent-Stops (Stationen)
     gtfs_graph = nx.MultiDiGraph()
      
     for route in tqdm(routes, desc=f"Füge Stop-Knoten aus Route zum gtfs_graph hinzu", unit="stop_id"):
-        # Hole alle Haltestellen für die Route inkl. Parent-Station
-        stop_ids = db.get_stops_id_by_route_id(route['route_id'])
-        for stop_id in stop_ids:
-            parent_stop = db.get_parent_stop_by_stop_id(stop_id)
-            # Füge Teleport-Kante zwischen Parent und Plattform hinzu (beidseitig)
-            gtfs_graph.add_edge(parent_stop['stop_id'], stop_id, weight=0, **{EdgeAttr.TYPE.value: EdgeType.TELEPORT.value})
-            gtfs_graph.add_edge(stop_id, parent_stop['stop_id'], weight=0, **{EdgeAttr.TYPE.value: EdgeType.TELEPORT.value})
-
-            # Falls Stations-Knoten noch nicht existiert, füge ihn hinzu
-            if not gtfs_graph.has_node(parent_stop['stop_id']):
-                gtfs_graph.add_node(parent_stop['stop_id'], attr={ NodeAttr.TYPE.value: NodeType.STATION.value})
-            # Füge Plattform-Knoten hinzu, falls noch nicht vorhanden
-            if not gtfs_graph.has_node(stop_id):
-                gtfs_graph.add_node(stop_id, attr={ NodeAttr.TYPE.value: NodeType.PLATFORM.value})   
+        _add_route_stop_nodes(db, gtfs_graph, route)
                   
     for route in tqdm(routes, desc=f"Füge Routenkanten zum gtfs_graph hinzu", unit="route"):
-        trips_stops = db.get_hole_route_stops_from_stop_times_by_route_id(route['route_id'])
-        for trip_stops in trips_stops.items():
-            sorted_stops = sorted(trip_stops[1], key=lambda tup: tup[1])
-            # Füge Kanten zwischen aufeinanderfolgenden Haltestellen hinzu
-            for index in range(1, len(sorted_stops)):
-                # Debug-Ausgabe für die aktuelle Verbindung
-                logger.debug(f"{utils.BRIGHT_MAGENTA}stop_a({sorted_stops[index - 1]}) ---> stop_b({sorted_stops[index]}){utils.RESET}")
-                # Berechne Gewicht (Fahrzeit zwischen den Haltestellen)
-                a_trip_stop_times = db.get_trip_stop_by_stop_and_route_id(sorted_stops[index - 1][0], route['route_id'])
-                b_trip_stop_times = db.get_trip_stop_by_stop_and_route_id(sorted_stops[index][0], route['route_id'])
-                weight = utils.diff_seconds(a_trip_stop_times['departure_time'], b_trip_stop_times['arrival_time'])
-                # Füge Kante mit Attributen hinzu
-                gtfs_graph.add_edge(
-                    sorted_stops[index - 1][0], 
-                    sorted_stops[index][0], 
-                    **{EdgeAttr.TYPE.value: EdgeType.TRANSIT.value}, 
-                    **{EdgeAttr.ROUTE_ID.value: route['route_id']}, 
-                    **{EdgeAttr.WEIGHT.value: weight}
-                )
+        trips_stops = _add_route_transit_edges(db, gtfs_graph, route)
+    _set_graph_build_info(db, gtfs_graph, routes, route_ids, route_types)
                             
     print(f"{utils.BRIGHT_BLUE}--------generate-gtfs-graph-by-ptc(route_ids={route_ids}, route_types={route_types})--------{utils.RESET}")
-    logger.debug(f"{utils.REVERSE}{utils.BRIGHT_BLUE} Trips für Route {route['route_id']}:{utils.RESET}\n{utils.BG_BRIGHT_BLUE}{trip_stops}{utils.RESET}")
+    logger.debug(f"{utils.REVERSE}{utils.BRIGHT_BLUE} Trips für Route {route['route_id']}:{utils.RESET}\n{utils.BG_BRIGHT_BLUE}{trips_stops}{utils.RESET}")
     logger.debug(f"{utils.BG_YELLOW}Gefundene Routen in DB: {len(routes)}{utils.RESET}")
     logger.info(f"{utils.BOLD}{utils.BRIGHT_CYAN}GTFS-Graph aus DB erzeugt: Knoten={len(gtfs_graph.nodes)}, Kanten={len(gtfs_graph.edges)}{utils.RESET}")
-    file_name = serialize_networkx_graph(gtfs_graph)
+    file_name = serialize_networkx_graph(gtfs_graph, file_name)
     logger.info(f"{utils.BOLD}{utils.BRIGHT_CYAN}GTFS-Graph serialisiert als {file_name}{utils.RESET}")
     return gtfs_graph
 
+def remove_routes_from_graph(gtfs_graph: nx.MultiDiGraph, route_ids):
+    """
+    Entfernt alle Transit-Kanten der Routen route_ids. Plattformen ohne verbleibende Transit-Kanten
+    werden samt Teleport-Kanten entfernt, danach Stationen ohne Kanten.
+    """
+    route_ids = set(route_ids)
+    stale_edges = [
+        (a, b, key) for a, b, key, attr in gtfs_graph.edges(keys=True, data=True)
+        if attr.get(EdgeAttr.ROUTE_ID.value) in route_ids
+    ]
+    touched = set()
+    for a, b, key in stale_edges:
+        gtfs_graph.remove_edge(a, b, key)
+        touched.update((a, b))
+
+    def has_transit_edge(node):
+        edges = list(gtfs_graph.out_edges(node, data=True)) + list(gtfs_graph.in_edges(node, data=True))
+        return any(attr.get(EdgeAttr.TYPE.value) == EdgeType.TRANSIT.value for _, _, attr in edges)
+
+    stations = set()
+    for node in touched:
+        if not has_transit_edge(node):
+            stations.update(n for n in gtfs_graph.successors(node) if n != node)
+            gtfs_graph.remove_node(node)
+    for node in stations:
+        if gtfs_graph.has_node(node) and gtfs_graph.degree(node) == 0:
+            gtfs_graph.remove_node(node)
+    return len(stale_edges)
+
+def update_ptc4gtfs_graph(db: GTFSDatabase, file_name="ptc4gtfs_graph.pkl"):
+    """
+    Aktualisiert einen gespeicherten Graphen inkrementell: nur Routen, deren Inhalts-Hash in der Datenbank
+    (siehe GTFSDatabase.update_gtfs_feed) vom Stand im Graphen abweicht, werden entfernt und neu eingefügt.
+    Graphen ohne gespeicherte Hashes werden vollständig neu erzeugt.
+    """
+    gtfs_graph = load_networkx_ptc4gtfs_graph(file_name)
+    if gtfs_graph is None or GRAPH_ROUTE_HASHES not in gtfs_graph.graph:
+        logger.warning(f"{utils.YELLOW}{file_name} ohne Routen-Hashes, Graph wird vollständig neu erzeugt{utils.RESET}")
+        return generate_ptc4gtfs_graph(db, file_name=file_name)
+
+    route_ids = gtfs_graph.graph.get(GRAPH_ROUTE_IDS, [])
+    route_types = [RouteType(route_type) for route_type in gtfs_graph.graph.get(GRAPH_ROUTE_TYPES, [])]
+    routes = {int(route['route_id']): route for route in _select_routes(db, route_ids, route_types)}
+    db_hashes = db.get_route_hashes()
+    graph_hashes = gtfs_graph.graph[GRAPH_ROUTE_HASHES]
+
+    stale = {route_id for route_id, content_hash in graph_hashes.items() if route_id not in routes or db_hashes.get(route_id) != content_hash}
+    fresh = [route for route_id, route in routes.items() if route_id not in graph_hashes or route_id in stale]
+    logger.info(f"Inkrementelles Update: {len(stale)} Routen entfernen, {len(fresh)} Routen einfügen (von {len(routes)})")
+
+    from tqdm import tqdm
+    removed_edges = remove_routes_from_graph(gtfs_graph, stale)
+    for route in tqdm(fresh, desc=f"Füge geänderte Routen zum gtfs_graph hinzu", unit="route"):
+        _add_route_stop_nodes(db, gtfs_graph, route)
+        _add_route_transit_edges(db, gtfs_graph, route)
+    _set_graph_build_info(db, gtfs_graph, list(routes.values()), route_ids, route_types)
+
+    logger.info(f"{utils.BOLD}{utils.BRIGHT_CYAN}GTFS-Graph aktualisiert: {removed_edges} Kanten entfernt, Knoten={len(gtfs_graph.nodes)}, Kanten={len(gtfs_graph.edges)}{utils.RESET}")
+    serialize_networkx_graph(gtfs_graph, file_name)
+    return gtfs_graph
+
+def compact_ptc4gtfs_graph(gtfs_graph: nx.MultiDiGraph):
+    """
+    Fasst parallele Kanten zusammen und vergibt kanonische Schlüssel (siehe edge_key): doppelte
+    Teleport-Kanten werden zu einer, parallele Transit-Kanten derselben Route zu einer mit dem
+    kleinsten Gewicht. Für Graphen, die vor den kanonischen Schlüsseln erzeugt wurden.
+    Gibt (Kanten vorher, Kanten nachher) zurück.
+    """
+    edges_before = gtfs_graph.number_of_edges()
+    merged = {}
+    for a, b, attr in gtfs_graph.edges(data=True):
+        key = edge_key(attr.get(EdgeAttr.TYPE.value), attr.get(EdgeAttr.ROUTE_ID.value))
+        current = merged.get((a, b, key))
+        if current is None or attr.get(EdgeAttr.WEIGHT.value, 0) < current.get(EdgeAttr.WEIGHT.value, 0):
+            merged[(a, b, key)] = attr
+    gtfs_graph.remove_edges_from(list(gtfs_graph.edges(keys=True)))
+    gtfs_graph.add_edges_from((a, b, key, attr) for (a, b, key), attr in merged.items())
+    edges_after = gtfs_graph.number_of_edges()
+    logger.info(f"{utils.BOLD}{utils.BRIGHT_CYAN}GTFS-Graph kompaktiert: Kanten {edges_before} -> {edges_after}{utils.RESET}")
+    return edges_before, edges_after
 
 def serialize_networkx_graph(graph, file_name="ptc4gtfs_graph.pkl"):
     with open(file_name, "wb") as f:
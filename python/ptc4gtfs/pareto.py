@@ -0,0 +1,179 @@
+from . import utils
+from datetime import datetime, timedelta
+from . import model
+import logging
+from . import db as gtfs_db
+import heapq
+import itertools
+import networkx as nx
+from .departures import DepartureIndex
+from .stats import QueryStats
+import time
+
+logger = logging.getLogger(__name__)
+
+class Label:
+    """
+    Ein Label der multikriteriellen Suche: Ankunft (Sekunden ab Mitternacht), Umstiege und Gehzeit
+    an einem Knoten, dazu aktuelle Route/Trip und Vorgänger-Label für die Pfadrekonstruktion.
+    Die Gehzeit ist ein Platzhalter für Fußwege (EdgeType.WALK): der Graph enthält bisher keine
+    WALK-Kanten, sie bleibt daher 0 und entscheidet keinen Vergleich.
+    """
+    __slots__ = ("arrival", "transfers", "walk", "node", "route_id", "trip_id", "parent", "alive")
+
+    def __init__(self, arrival, transfers, walk, node, route_id, trip_id, parent):
+        self.arrival = arrival
+        self.transfers = transfers
+        self.walk = walk
+        self.node = node
+        self.route_id = route_id
+        self.trip_id = trip_id
+        self.parent = parent
+        self.alive = True
+
+    # Prüft, ob dieses Label ein anderes in allen Kriterien mindestens gleich gut ist.
+    def dominates(self, other):
+        return self.arrival <= other.arrival and self.transfers <= other.transfers and self.walk <= other.walk
+
+def _dominated_by_bag(bag, label):
+    for other in bag:
+        if other.dominates(label):
+            return True
+    return False
+
+def _insert_into_bag(bag, label):
+    # Fügt label in die Pareto-Menge ein und entfernt nur die Labels, die es dominiert.
+    # Gibt False zurück, wenn das Label selbst dominiert ist und verworfen wurde.
+    if _dominated_by_bag(bag, label):
+        return False
+    kept = []
+    for other in bag:
+        if label.dominates(other):
+            other.alive = False
+        else:
+            kept.append(other)
+    kept.append(label)
+    bag[:] = kept
+    return True
+
+def pareto_ptc4gtfs(db: gtfs_db.GTFSDatabase, graph: nx.MultiDiGraph, start, target=None, departure_time: datetime = None, departures: DepartureIndex = None, max_transfers=5, stats: QueryStats = None, excluded_mask=0):
+    """
+    Label-Setting-Suche mit Pareto-Mengen (Bags) pro Knoten über die Kriterien Ankunftszeit, Anzahl
+    Umstiege und Gehzeit. Die Bags sind nicht in der Größe begrenzt, sondern über max_transfers: jedes
+    Label mit mehr Umstiegen wird verworfen, pro Knoten bleiben so höchstens max_transfers + 1 Labels
+    (solange die Gehzeit 0 ist). Mit target werden Labels verworfen, die bereits von einem Label am
+    Ziel dominiert sind. Gibt (bags, day_start) zurück.
+    """
+    if stats is None:
+        stats = QueryStats()
+    setup_start = time.perf_counter()
+    if departures is None:
+        departures = DepartureIndex.from_db(db)
+    if departure_time is None:
+        departure_time = datetime.now()
+    # Referenz für GTFS-Zeiten ist der Beginn des Betriebstages in der Zeitzone der Abfahrt
+    departure_time, day_start = utils.search_time_reference(departure_time)
+    start_seconds = (departure_time - day_start).total_seconds()
+
+    bags = {start: [Label(start_seconds, 0, 0, start, None, None, None)]}
+    target_bag = bags.setdefault(target, []) if target is not None else None
+    # Zähler als Tie-Breaker, damit Labels im Heap nie direkt verglichen werden
+    counter = itertools.count()
+    queue = [(start_seconds, 0, 0, next(counter), bags[start][0])]
+    nodes_settled = edges_relaxed = heap_pushes = departure_lookups = 0
+    search_start = time.perf_counter()
+    stats.setup_seconds += search_start - setup_start
+    while queue:
+        _, _, _, _, label = heapq.heappop(queue)
+        # Zwischenzeitlich dominierte Labels überspringen
+        if not label.alive:
+            continue
+        if target is not None and label.node == target:
+            continue
+        curr_node = label.node
+        nodes_settled += 1
+
+        for neighbor, edge_list in graph[curr_node].items():
+            for _, edge in edge_list.items():
+                edges_relaxed += 1
+                edge_type = edge[model.EdgeAttr.TYPE.value]
+                weight = edge.get('weight', 1)
+                transfers = label.transfers
+                walk = label.walk
+                edge_route_id = None
+                edge_trip_id = None
+
+                if edge_type == model.EdgeType.TRANSIT.value:
+                    edge_route_id = edge.get('route_id', None)
+                    # Ausgeschlossenes Verkehrsmittel (dijkstra.dijkstra_ptc4gtfs, excluded_mask)
+                    if not edge_route_id or edge.get(model.EdgeAttr.MODE_MASK.value, 0) & excluded_mask:
+                        continue
+                    # Weiterfahrt im selben Trip kostet nur die Fahrzeit
+                    if edge_route_id == label.route_id and label.trip_id and departures.trip_serves_stop(label.trip_id, neighbor):
+                        edge_trip_id = label.trip_id
+                    else:
+                        next_dep = departures.next_departure(curr_node, edge_route_id, label.arrival)
+                        departure_lookups += 1
+                        if next_dep is None:
+                            continue
+                        dep_seconds, edge_trip_id = next_dep
+                        weight += dep_seconds - label.arrival
+                        # Jeder weitere Einstieg ist ein Umstieg
+                        if label.trip_id is not None:
+                            transfers += 1
+                            if transfers > max_transfers:
+                                continue
+                elif edge_type == model.EdgeType.TELEPORT.value:
+                    # Über Teleport-Kanten bleibt man nicht im Fahrzeug
+                    weight = 0
+                elif edge_type == model.EdgeType.WALK.value:
+                    walk += weight
+
+                arrival = label.arrival + weight
+                # Trip merken, damit ein späterer Einstieg als Umstieg zählt
+                trip_for_label = edge_trip_id if edge_trip_id is not None else label.trip_id
+                new_label = Label(arrival, transfers, walk, neighbor, edge_route_id, trip_for_label, label)
+
+                # Pruning gegen bereits gefundene Ziel-Labels
+                if target_bag and _dominated_by_bag(target_bag, new_label):
+                    continue
+                bag = bags.setdefault(neighbor, [])
+                if _insert_into_bag(bag, new_label):
+                    heapq.heappush(queue, (arrival, transfers, walk, next(counter), new_label))
+                    heap_pushes += 1
+
+    stats.searches += 1
+    stats.nodes_settled += nodes_settled
+    stats.edges_relaxed += edges_relaxed
+    stats.heap_pushes += heap_pushes
+    stats.departure_lookups += departure_lookups
+    stats.search_seconds += time.perf_counter() - search_start
+    return bags, day_start
+
+def select_labels(bag, max_labels=None):
+    # Labels eines Bags nach Ankunft; bei mehr als max_labels bleiben die schnellsten und immer das
+    # Label mit den wenigsten Umstiegen, damit der Kompromiss Ankunft/Umstiege sichtbar bleibt
+    labels = sorted(bag, key=lambda l: (l.arrival, l.transfers, l.walk))
+    if max_labels is None or len(labels) <= max_labels:
+        return labels
+    if max_labels <= 1:
+        return labels[:max_labels]
+    fewest_transfers = min(labels, key=lambda l: (l.transfers, l.arrival, l.walk))
+    selected = [label for label in labels if label is not fewest_transfers][:max_labels - 1]
+    return sorted(selected + [fewest_transfers], key=lambda l: (l.arrival, l.transfers, l.walk))
+
+def get_paths_from_bag(bag, day_start, max_paths=None):
+    # Rekonstruiert die Pfade eines Ziel-Bags (höchstens max_paths, siehe select_labels) im Format von dijkstra.get_shortest_path_ptc4gtfs
+    paths = []
+    for label in select_labels(bag, max_paths):
+        path = []
+        current = label
+        while current.parent is not None:
+            arrival = day_start + timedelta(seconds=current.arrival)
+            # Auf Teleport-Kanten gibt es keine Route/Trip
+            trip_id = current.trip_id if current.route_id is not None else None
+            path.append((current.node, current.route_id, trip_id, arrival))
+            current = current.parent
+        path.append((current.node, None, day_start + timedelta(seconds=current.arrival)))
+        paths.append((label, path[::-1]))
+    return paths
@@ -1,10 +1,12 @@
 import networkx as nx
 import matplotlib.pyplot as plt
 from . import utils
+from . import dijkstra
+from . import journey
 import logging
-import random
-from ptc4gtfs.model import *
-from ptc4gtfs.db import *
+from ptc4gtfs.model import EdgeAttr
+from ptc4gtfs.db import GTFSDatabase, RouteType, RouteTypeColor, TB_RoutesAttr
+from ptc4gtfs.ids import IdKind
 
 logger = logging.getLogger(__name__)
 
@@ -12,47 +14,40 @@ def plot_path_only_from_predecessors_networkx_ptc4gtfs_graph(db: GTFSDatabase, a
     """
     Plottet nur den Pfad-Graphen, der durch das predecessors-Dict von start_node zu end_node führt.
     """
-    # Pfad aus Vorgängern rekonstruieren
-    node_predecessors = dict()
-    node_trip_ids = dict()
-    for key, predecessor in predecessors.items():
-        node_predecessors[key] = predecessor[0]
-        node_trip_ids[predecessor[0]] = predecessor[2]
-
-    path = []
-    current = end_node
-    while current != start_node and current is not None:
-        path.append(current)
-        current = node_predecessors.get(current)
-    if current == start_node:
-        path.append(start_node)
-        path = list(reversed(path))
-    else:
+    path = dijkstra.get_shortest_path_ptc4gtfs(predecessors, arrival_times, start_node, end_node)
+    if not path:
         print("Kein Pfad gefunden!")
         return
+    plot_itinerary(journey.build_itineraries(db, [path])[0], figsize, export_path)
+
+
+def plot_itinerary(itinerary, figsize=(8, 4), export_path=None):
+    """
+    Plottet eine Verbindung aus journey.build_itinerary: Haltestellen als Knoten, Fahrten bzw. Umstiege als Kanten.
+    """
+    stops = itinerary['stops']
+    # Trip, mit dem eine Haltestelle erreicht wird
+    stop_trip_ids = {}
+    for leg in itinerary['legs']:
+        for stop in leg['stops'][1:]:
+            stop_trip_ids[stop['stop_id']] = leg['trip_id']
 
     # Erzeuge Graph nur für den Pfad
+    path = [stop['stop_id'] for stop in stops]
     G_path = nx.DiGraph()
-    path_edges = list(zip(path[:-1], path[1:]))
-    G_path.add_edges_from(path_edges)
+    G_path.add_edges_from(zip(path[:-1], path[1:]))
 
     # Labels für Knoten (Name, ID, Zeit, Trip)
     labels = {}
-    for node in G_path.nodes():
-        stop = db.get_stop_by_id(node)
-        stop_name = stop['stop_name'] if stop else node
-        arrival_time = arrival_times[node]
-        labels[node] = f"{stop_name}\nid={node}\n{arrival_time}\ntrip_id={node_trip_ids[node]}"
+    for stop in stops:
+        arrival_time = stop['arrival_time'].strftime("%H:%M:%S") if stop['arrival_time'] else None
+        labels[stop['stop_id']] = f"{stop['stop_name']}\nid={stop['stop_id']}\n{arrival_time}\ntrip_id={stop_trip_ids.get(stop['stop_id'])}"
 
     # Labels für Kanten (Route oder Teleport)
     edge_labels = {}
-    for u, v in G_path.edges():
-        print(f"{u}->{v}")
-        prev = predecessors.get(v)
-        if not prev[1]:
-            edge_labels[(u, v)] = "teleport"
-        else:
-            edge_labels[(u, v)] = db.get_route_name_by_id(prev[1])
+    for segment in itinerary['segments']:
+        edge = (segment['from_stop_id'], segment['to_stop_id'])
+        edge_labels[edge] = segment['route_name'] if segment['route_id'] is not None else "teleport"
 
     spacing = 10  # Abstand zwischen Knoten
     pos = {node: (i * spacing, 0) for i, node in enumerate(path)}
@@ -61,10 +56,103 @@ def plot_path_only_from_predecessors_networkx_ptc4gtfs_graph(db: GTFSDatabase, a
     nx.draw_networkx_labels(G_path, pos, labels=labels, font_size=9)
     nx.draw_networkx_edge_labels(G_path, pos, edge_labels=edge_labels, font_size=8, label_pos=0.5)
     plt.title("Nur Pfad-Graph (mit Stop- und Routen-Namen)")
-    plt.show()
+    # Erst speichern, nach plt.show ist die Figure geschlossen und die Datei wäre leer
     if export_path:
         plt.savefig(export_path, dpi=300, bbox_inches='tight')
+    plt.show()
+
+
+# Ab so vielen Knoten werden keine Namen mehr gezeichnet (Text ist bei großen Netzen der teuerste Teil)
+MAX_LABELS = 500
+# Ab so vielen Kanten werden die Linien in Vektorformaten (SVG/PDF) als Bild eingebettet
+RASTERIZE_EDGES = 20000
+# Rasterweite der Dichtedarstellung in Pixeln (Zellen entlang der längeren Kante des Netzes)
+DENSITY_BINS = 1200
+
+ROUTE_TYPE_COLORS = {
+    RouteType.TRAM.value: RouteTypeColor.TRAM.value,
+    RouteType.UBAHN.value: RouteTypeColor.UBAHN.value,
+    RouteType.ZUG.value: RouteTypeColor.ZUG.value,
+    RouteType.BUS.value: RouteTypeColor.BUS.value,
+}
+
+def _graph_geometry(db: GTFSDatabase, graph: nx.MultiDiGraph):
+    """
+    Lädt Haltestellen und Kanten des Graphen auf einmal als Arrays: Positionen (lon, lat), Namen und
+    Community (Parent-Station) der Knoten sowie Start-/Zielindex und Route jeder Kante.
+    Knoten ohne Position in der Datenbank werden mit ihren Kanten ausgelassen.
+    """
+    import numpy as np
+    import pandas as pd
+    stops = db.get_table_frame('stops', columns=['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station'])
+    stops = stops.dropna(subset=['stop_id', 'stop_lat', 'stop_lon']).drop_duplicates('stop_id')
+    stops = stops.assign(stop_id=stops['stop_id'].astype('int64')).set_index('stop_id')
+
+    nodes = pd.Index(np.fromiter(graph.nodes(), dtype='int64', count=graph.number_of_nodes()))
+    nodes = nodes[nodes.isin(stops.index)]
+    stops = stops.loc[nodes]
+    # Community: Parent-Station, Stationen ohne Parent sind ihre eigene Community
+    community = pd.to_numeric(stops['parent_station'], errors='coerce').fillna(pd.Series(stops.index, index=stops.index))
+
+    edges = graph.edges(data=EdgeAttr.ROUTE_ID.value, default=None)
+    sources, targets, route_ids = (list(column) for column in zip(*edges)) if graph.number_of_edges() else ([], [], [])
+    u = nodes.get_indexer(np.asarray(sources, dtype='int64'))
+    v = nodes.get_indexer(np.asarray(targets, dtype='int64'))
+    # Teleport-Kanten haben keine Route (0 wie in der Suche)
+    route_ids = pd.to_numeric(pd.Series(route_ids, dtype='object'), errors='coerce').fillna(0).astype('int64').to_numpy()
+    keep = (u >= 0) & (v >= 0)
+    return {
+        "nodes": nodes,
+        "lon": stops['stop_lon'].to_numpy(dtype=float),
+        "lat": stops['stop_lat'].to_numpy(dtype=float),
+        "names": stops['stop_name'].tolist(),
+        "community": community.to_numpy(dtype='int64'),
+        "u": u[keep],
+        "v": v[keep],
+        "route_ids": route_ids[keep],
+    }
+
+def _edge_colors(db: GTFSDatabase, route_ids, route_to_color, random_default_route_color, rng):
+    # RGBA pro Kante: Farbe aus route_to_color, sonst zufällig pro Route oder nach Routentyp, sonst grau
+    import numpy as np
+    import pandas as pd
+    from matplotlib.colors import to_rgba_array
+    routes = db.get_table_frame('routes', columns=[TB_RoutesAttr.ROUTE_ID.value, TB_RoutesAttr.ROUTE_TYPE.value])
+    route_colors = {}
+    if random_default_route_color:
+        route_colors.update(zip(routes[TB_RoutesAttr.ROUTE_ID.value].astype('int64'), rng.random((len(routes), 3)).tolist()))
+    else:
+        route_types = pd.to_numeric(routes[TB_RoutesAttr.ROUTE_TYPE.value], errors='coerce').map(ROUTE_TYPE_COLORS)
+        route_colors.update((int(route_id), color) for route_id, color in zip(routes[TB_RoutesAttr.ROUTE_ID.value], route_types) if isinstance(color, str))
+    route_colors.update(route_to_color)
 
+    # Jede Route einmal in RGBA umrechnen, dann pro Kante über den Palettenindex nachschlagen
+    palette = ['grey'] + list(route_colors.values())
+    palette_index = pd.Series(np.arange(1, len(palette)), index=pd.Index(list(route_colors.keys()), dtype='int64'))
+    edge_index = palette_index.reindex(route_ids).fillna(0).astype('int64').to_numpy()
+    return to_rgba_array(palette)[edge_index]
+
+def _density_grid(x, y, u, v, bins):
+    """
+    Rastert die Kanten: Punkte im Abstand einer Zelle entlang jeder Kante, gezählt pro Zelle.
+    Gibt das Raster (Zeilen = y) und die Ausdehnung (xmin, xmax, ymin, ymax) zurück.
+    """
+    import numpy as np
+    xmin, xmax, ymin, ymax = x.min(), x.max(), y.min(), y.max()
+    cell = max(xmax - xmin, ymax - ymin, 1e-9) / bins
+    width = int((xmax - xmin) / cell) + 1
+    height = int((ymax - ymin) / cell) + 1
+
+    x0, y0, x1, y1 = x[u], y[u], x[v], y[v]
+    samples = np.ceil(np.hypot(x1 - x0, y1 - y0) / cell).astype('int64') + 1
+    # Pro Kante samples Punkte bei t = 0 .. 1, ohne Python-Schleife über die Kanten
+    edge = np.repeat(np.arange(len(u)), samples)
+    step = np.arange(len(edge)) - np.repeat(np.cumsum(samples) - samples, samples)
+    t = step / np.maximum(samples - 1, 1)[edge]
+    col = ((x0[edge] + (x1 - x0)[edge] * t - xmin) / cell).astype('int64').clip(0, width - 1)
+    row = ((y0[edge] + (y1 - y0)[edge] * t - ymin) / cell).astype('int64').clip(0, height - 1)
+    grid = np.bincount(row * width + col, minlength=width * height).reshape(height, width)
+    return grid, (xmin, xmin + width * cell, ymin, ymin + height * cell)
 
 def plot_graph(db: GTFSDatabase, graph: nx.MultiDiGraph, route_to_color={
         17462: "#52822f",   # U1
@@ -75,117 +163,72 @@ def plot_graph(db: GTFSDatabase, graph: nx.MultiDiGraph, route_to_color={
         21507: "#0065ae",   # U6
         17359: "#52822f",   # U7 (wie U1)
         12888: "#c20831",   # U8 (wie U2)
-    }, random_default_route_color=True, export_path=None
+    }, random_default_route_color=True, export_path=None, density=False, show=None, figsize=(10, 10), dpi=300,
+    max_labels=MAX_LABELS, seed=0
 ):
+    """
+    Zeichnet den Graphen auf Geo-Positionen: alle Kanten als eine LineCollection, alle Knoten mit einem scatter.
+    density=True zeichnet statt der Linien die Liniendichte als Rasterbild (für landesweite Netze).
+    Mit export_path (Format aus der Endung, z.B. .svg oder .png) wird ohne Fenster gespeichert, außer show=True.
+    """
+    import time
+    import numpy as np
+    from matplotlib.collections import LineCollection
+    start = time.perf_counter()
+    show = export_path is None if show is None else show
     logger.info(f"{utils.BRIGHT_CYAN}Plot ptc4gtfs_graph({graph}) with route_to_color({route_to_color}){utils.RESET}")
-    # Community-Zuordnung für Parent-Stationen
-    node_to_community = dict()
-    community_to_color = dict()
-    parent_stations = db.get_all_parent_station()
-    for parent_station in parent_stations:
-        # Child-Stations zuordnen
-        child_stations = db.get_all_child_stops(float(parent_station['stop_id']))
-        node_to_community[parent_station['stop_id']] = parent_station['stop_id']
-        for child_station in child_stations:
-            node_to_community[child_station['stop_id']] = parent_station['stop_id']
-        # Farbe für Community setzen
-        community_to_color[parent_station['stop_id']] = "#%06x" % random.randint(0, 0xFFFFFF)
-    
-    # Geo-Positionen für alle Stops
-    raw_pos = {
-        stop['stop_id']: (stop['stop_lon'], stop['stop_lat'])
-        for stop in db.get_all_stops()
-    }
-    scale = 1000
-    pos = {
-        n: (raw_pos[n][0] * scale, raw_pos[n][1] * scale)
-        for n in graph.nodes() if n in raw_pos
-    }
-
-    # Farben und Labels für Knoten
-    node_colors = [
-        [node_to_community[n]]
-        for n in graph.nodes() if n in pos
-    ]
-    node_list = [n for n in graph.nodes() if n in pos]
-    labels = {n: db.get_stop_by_id(n)['stop_name'] for n in node_list}
-
-    # Farben für Kanten bestimmen
-    if random_default_route_color:
-        routes_of_db = db.get_all_routes()
-        for route in routes_of_db:
-            if route[TB_RoutesAttr.ROUTE_ID.value] not in route_to_color:
-                route_to_color[route[EdgeAttr.ROUTE_ID.value]] = "#%06x" % random.randint(0, 0xFFFFFF)
-    
-    egde_colors = []
-    for a, b, attr in graph.edges(data=True):
-        # Standardfarbe, falls keine Route zugeordnet
-        if not EdgeAttr.ROUTE_ID.value in attr:
-            egde_colors.append('grey')
-            continue
-
-        # Farbe aus Dictionary
-        if attr[EdgeAttr.ROUTE_ID.value] in route_to_color:
-            EdgeAttr.ROUTE_ID.value
-            egde_colors.append(route_to_color[attr[EdgeAttr.ROUTE_ID.value]])
-            continue
-
-        # Farbe nach Routentyp
-        route = db.get_route_by_id(attr[EdgeAttr.ROUTE_ID.value])
-        if route:
-            route_type = route[TB_RoutesAttr.ROUTE_TYPE.value] 
-            if route_type == RouteType.ZUG.value:
-                egde_colors.append(RouteTypeColor.ZUG.value)
-                continue
-            
-            if route_type == RouteType.TRAM.value:
-                egde_colors.append(RouteTypeColor.TRAM.value)
-                continue
-                
-            if route_type == RouteType.BUS.value:
-                egde_colors.append(RouteTypeColor.BUS.value)
-                continue
-                
-            if route_type == RouteType.UBAHN.value:
-                egde_colors.append(RouteTypeColor.UBAHN.value)
-                continue
-
-        # Standardfarbe
-        egde_colors.append('grey')  
-
-    # Plot erstellen
-    fig, ax = plt.subplots(figsize=(10,10))
-
-    # Kanten zeichnen
-    nx.draw_networkx_edges(
-        graph.subgraph(node_list),
-        pos,
-        ax=ax,
-        width=0.5,
-        alpha=0.3,
-        edge_color=egde_colors
-    )
-    # Knoten zeichnen
-    nx.draw_networkx_nodes(
-        graph.subgraph(node_list),
-        pos,
-        node_size=50,
-        node_color=node_colors,
-        ax=ax
-    )
-    # Labels zeichnen
-    nx.draw_networkx_labels(
-        graph.subgraph(node_list),
-        pos,
-        labels=labels,
-        font_size=6,
-        ax=ax
-    )
-
-    # Achsen ausblenden, Layout anpassen
-    ax.set_aspect('equal')
+    # Farben sind nach GTFS-Route-ID angegeben, Graph und Datenbank verwenden die Codes
+    ids = db.get_id_dictionary()
+    route_to_color = {ids.encode(IdKind.ROUTE, route_id): color for route_id, color in route_to_color.items()}
+    route_to_color = {route_id: color for route_id, color in route_to_color.items() if route_id is not None}
+    rng = np.random.default_rng(seed)
+
+    geometry = _graph_geometry(db, graph)
+    x, y = geometry["lon"], geometry["lat"]
+    u, v = geometry["u"], geometry["v"]
+    logger.debug(f"Plot: {len(x)} Knoten, {len(u)} Kanten geladen in {time.perf_counter() - start:.2f} s")
+
+    # Ohne Anzeige kein pyplot: Figure mit Agg-Canvas braucht kein Display
+    if show:
+        fig, ax = plt.subplots(figsize=figsize)
+    else:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+
+    if len(x) and density:
+        grid, extent = _density_grid(x, y, u, v, DENSITY_BINS)
+        ax.imshow(np.log1p(grid), origin='lower', extent=extent, cmap='magma', interpolation='nearest')
+        ax.set_facecolor('black')
+    elif len(x):
+        # Doppelte Kanten gleicher Farbe (Hin- und Rückrichtung, mehrere Routen) nur einmal zeichnen
+        colors = _edge_colors(db, geometry["route_ids"], route_to_color, random_default_route_color, rng)
+        pairs = np.column_stack([np.minimum(u, v), np.maximum(u, v), (colors * 255).astype('int64') @ (256 ** np.arange(4))])
+        _, unique = np.unique(pairs, axis=0, return_index=True)
+        segments = np.stack([np.column_stack([x[u], y[u]]), np.column_stack([x[v], y[v]])], axis=1)[unique]
+        edges = LineCollection(segments, colors=colors[unique], linewidths=0.5, alpha=0.3, rasterized=len(unique) > RASTERIZE_EDGES)
+        ax.add_collection(edges)
+
+        # Knoten nach Community einfärben (zufällige Farbe pro Parent-Station)
+        communities, community_index = np.unique(geometry["community"], return_inverse=True)
+        node_colors = rng.random((len(communities), 3))[community_index]
+        small = len(x) <= max_labels
+        ax.scatter(x, y, s=50 if small else 1, c=node_colors, linewidths=0, zorder=2, rasterized=not small)
+        if small:
+            for lon, lat, name in zip(x, y, geometry["names"]):
+                ax.text(lon, lat, name, fontsize=6, ha='center', va='center', zorder=3)
+        ax.autoscale_view()
+
+    # Längengrade auf die Breite des Netzes stauchen, damit Abstände ungefähr stimmen; Achsen ausblenden
+    if len(y):
+        ax.set_aspect(1 / np.cos(np.radians(np.mean(y))))
     ax.axis('off')
-    plt.tight_layout()
-    plt.show()
+    fig.tight_layout()
     if export_path:
-        plt.savefig(export_path, dpi=300, bbox_inches='tight')
+        fig.savefig(export_path, dpi=dpi, bbox_inches='tight')
+        logger.info(f"{utils.GREEN}Plot gespeichert: {export_path} ({time.perf_counter() - start:.2f} s){utils.RESET}")
+    if show:
+        plt.show()
+    return fig
@@ -1,26 +1,317 @@
 import logging
-from ptc4gtfs.db import *
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from ptc4gtfs.db import GTFSDatabase, TB_StopsAttr, route_type_mask
 import networkx as nx
 from . import dijkstra
+from . import model
+from . import pareto
+from . import utils
+from .departures import DepartureIndex
+from .ids import IdKind
+from .stats import QueryStats, collecting, timed
+from .model import EdgeAttr, EdgeType
+from .matrix import TravelTimeMatrixWriter
 
 logger = logging.getLogger(__name__)
 
-def find_path_in_ptc4gtfs_graph(db: GTFSDatabase, a_stop_id, b_stop_id, ptc4gtfs_graph: nx.MultiDiGraph=None):
-    logger.info(f"Suche kürzeste Wege im ptc4gtfs-Graph: a_stop({a_stop_id})->b_stop({b_stop_id})")
+def _departures_for(db: GTFSDatabase, departure_time: datetime, departures: DepartureIndex=None):
+    # Abfahrtsindex für den Betriebstag der Abfahrt, ohne departures_today anzufassen
+    if departures is None:
+        departures = DepartureIndex.for_service_date(db, departure_time.date())
+    return departures
+
+class PathResult(tuple):
+    # (distances, predecessors, arrival_times, path) wie bisher, zusätzlich die Messwerte der Suche in .stats
+    def __new__(cls, distances, predecessors, arrival_times, path, stats: QueryStats):
+        result = super().__new__(cls, (distances, predecessors, arrival_times, path))
+        result.stats = stats
+        return result
+
+def _excluded_mask(db: GTFSDatabase, ptc4gtfs_graph: nx.MultiDiGraph, excluded_route_types):
+    # Maske der ausgeschlossenen Verkehrsmittel; Graphen ohne Kanten-Masken werden einmalig ergänzt
+    excluded_mask = route_type_mask(excluded_route_types)
+    if excluded_mask:
+        model.annotate_mode_masks(db, ptc4gtfs_graph)
+    return excluded_mask
+
+def _search_for(contracted):
+    # Suche mit Stationen als Einheit (contraction.py) oder auf dem Graphen mit Teleport-Kanten
+    return dijkstra.dijkstra_ptc4gtfs_contracted if contracted else dijkstra.dijkstra_ptc4gtfs
+
+def find_path_in_ptc4gtfs_graph(db: GTFSDatabase, a_stop_id, b_stop_id, ptc4gtfs_graph: nx.MultiDiGraph=None, departure_time: datetime=None, departures: DepartureIndex=None, stats: QueryStats=None, contracted=False, bidirectional=False, excluded_route_types=None):
+    # bidirectional: Vorwärtssuche mit unteren Schranken aus einer statischen Rückwärtssuche vom Ziel, endet am Ziel
+    # (dijkstra.dijkstra_ptc4gtfs_bidirectional); predecessors/arrival_times enthalten dann nur die abgearbeiteten Knoten
+    # excluded_route_types: Verkehrsmittel (RouteType), deren Transit-Kanten die Suche überspringt
+    if contracted and bidirectional:
+        raise ValueError("contracted und bidirectional können nicht kombiniert werden")
+    logger.info("Suche kürzeste Wege im ptc4gtfs-Graph: a_stop(%s)->b_stop(%s)", a_stop_id, b_stop_id)
     a_stop_id = int(a_stop_id)
     b_stop_id = int(b_stop_id)
     # Prüfe, ob Start- und Zielknoten im Graphen vorhanden sind
     if not ptc4gtfs_graph.has_node(a_stop_id):
-        logger.fatal(f"Graph enthält a_stop({a_stop_id}) nicht")
+        logger.fatal("Graph enthält a_stop(%s) nicht", a_stop_id)
+        return None
+    if not ptc4gtfs_graph.has_node(b_stop_id):
+        logger.fatal("Graph enthält b_stop(%s) nicht", b_stop_id)
+        return None
+    stats = stats if stats is not None else QueryStats()
+    with collecting(stats):
+        # Abfahrtszeit in der Agentur-Zeitzone, daraus ergibt sich der Betriebstag
+        with timed(stats, "setup_seconds"):
+            departure_time = utils.resolve_departure_time(departure_time, db.get_agency_timezone())
+            departures = _departures_for(db, departure_time, departures)
+            excluded_mask = _excluded_mask(db, ptc4gtfs_graph, excluded_route_types)
+        # Starte Dijkstra-Algorithmus ab Startknoten
+        if bidirectional:
+            distances, predecessors, arrival_times = dijkstra.dijkstra_ptc4gtfs_bidirectional(db, ptc4gtfs_graph, a_stop_id, b_stop_id, departure_time, departures, stats=stats, excluded_mask=excluded_mask)
+        else:
+            distances, predecessors, arrival_times = _search_for(contracted)(db, ptc4gtfs_graph, a_stop_id, departure_time, departures, stats=stats, excluded_mask=excluded_mask)
+        # Berechne kürzesten Pfad von Start zu Ziel
+        with timed(stats, "reconstruction_seconds"):
+            path = dijkstra.get_shortest_path_ptc4gtfs(predecessors, arrival_times, a_stop_id, b_stop_id)
+    logger.debug("a_stop(%s)->b_stop(%s): Kürzester Pfad:\n%s", a_stop_id, b_stop_id, path)
+    logger.info("Suche im ptc4gtfs-Graph beendet: a_stop(%s)->b_stop(%s)", a_stop_id, b_stop_id)
+    return PathResult(distances, predecessors, arrival_times, path, stats)
+
+def find_path_arrive_by_in_ptc4gtfs_graph(db: GTFSDatabase, a_stop_id, b_stop_id, ptc4gtfs_graph: nx.MultiDiGraph=None, arrival_time: datetime=None, departures: DepartureIndex=None, stats: QueryStats=None, excluded_route_types=None):
+    """
+    Ankunft-bis-Suche: späteste Verbindung von a nach b, die spätestens arrival_time ankommt.
+    Eine Rückwärtssuche vom Ziel (dijkstra.dijkstra_ptc4gtfs_reverse) statt vieler Vorwärtssuchen mit
+    verschiedenen Abfahrtszeiten. Rückgabe wie find_path_in_ptc4gtfs_graph; predecessors und arrival_times
+    beschreiben den gefundenen Pfad, distances sind Sekunden vor arrival_time.
+    """
+    logger.info("Suche späteste Verbindung im ptc4gtfs-Graph: a_stop(%s)->b_stop(%s)", a_stop_id, b_stop_id)
+    a_stop_id = int(a_stop_id)
+    b_stop_id = int(b_stop_id)
+    if not ptc4gtfs_graph.has_node(a_stop_id):
+        logger.fatal("Graph enthält a_stop(%s) nicht", a_stop_id)
+        return None
+    if not ptc4gtfs_graph.has_node(b_stop_id):
+        logger.fatal("Graph enthält b_stop(%s) nicht", b_stop_id)
+        return None
+    stats = stats if stats is not None else QueryStats()
+    with collecting(stats):
+        # Ankunftszeit in der Agentur-Zeitzone, daraus ergibt sich der Betriebstag
+        with timed(stats, "setup_seconds"):
+            arrival_time = utils.resolve_departure_time(arrival_time, db.get_agency_timezone())
+            departures = _departures_for(db, arrival_time, departures)
+            excluded_mask = _excluded_mask(db, ptc4gtfs_graph, excluded_route_types)
+        distances, successors, departure_times = dijkstra.dijkstra_ptc4gtfs_reverse(db, ptc4gtfs_graph, b_stop_id, arrival_time, departures, stats=stats, excluded_mask=excluded_mask)
+        with timed(stats, "reconstruction_seconds"):
+            path = dijkstra.get_shortest_path_ptc4gtfs_reverse(successors, departure_times, a_stop_id, b_stop_id)
+    # Vorgänger und Ankunftszeiten entlang des Pfades wie bei der Vorwärtssuche (für Ausgabe und Plot)
+    predecessors = {}
+    arrival_times = {a_stop_id: departure_times[a_stop_id]} if path else {}
+    for (prev_node, *_), (node, route_id, trip_id, node_arrival) in zip(path, path[1:]):
+        predecessors[node] = (prev_node, route_id, trip_id)
+        arrival_times[node] = node_arrival
+    logger.debug("a_stop(%s)->b_stop(%s): Späteste Verbindung:\n%s", a_stop_id, b_stop_id, path)
+    logger.info("Suche im ptc4gtfs-Graph beendet: a_stop(%s)->b_stop(%s)", a_stop_id, b_stop_id)
+    return PathResult(distances, predecessors, arrival_times, path, stats)
+
+def find_alternatives_in_ptc4gtfs_graph(db: GTFSDatabase, a_stop_id, b_stop_id, ptc4gtfs_graph: nx.MultiDiGraph, departure_time: datetime=None, max_alternatives=3, max_transfers=5, departures: DepartureIndex=None, stats: QueryStats=None, excluded_route_types=None):
+    """
+    Multikriterielle Suche (Ankunftszeit, Umstiege, Gehzeit) mit Pareto-Mengen pro Knoten.
+    Gibt bis zu max_alternatives Alternativen aufsteigend nach Ankunft zurück (Liste von Dicts) oder None;
+    die Verbindung mit den wenigsten Umstiegen ist immer dabei (pareto.select_labels).
+    """
+    logger.info("Suche Alternativen im ptc4gtfs-Graph: a_stop(%s)->b_stop(%s)", a_stop_id, b_stop_id)
+    a_stop_id = int(a_stop_id)
+    b_stop_id = int(b_stop_id)
+    if not ptc4gtfs_graph.has_node(a_stop_id):
+        logger.fatal("Graph enthält a_stop(%s) nicht", a_stop_id)
         return None
     if not ptc4gtfs_graph.has_node(b_stop_id):
-        logger.fatal(f"Graph enthält b_stop({b_stop_id}) nicht")
+        logger.fatal("Graph enthält b_stop(%s) nicht", b_stop_id)
         return None
-    # Starte Dijkstra-Algorithmus ab Startknoten
-    distances, predecessors, arrival_times = dijkstra.dijkstra_ptc4gtfs(db, ptc4gtfs_graph, a_stop_id)
-    # Berechne kürzesten Pfad von Start zu Ziel
-    path = dijkstra.get_shortest_path_ptc4gtfs(predecessors, arrival_times, a_stop_id, b_stop_id)    
-    logger.debug(f"a_stop({a_stop_id})->b_stop({b_stop_id}): Kürzester Pfad:\n{path}")
-    logger.info(f"Suche im ptc4gtfs-Graph beendet: a_stop({a_stop_id})->b_stop({b_stop_id})")
-    return (distances, predecessors, arrival_times, path)
+    stats = stats if stats is not None else QueryStats()
+    with collecting(stats):
+        with timed(stats, "setup_seconds"):
+            departure_time = utils.resolve_departure_time(departure_time, db.get_agency_timezone())
+            departures = _departures_for(db, departure_time, departures)
+            excluded_mask = _excluded_mask(db, ptc4gtfs_graph, excluded_route_types)
+        bags, day_start = pareto.pareto_ptc4gtfs(
+            db, ptc4gtfs_graph, a_stop_id, b_stop_id, departure_time, departures,
+            max_transfers=max_transfers, stats=stats, excluded_mask=excluded_mask
+        )
+        with timed(stats, "reconstruction_seconds"):
+            paths = pareto.get_paths_from_bag(bags.get(b_stop_id, []), day_start, max_alternatives)
+    alternatives = []
+    for label, path in paths:
+        arrival_time = day_start + timedelta(seconds=label.arrival)
+        # Dauer in UTC rechnen, Ausgabe in der Agentur-Zeitzone
+        alternatives.append({
+            "departure_time": departure_time,
+            "arrival_time": arrival_time.astimezone(departure_time.tzinfo),
+            "duration": (arrival_time - departure_time.astimezone(timezone.utc)).total_seconds(),
+            "transfers": label.transfers,
+            "walk_seconds": label.walk,
+            "path": path,
+        })
+    logger.info("Suche nach Alternativen beendet: %d Pareto-optimale Verbindungen", len(alternatives))
+    return alternatives
+
+# Sammelt alle Abfahrtszeiten (Sekunden) im Fenster an den Plattformen, die vom Start per Teleport erreichbar sind
+def _profile_departure_candidates(ptc4gtfs_graph: nx.MultiDiGraph, departures: DepartureIndex, a_stop_id, start_seconds, end_seconds, excluded_mask=0):
+    candidates = set()
+    boarding_nodes = {a_stop_id}
+    boarding_nodes.update(
+        neighbor for neighbor, edge_list in ptc4gtfs_graph[a_stop_id].items()
+        if any(edge[EdgeAttr.TYPE.value] == EdgeType.TELEPORT.value for edge in edge_list.values())
+    )
+    for node in boarding_nodes:
+        for _, edge_list in ptc4gtfs_graph[node].items():
+            for edge in edge_list.values():
+                if edge[EdgeAttr.TYPE.value] == EdgeType.TRANSIT.value and edge.get(EdgeAttr.ROUTE_ID.value) and not edge.get(EdgeAttr.MODE_MASK.value, 0) & excluded_mask:
+                    candidates.update(departures.departures_between(node, edge[EdgeAttr.ROUTE_ID.value], start_seconds, end_seconds))
+    return sorted(candidates)
+
+def find_profile_in_ptc4gtfs_graph(db: GTFSDatabase, a_stop_id, b_stop_id, ptc4gtfs_graph: nx.MultiDiGraph, departure_time: datetime=None, window_minutes=60, max_results=5, departures: DepartureIndex=None, stats: QueryStats=None, contracted=False, excluded_route_types=None):
+    """
+    Profilsuche (rRAPTOR-Stil): findet alle Pareto-optimalen Verbindungen (Abfahrt, Ankunft) von a nach b
+    mit Abfahrt im Fenster [departure_time, departure_time + window_minutes].
+    Die Abfahrten am Start werden von der spätesten zur frühesten durchsucht. Ankunftszeiten späterer
+    Abfahrten bleiben als Schranken erhalten, sodass frühere Suchen dominierte Teilbäume sofort abschneiden.
+    Gibt bis zu max_results Verbindungen aufsteigend nach Abfahrt zurück (Liste von Dicts) oder None.
+    """
+    logger.info("Profilsuche im ptc4gtfs-Graph: a_stop(%s)->b_stop(%s), Fenster=%s min", a_stop_id, b_stop_id, window_minutes)
+    a_stop_id = int(a_stop_id)
+    b_stop_id = int(b_stop_id)
+    if not ptc4gtfs_graph.has_node(a_stop_id):
+        logger.fatal("Graph enthält a_stop(%s) nicht", a_stop_id)
+        return None
+    if not ptc4gtfs_graph.has_node(b_stop_id):
+        logger.fatal("Graph enthält b_stop(%s) nicht", b_stop_id)
+        return None
+    stats = stats if stats is not None else QueryStats()
+    with collecting(stats), timed(stats, "setup_seconds"):
+        departure_time = utils.resolve_departure_time(departure_time, db.get_agency_timezone())
+        departures = _departures_for(db, departure_time, departures)
+        excluded_mask = _excluded_mask(db, ptc4gtfs_graph, excluded_route_types)
+    tz = departure_time.tzinfo
+
+    utc_departure_time, day_start = utils.search_time_reference(departure_time)
+    start_seconds = (utc_departure_time - day_start).total_seconds()
+    candidates = _profile_departure_candidates(ptc4gtfs_graph, departures, a_stop_id, start_seconds, start_seconds + window_minutes * 60, excluded_mask)
+
+    # node -> früheste Ankunft über alle bisher (später) gestarteten Suchen
+    arrival_bounds = {}
+    journeys = []
+    for dep_seconds in reversed(candidates):
+        # Abfahrt in der Agentur-Zeitzone; der Betriebstag bleibt der des Fensters, auch nach Mitternacht
+        dep_time = (day_start + timedelta(seconds=dep_seconds)).astimezone(tz)
+        _, predecessors, arrival_times = _search_for(contracted)(db, ptc4gtfs_graph, a_stop_id, dep_time, departures, arrival_bounds, stats=stats, excluded_mask=excluded_mask, day_start=day_start)
+        for node, arrival in arrival_times.items():
+            if arrival is not None and node != a_stop_id:
+                arrival_bounds[node] = arrival
+        # Ziel nicht verbessert -> Verbindung ist von einer späteren Abfahrt dominiert
+        if b_stop_id not in predecessors or (journeys and arrival_times[b_stop_id] >= journeys[-1]["arrival_time"]):
+            continue
+        with timed(stats, "reconstruction_seconds"):
+            path = dijkstra.get_shortest_path_ptc4gtfs(predecessors, arrival_times, a_stop_id, b_stop_id)
+        # Dauer in UTC rechnen, Ausgabe in der Agentur-Zeitzone
+        journeys.append({
+            "departure_time": dep_time.astimezone(tz),
+            "arrival_time": arrival_times[b_stop_id].astimezone(tz),
+            "duration": (arrival_times[b_stop_id] - dep_time).total_seconds(),
+            "path": path,
+        })
+
+    journeys.reverse()
+    logger.info("Profilsuche beendet: %d Pareto-optimale Verbindungen aus %d Abfahrten", len(journeys), len(candidates))
+    return journeys[:max_results]
+
+def departure_board(db: GTFSDatabase, stop_id, departure_time: datetime=None, n=10, departures: DepartureIndex=None, stats: QueryStats=None):
+    """
+    Abfahrtstafel: die nächsten n Abfahrten ab departure_time an einer Station über alle ihre Steige
+    (bzw. an der Haltestelle selbst), direkt aus dem Abfahrtsindex statt über eine Suche oder departures_today.
+    Steige und Routennamen kommen aus dem Stammdaten-Cache der Datenbank, nach dem ersten Aufruf pro
+    Station also ohne Datenbankzugriff. Gibt eine Liste von Dicts nach Abfahrt sortiert zurück.
+    """
+    stats = stats if stats is not None else QueryStats()
+    with collecting(stats):
+        with timed(stats, "setup_seconds"):
+            departure_time = utils.resolve_departure_time(departure_time, db.get_agency_timezone())
+            departures = _departures_for(db, departure_time, departures)
+            platforms = db.get_station_platforms(stop_id)
+            route_names = db.get_route_names()
+        tz = departure_time.tzinfo
+        with timed(stats, "search_seconds"):
+            utc_departure_time, day_start = utils.search_time_reference(departure_time)
+            after_seconds = (utc_departure_time - day_start).total_seconds()
+            stats.departure_lookups += len(platforms)
+            entries = departures.next_departures([platform_id for platform_id, _, _ in platforms], after_seconds, n)
+    platform_by_id = {platform_id: (name, code) for platform_id, name, code in platforms}
+    # Ausgabe mit GTFS-IDs, Eingabe stop_id ist der Code der Datenbank
+    ids = db.get_id_dictionary()
+    board = []
+    for dep_seconds, platform_id, route_id, trip_id in entries:
+        name, code = platform_by_id[platform_id]
+        board.append({
+            "departure_time": (day_start + timedelta(seconds=dep_seconds)).astimezone(tz),
+            "stop_id": ids.decode(IdKind.STOP, platform_id),
+            "stop_name": name,
+            "platform_code": code,
+            "route_id": ids.decode(IdKind.ROUTE, route_id),
+            "route_name": route_names.get(route_id),
+            "trip_id": ids.decode(IdKind.TRIP, trip_id),
+        })
+    logger.debug("Abfahrtstafel stop(%s): %d Abfahrten an %d Steigen", stop_id, len(board), len(platforms))
+    return board
+
+# Geteilter Zustand der Worker-Prozesse für die Reisezeitmatrix (Graph und Abfahrtsindex)
+_matrix_worker_state = {}
+
+def _init_travel_time_matrix_worker(graph, departures, departure_time, target_stop_ids):
+    # Wird einmal pro Worker-Prozess aufgerufen, damit nicht jede Suche den Fahrplan neu lädt
+    _matrix_worker_state["graph"] = graph
+    _matrix_worker_state["departures"] = departures
+    _matrix_worker_state["departure_time"] = departure_time
+    _matrix_worker_state["target_stop_ids"] = target_stop_ids
+
+def _travel_times_from_origin(origin_stop_id):
+    # One-to-all-Suche ab einem Start, gibt nur die Reisezeiten zu den Zielen zurück
+    state = _matrix_worker_state
+    distances, _, _ = dijkstra.dijkstra_ptc4gtfs(None, state["graph"], origin_stop_id, state["departure_time"], state["departures"])
+    return origin_stop_id, {stop_id: distances.get(stop_id, float('inf')) for stop_id in state["target_stop_ids"]}
+
+def compute_travel_time_matrix(db: GTFSDatabase, ptc4gtfs_graph: nx.MultiDiGraph, output_path, departure_time: datetime=None, stop_ids=None, workers=None, resume=True):
+    """
+    Berechnet eine Reisezeitmatrix (alle stop_ids x alle stop_ids) zur Abfahrtszeit departure_time.
+    Pro Start läuft eine One-to-all-Suche in einem Prozess-Pool, der Graph und Abfahrtsindex nur einmal
+    pro Worker erhält. Zeilen werden sofort in output_path geschrieben, ein erneuter Aufruf setzt fort.
+    Ohne stop_ids werden alle Parent-Stationen im Graphen verwendet.
+    """
+    departure_time = utils.resolve_departure_time(departure_time, db.get_agency_timezone())
+    if stop_ids is None:
+        stop_ids = [int(stop[TB_StopsAttr.STOP_ID.value]) for stop in db.get_all_parent_station(ptc4gtfs_graph)]
+    stop_ids = [int(stop_id) for stop_id in stop_ids if ptc4gtfs_graph.has_node(int(stop_id))]
+    logger.info(f"Berechne Reisezeitmatrix für {len(stop_ids)} Stationen ab {departure_time} nach {output_path}")
+
+    ids = db.get_id_dictionary()
+    writer = TravelTimeMatrixWriter(output_path, stop_ids, departure_time, resume, [ids.decode(IdKind.STOP, stop_id) for stop_id in stop_ids])
+    pending = writer.pending_origins()
+    if not pending:
+        logger.info(f"{utils.GREEN}Reisezeitmatrix {output_path} ist bereits vollständig{utils.RESET}")
+        return output_path
 
+    from tqdm import tqdm
+    departures = _departures_for(db, departure_time)
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_travel_time_matrix_worker,
+        initargs=(ptc4gtfs_graph, departures, departure_time, stop_ids),
+    ) as executor:
+        futures = [executor.submit(_travel_times_from_origin, origin) for origin in pending]
+        for n, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Reisezeitmatrix", unit="origin"), start=1):
+            origin, travel_times = future.result()
+            writer.write_row(origin, travel_times)
+            # Regelmäßig auf die Platte schreiben, damit ein Abbruch wenig Arbeit kostet
+            if n % 50 == 0:
+                writer.flush()
+    writer.flush()
+    logger.info(f"{utils.GREEN}Reisezeitmatrix gespeichert: {output_path}{utils.RESET}")
+    return output_path
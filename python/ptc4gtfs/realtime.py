@@ -0,0 +1,271 @@
+import importlib.util
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from . import utils
+from .departures import DepartureIndex
+from .ids import IdDictionary, IdKind
+
+# Echtzeit-Überlagerung (GTFS-Realtime TripUpdates) für den Abfahrtsindex.
+# Protobuf-Dateien brauchen das optionale Paket gtfs-realtime-bindings; die JSON-Darstellung
+# des FeedMessage (z.B. von einem lokalen Test-Server) geht auch ohne.
+gtfs_realtime_pb2 = None
+
+logger = logging.getLogger(__name__)
+
+# TripDescriptor.ScheduleRelationship / StopTimeUpdate.ScheduleRelationship
+TRIP_CANCELED = 3
+STOP_SKIPPED = 1
+# Standard-Abrufintervall in Sekunden
+POLL_INTERVAL = 30.0
+
+TripUpdate = namedtuple("TripUpdate", "trip_id canceled stop_updates")
+StopTimeUpdate = namedtuple("StopTimeUpdate", "stop_id delay time skipped")
+# Konsistenter Stand des Index: Suchen holen sich einmal einen Snapshot und rechnen komplett darauf
+Snapshot = namedtuple("Snapshot", "version departures feed_timestamp")
+
+def is_available():
+    return gtfs_realtime_pb2 is not None or importlib.util.find_spec("google.transit") is not None
+
+def _load_bindings():
+    global gtfs_realtime_pb2
+    if gtfs_realtime_pb2 is None:
+        try:
+            from google.transit import gtfs_realtime_pb2 as bindings
+        except ImportError:
+            raise ImportError("gtfs-realtime-bindings ist nicht installiert (pip install gtfs-realtime-bindings)")
+        gtfs_realtime_pb2 = bindings
+    return gtfs_realtime_pb2
+
+def _encoder(ids: IdDictionary, kind):
+    # IDs im Feed sind GTFS-IDs, im Index Codes der Datenbank; unbekannte IDs gehören nicht zu diesem Fahrplan
+    ids = ids if ids is not None else IdDictionary.identity()
+    return lambda value: ids.encode(kind, value) if value else None
+
+def _field(message: dict, name):
+    # JSON-Darstellung mit snake_case oder camelCase (protobuf json_format)
+    if name in message:
+        return message[name]
+    parts = name.split("_")
+    return message.get(parts[0] + "".join(part.title() for part in parts[1:]))
+
+def _parse_json(feed: dict, ids: IdDictionary = None):
+    stop_code, trip_code = _encoder(ids, IdKind.STOP), _encoder(ids, IdKind.TRIP)
+    updates = []
+    for entity in _field(feed, "entity") or []:
+        trip_update = _field(entity, "trip_update")
+        if not trip_update:
+            continue
+        trip = _field(trip_update, "trip") or {}
+        stop_updates = []
+        for stop_update in _field(trip_update, "stop_time_update") or []:
+            event = _field(stop_update, "departure") or _field(stop_update, "arrival") or {}
+            delay, event_time = _field(event, "delay"), _field(event, "time")
+            stop_updates.append(StopTimeUpdate(
+                stop_code(_field(stop_update, "stop_id")),
+                int(delay) if delay is not None else None,
+                int(event_time) if event_time is not None else None,
+                _field(stop_update, "schedule_relationship") in (STOP_SKIPPED, "SKIPPED"),
+            ))
+        updates.append(TripUpdate(
+            trip_code(_field(trip, "trip_id")),
+            _field(trip, "schedule_relationship") in (TRIP_CANCELED, "CANCELED"),
+            stop_updates,
+        ))
+    timestamp = _field(_field(feed, "header") or {}, "timestamp")
+    return int(timestamp) if timestamp is not None else None, updates
+
+def _parse_protobuf(data: bytes, ids: IdDictionary = None):
+    stop_code, trip_code = _encoder(ids, IdKind.STOP), _encoder(ids, IdKind.TRIP)
+    bindings = _load_bindings()
+    feed = bindings.FeedMessage()
+    feed.ParseFromString(data)
+    updates = []
+    for entity in feed.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        trip_update = entity.trip_update
+        stop_updates = []
+        for stop_update in trip_update.stop_time_update:
+            event = stop_update.departure if stop_update.HasField("departure") else stop_update.arrival
+            stop_updates.append(StopTimeUpdate(
+                stop_code(stop_update.stop_id),
+                event.delay if event.HasField("delay") else None,
+                event.time if event.HasField("time") else None,
+                stop_update.schedule_relationship == STOP_SKIPPED,
+            ))
+        updates.append(TripUpdate(
+            trip_code(trip_update.trip.trip_id),
+            trip_update.trip.schedule_relationship == TRIP_CANCELED,
+            stop_updates,
+        ))
+    return (feed.header.timestamp or None), updates
+
+def parse_feed(data: bytes, ids: IdDictionary = None):
+    # Gibt (Zeitstempel des Feeds, Liste TripUpdate) zurück; JSON wird am ersten Zeichen erkannt.
+    # ids: Wörterbuch der Datenbank, übersetzt stop_id/trip_id in Codes (ohne: IDs müssen numerisch sein)
+    if data.lstrip()[:1] == b"{":
+        return _parse_json(json.loads(data), ids)
+    return _parse_protobuf(data, ids)
+
+def read_feed(source, timeout=10):
+    # Lokale Datei oder HTTP-URL (z.B. lokaler Test-Server), Inhalt als Bytes
+    if source.startswith(("http://", "https://")):
+        import requests
+        response = requests.get(source, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+    with open(source, "rb") as f:
+        return f.read()
+
+class RealtimeDepartures:
+    """
+    Abfahrtsindex mit Echtzeit-Überlagerung. Jede Aktualisierung (apply) rechnet nur die Trips neu, deren
+    Zeiten sich gegenüber dem aktuellen Stand ändern, und erzeugt per DepartureIndex.patched einen neuen Index,
+    der alle unveränderten (stop_id, route_id)-Listen mit dem Vorgänger teilt. Der neue Stand wird als
+    Snapshot mit fortlaufender Version atomar ausgetauscht; laufende Suchen rechnen auf ihrem Snapshot weiter.
+    Tabelle departures_today und Graph bleiben unverändert.
+    """
+
+    def __init__(self, departures: DepartureIndex, day_start: datetime, ids: IdDictionary = None):
+        # day_start: Beginn des Betriebstages (utils.service_day_start), Bezug für absolute Zeiten im Feed
+        self.day_start_epoch = day_start.timestamp()
+        # ids: übersetzt die GTFS-IDs des Feeds in die Codes des Index
+        self.ids = ids
+        # trip_id -> [(Soll-Abfahrt, stop_id, route_id)] nach Zeit sortiert; erst bei der ersten Meldung zum Trip
+        # aus dem Fahrplan gelesen (schedule), statt alle Abfahrten des Tages pro Trip vorzuhalten
+        self._scheduled_from = departures
+        self.scheduled = {}
+        # trip_id -> aktuelle Zeiten (None = entfällt), nur Trips mit Abweichung vom Fahrplan
+        self.current = {}
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot(0, departures, None)
+        self._stop_polling = threading.Event()
+        self._poller = None
+
+    @classmethod
+    def from_db(cls, db, service_date):
+        # Abfahrtsindex des Betriebstages aus der Datenbank, noch ohne Echtzeit-Meldungen
+        return cls(DepartureIndex.for_service_date(db, service_date), utils.service_day_start(service_date, db.get_agency_timezone()), db.get_id_dictionary())
+
+    def schedule(self, trip_id):
+        # Soll-Abfahrten eines Trips (DepartureIndex.trip_schedule) oder None, wenn er an diesem Tag nicht fährt
+        scheduled = self.scheduled.get(trip_id)
+        if scheduled is None:
+            scheduled = self._scheduled_from.trip_schedule(trip_id) if trip_id is not None else None
+            if not scheduled:
+                return None
+            self.scheduled[trip_id] = scheduled
+        return scheduled
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def departures(self):
+        return self._snapshot.departures
+
+    def _trip_times(self, scheduled, update: TripUpdate):
+        # Neue Zeiten eines Trips: Verspätung gilt ab der Haltestelle der Meldung bis zur nächsten Meldung
+        if update.canceled:
+            return [None] * len(scheduled)
+        by_stop = {stop_update.stop_id: stop_update for stop_update in update.stop_updates if stop_update.stop_id is not None}
+        delay = 0
+        times = []
+        for dep_seconds, stop_id, _ in scheduled:
+            stop_update = by_stop.get(stop_id)
+            if stop_update is not None:
+                if stop_update.time is not None:
+                    delay = int(stop_update.time - self.day_start_epoch) - dep_seconds
+                elif stop_update.delay is not None:
+                    delay = stop_update.delay
+                if stop_update.skipped:
+                    times.append(None)
+                    continue
+            times.append(dep_seconds + delay)
+        return times
+
+    def apply(self, trip_updates, feed_timestamp=None, full_dataset=True):
+        """
+        Übernimmt TripUpdates in einen neuen Snapshot. full_dataset: der Feed enthält alle aktuellen Meldungen,
+        Trips ohne Meldung fallen auf den Fahrplan zurück. Gibt die Kennzahlen der Aktualisierung zurück.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            changes = []
+            seen = set()
+            unknown_trips = 0
+            for update in trip_updates:
+                scheduled = self.schedule(update.trip_id)
+                if scheduled is None:
+                    unknown_trips += 1
+                    continue
+                seen.add(update.trip_id)
+                self._update_trip(update.trip_id, scheduled, self._trip_times(scheduled, update), changes)
+            if full_dataset:
+                for trip_id in [trip_id for trip_id in self.current if trip_id not in seen]:
+                    scheduled = self.scheduled[trip_id]
+                    self._update_trip(trip_id, scheduled, [dep_seconds for dep_seconds, _, _ in scheduled], changes)
+            # Neuer Snapshot nur bei geänderten Abfahrten; der Index des alten bleibt unverändert
+            previous = self._snapshot
+            if changes:
+                self._snapshot = Snapshot(previous.version + 1, previous.departures.patched(changes), feed_timestamp)
+        result = {
+            "version": self._snapshot.version,
+            "trip_updates": len(seen),
+            "unknown_trips": unknown_trips,
+            "delayed_trips": len(self.current),
+            "changed_entries": len(changes),
+            "seconds": time.perf_counter() - started,
+        }
+        logger.debug("Echtzeit-Stand %(version)d: %(trip_updates)d Trips, %(changed_entries)d Abfahrten geändert in %(seconds).3f s", result)
+        if unknown_trips:
+            logger.debug("%d TripUpdates ohne passenden Trip im Fahrplan", unknown_trips)
+        return result
+
+    def _update_trip(self, trip_id, scheduled, times, changes):
+        old_times = self.current.get(trip_id)
+        for position, (dep_seconds, stop_id, route_id) in enumerate(scheduled):
+            old_seconds = old_times[position] if old_times is not None else dep_seconds
+            if times[position] != old_seconds:
+                changes.append((trip_id, stop_id, route_id, old_seconds, times[position]))
+        if all(new == dep_seconds for new, (dep_seconds, _, _) in zip(times, scheduled)):
+            self.current.pop(trip_id, None)
+        else:
+            self.current[trip_id] = times
+
+    def apply_feed(self, data: bytes):
+        feed_timestamp, trip_updates = parse_feed(data, self.ids)
+        return self.apply(trip_updates, feed_timestamp)
+
+    def refresh(self, source):
+        # Feed lesen und übernehmen; bei Fehlern bleibt der bisherige Snapshot gültig
+        try:
+            return self.apply_feed(read_feed(source))
+        except Exception as e:
+            logger.warning("Echtzeit-Feed %s konnte nicht übernommen werden: %s", source, e)
+            return None
+
+    def start_polling(self, source, interval=POLL_INTERVAL):
+        # Ruft source im Hintergrund alle interval Sekunden ab
+        if self._poller is not None:
+            return
+        self._stop_polling.clear()
+
+        def poll():
+            while not self._stop_polling.is_set():
+                self.refresh(source)
+                self._stop_polling.wait(interval)
+
+        self._poller = threading.Thread(target=poll, name="ptc4gtfs-realtime", daemon=True)
+        self._poller.start()
+        logger.info("Echtzeit-Feed %s wird alle %s s abgerufen", source, interval)
+
+    def stop_polling(self):
+        self._stop_polling.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
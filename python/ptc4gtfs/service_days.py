@@ -0,0 +1,130 @@
+import logging
+from datetime import date, datetime, timedelta
+
+# numpy wird nur für die Expansion beim Import (from_frames) gebraucht, nicht für Abfragen
+
+logger = logging.getLogger(__name__)
+
+# Spalten von calendar.txt in der Reihenfolge von date.weekday() (Montag = 0)
+WEEKDAY_COLUMNS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+# exception_type in calendar_dates.txt
+SERVICE_ADDED = 1
+SERVICE_REMOVED = 2
+
+def _to_date(value):
+    # GTFS-Datum (YYYYMMDD als int/str) oder date
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(int(value)), "%Y%m%d").date()
+
+def _gtfs_date(day: date):
+    return int(day.strftime("%Y%m%d"))
+
+def _native(value):
+    # numpy-Skalare (aus pandas) als Python-Werte, damit Schlüssel zu SQLite-Werten passen
+    return value.item() if hasattr(value, "item") else value
+
+class ServiceCalendar:
+    """
+    Aktive Betriebstage pro service_id als Bitset über den Gültigkeitszeitraum des Feeds:
+    Bit i steht für start_date + i Tage. Einmal beim Import aus calendar und calendar_dates
+    berechnet (GTFSDatabase.get_service_calendar); danach ist jede Abfrage "fährt service_id am Tag X?"
+    ein einzelner Bit-Test.
+    """
+
+    def __init__(self, start_date: date, num_days, bits: dict):
+        self.start_date = start_date
+        self.num_days = num_days
+        # service_id -> int als Bitset
+        self.bits = bits
+
+    @property
+    def end_date(self):
+        return self.start_date + timedelta(days=self.num_days - 1)
+
+    def day_index(self, day: date):
+        # Bit-Position des Tages, None außerhalb des Gültigkeitszeitraums
+        index = (day - self.start_date).days
+        return index if 0 <= index < self.num_days else None
+
+    def is_active(self, service_id, day: date):
+        index = self.day_index(day)
+        return index is not None and (self.bits.get(service_id, 0) >> index) & 1 == 1
+
+    def active_services(self, day: date):
+        index = self.day_index(day)
+        if index is None:
+            return set()
+        return {service_id for service_id, bits in self.bits.items() if (bits >> index) & 1}
+
+    def active_services_between(self, first_day: date, last_day: date):
+        # Tag -> aktive service_ids für ein Fenster über mehrere Betriebstage
+        return {
+            first_day + timedelta(days=offset): self.active_services(first_day + timedelta(days=offset))
+            for offset in range((last_day - first_day).days + 1)
+        }
+
+    def active_days(self, service_id):
+        bits = self.bits.get(service_id, 0)
+        return [self.start_date + timedelta(days=index) for index in range(self.num_days) if (bits >> index) & 1]
+
+    @classmethod
+    def from_frames(cls, calendar, calendar_dates=None):
+        """
+        Expandiert calendar (Wochentage + Zeitraum) und calendar_dates (Ausnahmen) zu Bitsets.
+        Beide Argumente sind DataFrames im GTFS-Format, calendar_dates darf fehlen (None).
+        """
+        import numpy as np
+        has_calendar = calendar is not None and len(calendar) > 0
+        has_dates = calendar_dates is not None and len(calendar_dates) > 0
+        bounds = []
+        if has_calendar:
+            bounds += [calendar["start_date"].min(), calendar["end_date"].max()]
+        if has_dates:
+            bounds += [calendar_dates["date"].min(), calendar_dates["date"].max()]
+        if not bounds:
+            return cls(date.today(), 0, {})
+        start_date = _to_date(min(bounds))
+        num_days = (_to_date(max(bounds)) - start_date).days + 1
+        # Wochentag jedes Tages im Zeitraum
+        weekdays = (start_date.weekday() + np.arange(num_days)) % 7
+        days = {}
+        if has_calendar:
+            for row in calendar.itertuples(index=False):
+                weekday_flags = np.array([int(getattr(row, column)) == 1 for column in WEEKDAY_COLUMNS])
+                first = (_to_date(row.start_date) - start_date).days
+                last = (_to_date(row.end_date) - start_date).days
+                active = weekday_flags[weekdays]
+                active[:first] = False
+                active[last + 1:] = False
+                days[_native(row.service_id)] = active
+        if has_dates:
+            for row in calendar_dates.itertuples(index=False):
+                service_id = _native(row.service_id)
+                active = days.setdefault(service_id, np.zeros(num_days, dtype=bool))
+                active[(_to_date(row.date) - start_date).days] = int(row.exception_type) == SERVICE_ADDED
+        bits = {
+            service_id: int.from_bytes(np.packbits(active, bitorder="little").tobytes(), "little")
+            for service_id, active in days.items()
+        }
+        logger.debug("Betriebstage expandiert: %d Services über %d Tage ab %s", len(bits), num_days, start_date)
+        return cls(start_date, num_days, bits)
+
+    def to_records(self):
+        # Zeilen für die Tabelle service_days (Bitset als BLOB, little-endian)
+        num_bytes = (self.num_days + 7) // 8
+        return [
+            {"service_id": service_id, "start_date": _gtfs_date(self.start_date), "num_days": self.num_days, "bitset": bits.to_bytes(num_bytes, "little")}
+            for service_id, bits in self.bits.items()
+        ]
+
+    @classmethod
+    def from_records(cls, records):
+        if not records:
+            return cls(date.today(), 0, {})
+        first = records[0]
+        return cls(
+            _to_date(first["start_date"]),
+            int(first["num_days"]),
+            {record["service_id"]: int.from_bytes(record["bitset"], "little") for record in records},
+        )
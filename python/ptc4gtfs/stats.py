@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Statistik der gerade laufenden Suche im aktuellen Thread/Task (für Zähler außerhalb des Routers, z.B. DB-Aufrufe)
+_current_stats = ContextVar("ptc4gtfs_query_stats", default=None)
+
+class QueryStats:
+    """
+    Messwerte einer Suche: Aufwand im Router (Knoten, Kanten, Heap, Abfahrts-Lookups), Datenbankzugriffe
+    und Zeit für Vorbereitung, Suche und Pfadrekonstruktion. Mehrere Suchen (Profil, Alternativen)
+    können in dasselbe Objekt zählen. bound_nodes_settled zählt die Knoten der statischen
+    Schranken-Suche vom Ziel (bidirektionale Suche), nur die neu abgearbeiteten, wenn die Suche zum
+    selben Ziel aus dem Cache fortgesetzt wird; nodes_settled zählt nur die zeitabhängige Suche.
+    """
+    COUNTERS = ("searches", "nodes_settled", "bound_nodes_settled", "edges_relaxed", "heap_pushes", "departure_lookups", "db_calls")
+    TIMINGS = ("setup_seconds", "search_seconds", "reconstruction_seconds")
+    __slots__ = COUNTERS + TIMINGS
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    @property
+    def total_seconds(self):
+        return self.setup_seconds + self.search_seconds + self.reconstruction_seconds
+
+    def merge(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    def to_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result["total_seconds"] = self.total_seconds
+        return result
+
+    def format_table(self):
+        # Lesbare Ausgabe für die CLI
+        lines = [f"{name:<24}{getattr(self, name):>12}" for name in self.COUNTERS]
+        lines += [f"{name:<24}{getattr(self, name) * 1000:>10.2f} ms" for name in self.TIMINGS]
+        lines.append(f"{'total_seconds':<24}{self.total_seconds * 1000:>10.2f} ms")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"QueryStats({', '.join(f'{k}={v}' for k, v in self.to_dict().items())})"
+
+@contextmanager
+def collecting(stats: QueryStats):
+    # Macht stats für count_db_call() im aktuellen Kontext sichtbar
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+@contextmanager
+def timed(stats: QueryStats, field):
+    # Addiert die Laufzeit des Blocks auf stats.<field>
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(stats, field, getattr(stats, field) + time.perf_counter() - start)
+
+def count_db_call():
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.db_calls += 1
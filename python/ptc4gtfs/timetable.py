@@ -0,0 +1,409 @@
+import logging
+import math
+from bisect import bisect_left, bisect_right
+import numpy as np
+from . import utils
+from . import db as gtfs_db
+
+logger = logging.getLogger(__name__)
+
+# Mindestanzahl Fahrten im gleichen Takt, die als ein Lauf (Start, Takt, Anzahl) gespeichert werden
+MIN_FREQUENCY_RUN = 3
+# Dichte Tabelle trip_id -> Position nur, wenn die IDs dicht genug liegen (Codes aus ids.IdDictionary);
+# sonst (z.B. große numerische IDs alter Datenbanken) sortierte IDs mit Binärsuche
+DENSE_TRIP_FACTOR = 4
+# Arrays, die für Einzelzugriffe zusätzlich als memoryview gehalten werden (Index liefert Python-int ohne numpy-Skalar)
+VIEWED_ARRAYS = (
+    "pattern_stop_ptr", "departure_offsets", "pattern_trip_ptr", "pattern_run_ptr", "trips", "slot_runs",
+    "run_patterns", "run_first", "run_start", "run_headway", "run_count", "run_last",
+    "trip_slot", "sorted_trips", "sorted_trip_slots",
+)
+
+def _gtfs_seconds(values):
+    # GTFS-Zeiten (HH:MM:SS, auch > 24:00) spaltenweise in Sekunden, fehlende Zeiten als NaN.
+    # Ein Tag hat höchstens ~10^5 verschiedene Zeiten: nur die eindeutigen Werte parsen (str.split pro Zeile ist ~50x langsamer)
+    import pandas as pd
+    codes, uniques = pd.factorize(values)
+    unique_seconds = np.array(
+        [utils.parse_gtfs_time(str(value).strip()) if str(value).strip() else np.nan for value in uniques] + [np.nan],
+        dtype=float,
+    )
+    return unique_seconds[codes]
+
+def _frequency_runs(starts):
+    # Zerlegt sortierte Startzeiten in Läufe (erste Position, Start, Takt, Anzahl); Einzelfahrten haben Takt 0
+    runs = []
+    i, n = 0, len(starts)
+    while i < n:
+        j = i + 1
+        if i + 1 < n:
+            headway = starts[i + 1] - starts[i]
+            while j < n and starts[j] - starts[j - 1] == headway:
+                j += 1
+        if j - i >= MIN_FREQUENCY_RUN:
+            runs.append((i, starts[i], headway, j - i))
+            i = j
+        else:
+            runs.append((i, starts[i], 0, 1))
+            i += 1
+    return runs
+
+class PatternTimetable:
+    """
+    Fahrplan eines Betriebstages pro Fahrtmuster: Trips einer Route mit gleicher Haltfolge und gleichen
+    Fahr- und Haltezeiten teilen sich eine Haltfolge samt Zeit-Offsets (Ankunft/Abfahrt relativ zum Start).
+    Pro Trip bleibt nur die Startzeit; Folgen von Trips im gleichen Takt werden als Lauf (Start, Takt, Anzahl)
+    gespeichert. Alles liegt in flachen numpy-Arrays (int32), Muster und Läufe sind Abschnitte darin.
+
+    Ankunft und Abfahrt eines Trips an einem Halt sind zwei Array-Zugriffe plus eine Multiplikation:
+    trip_id -> Position -> Lauf -> Startzeit, dazu der Offset des Musters an der Haltposition.
+    Die nächste/letzte Abfahrt eines Musters an einer Haltposition ist eine Binärsuche über seine Läufe
+    (next_departure, previous_departure); darauf fragt departures.DepartureIndex ab.
+    """
+
+    def __init__(self, pattern_routes, pattern_stop_ptr, stops, arrival_offsets, departure_offsets,
+                 pattern_trip_ptr, trips, slot_runs, run_patterns, run_first, run_start, run_headway, run_count):
+        # Muster p: Route, Halte stops[pattern_stop_ptr[p]:pattern_stop_ptr[p + 1]] mit Offsets in Sekunden
+        self.pattern_routes = pattern_routes
+        self.pattern_stop_ptr = pattern_stop_ptr
+        self.stops = stops
+        self.arrival_offsets = arrival_offsets
+        self.departure_offsets = departure_offsets
+        # Trips des Musters p nach Startzeit: trips[pattern_trip_ptr[p]:pattern_trip_ptr[p + 1]] (Position = Slot)
+        self.pattern_trip_ptr = pattern_trip_ptr
+        self.trips = trips
+        # Slot -> Lauf; Lauf r: Muster, erster Slot, Start des ersten Trips, Takt, Anzahl Trips
+        self.slot_runs = slot_runs
+        self.run_patterns = run_patterns
+        self.run_first = run_first
+        self.run_start = run_start
+        self.run_headway = run_headway
+        self.run_count = run_count
+        # Start des letzten Trips pro Lauf, für die Suche nach der nächsten Abfahrt
+        self.run_last = run_start + (run_count - 1) * run_headway
+        # Läufe des Musters p: run_patterns ist aufsteigend, also ein Abschnitt [pattern_run_ptr[p], pattern_run_ptr[p + 1])
+        self.pattern_run_ptr = np.searchsorted(run_patterns, np.arange(len(pattern_routes) + 1)).astype(np.int64)
+        self._build_trip_slots()
+        # Muster -> {stop_id: Haltposition}, erst bei Bedarf pro Muster aufgebaut
+        self._stop_positions = {}
+        self._build_views()
+
+    def _build_trip_slots(self):
+        # trip_id -> Slot: dichte Tabelle bei kleinen IDs, sonst sortierte IDs
+        max_trip = int(self.trips.max()) if len(self.trips) else 0
+        if max_trip <= DENSE_TRIP_FACTOR * len(self.trips) + 1024:
+            self.trip_slot = np.full(max_trip + 1, -1, dtype=np.int32)
+            self.trip_slot[self.trips] = np.arange(len(self.trips), dtype=np.int32)
+            self.sorted_trips = self.sorted_trip_slots = None
+        else:
+            order = np.argsort(self.trips, kind="stable")
+            self.trip_slot = None
+            self.sorted_trips = self.trips[order]
+            self.sorted_trip_slots = order.astype(np.int32)
+
+    def _build_views(self):
+        # memoryviews der Arrays als _<name>; ein Indexzugriff darauf ist deutlich schneller als ndarray.item
+        for name in VIEWED_ARRAYS:
+            array = getattr(self, name)
+            setattr(self, "_" + name, memoryview(np.ascontiguousarray(array)) if array is not None else None)
+
+    def __getstate__(self):
+        # memoryviews lassen sich nicht pickeln (z.B. Übergabe an Worker-Prozesse), sie werden neu angelegt
+        return {name: value for name, value in vars(self).items() if not isinstance(value, memoryview)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_views()
+
+    @classmethod
+    def from_frames(cls, trips, stop_times, min_last_departure=None):
+        """
+        Baut den Fahrplan aus trips (trip_id, route_id) und stop_times (trip_id, stop_id, stop_sequence,
+        arrival_time, departure_time) der an einem Tag fahrenden Trips. Fehlt eine der beiden Zeiten, gilt
+        die andere; Halte ganz ohne Zeit werden ausgelassen. Mit min_last_departure (GTFS-Sekunden) bleiben
+        nur Trips, die ab dieser Zeit noch abfahren, z.B. die Fahrten über Mitternacht für den Folgetag.
+        """
+        started_rows = len(stop_times)
+        arrivals = _gtfs_seconds(stop_times[gtfs_db.TB_StopTimesAttr.ARRIVAL_TIME.value])
+        departures = _gtfs_seconds(stop_times[gtfs_db.TB_StopTimesAttr.DEPARTURE_TIME.value])
+        arrivals = np.where(np.isnan(arrivals), departures, arrivals)
+        departures = np.where(np.isnan(departures), arrivals, departures)
+        timed = ~np.isnan(arrivals)
+        trip_ids = stop_times[gtfs_db.TB_StopTimesAttr.TRIP_ID.value].to_numpy(dtype=np.int64)[timed]
+        stop_ids = stop_times[gtfs_db.TB_StopTimesAttr.STOP_ID.value].to_numpy(dtype=np.int64)[timed]
+        sequences = stop_times[gtfs_db.TB_StopTimesAttr.STOP_SEQUENCE.value].to_numpy(dtype=np.int64)[timed]
+        arrivals = arrivals[timed].astype(np.int32)
+        departures = departures[timed].astype(np.int32)
+        if started_rows != len(trip_ids):
+            logger.debug("%d Halte ohne Ankunfts- und Abfahrtszeit ausgelassen", started_rows - len(trip_ids))
+        if min_last_departure is not None:
+            # Ganze Trips behalten, damit Muster und Haltfolge vollständig bleiben
+            keep = np.isin(trip_ids, np.unique(trip_ids[departures >= min_last_departure]))
+            trip_ids, stop_ids, sequences, arrivals, departures = (
+                column[keep] for column in (trip_ids, stop_ids, sequences, arrivals, departures)
+            )
+
+        # Nur Trips mit Route; nach Trip und Haltfolge sortiert
+        trip_routes = dict(zip(
+            trips[gtfs_db.TB_TripsAttr.TRIP_ID.value].to_numpy(dtype=np.int64).tolist(),
+            trips[gtfs_db.TB_TripsAttr.ROUTE_ID.value].to_numpy(dtype=np.int64).tolist(),
+        ))
+        order = np.lexsort((sequences, trip_ids))
+        return cls._from_events(trip_ids[order], stop_ids[order], arrivals[order], departures[order], trip_routes)
+
+    @classmethod
+    def from_departures(cls, stop_ids, route_ids, trip_ids, dep_seconds):
+        """
+        Baut den Fahrplan aus Abfahrten im Format von departures_today (gleich lange int-Arrays, eine Abfahrt pro
+        Position), z.B. für ältere Datenbanken ohne stop_times-Auswertung. Die Haltfolge eines Trips ergibt sich aus
+        der Reihenfolge der Abfahrten, Ankunft = Abfahrt.
+        """
+        stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        trip_ids = np.asarray(trip_ids, dtype=np.int64)
+        dep_seconds = np.asarray(dep_seconds, dtype=np.int64)
+        trip_routes = dict(zip(trip_ids.tolist(), np.asarray(route_ids, dtype=np.int64).tolist()))
+        order = np.lexsort((stop_ids, dep_seconds, trip_ids))
+        departures = dep_seconds[order].astype(np.int32)
+        return cls._from_events(trip_ids[order], stop_ids[order], departures, departures, trip_routes)
+
+    @classmethod
+    def _from_events(cls, trip_ids, stop_ids, arrivals, departures, trip_routes):
+        # Halte nach (Trip, Haltfolge) sortiert, trip_routes: trip_id -> route_id (Trips ohne Route fallen weg)
+        boundaries = np.flatnonzero(np.diff(trip_ids) != 0) + 1
+        starts = np.concatenate(([0], boundaries)).tolist()
+        ends = np.concatenate((boundaries, [len(trip_ids)])).tolist() if len(trip_ids) else []
+        stop_ids = stop_ids.astype(np.int32)
+
+        # Muster über (Route, Haltfolge, Offsets) zusammenfassen; Startzeit = Abfahrt am ersten Halt
+        pattern_index = {}
+        pattern_keys = []
+        pattern_trip_lists = []
+        for start, end in zip(starts, ends):
+            trip_id = int(trip_ids[start])
+            route_id = trip_routes.get(trip_id)
+            if route_id is None:
+                continue
+            trip_start = int(departures[start])
+            key = (
+                route_id,
+                stop_ids[start:end].tobytes(),
+                (arrivals[start:end] - trip_start).tobytes(),
+                (departures[start:end] - trip_start).tobytes(),
+            )
+            pattern = pattern_index.get(key)
+            if pattern is None:
+                pattern = pattern_index[key] = len(pattern_keys)
+                pattern_keys.append(key)
+                pattern_trip_lists.append([])
+            pattern_trip_lists[pattern].append((trip_start, trip_id))
+
+        # Flache Arrays: Haltfolgen und Offsets, Trips pro Muster nach Start, Läufe gleichen Takts
+        pattern_routes = np.array([key[0] for key in pattern_keys], dtype=np.int32)
+        stop_chunks = [np.frombuffer(key[1], dtype=np.int32) for key in pattern_keys]
+        pattern_stop_ptr = np.zeros(len(pattern_keys) + 1, dtype=np.int64)
+        pattern_stop_ptr[1:] = np.cumsum([len(chunk) for chunk in stop_chunks])
+        empty = np.zeros(0, dtype=np.int32)
+        pattern_stops = np.concatenate(stop_chunks) if stop_chunks else empty
+        arrival_offsets = np.concatenate([np.frombuffer(key[2], dtype=np.int32) for key in pattern_keys]) if pattern_keys else empty
+        departure_offsets = np.concatenate([np.frombuffer(key[3], dtype=np.int32) for key in pattern_keys]) if pattern_keys else empty
+
+        slot_trips, runs = [], []
+        pattern_trip_ptr = np.zeros(len(pattern_keys) + 1, dtype=np.int64)
+        for pattern, trip_list in enumerate(pattern_trip_lists):
+            trip_list.sort()
+            first_slot = len(slot_trips)
+            slot_trips.extend(trip_id for _, trip_id in trip_list)
+            for first, run_start, headway, count in _frequency_runs([trip_start for trip_start, _ in trip_list]):
+                runs.append((pattern, first_slot + first, run_start, headway, count))
+            pattern_trip_ptr[pattern + 1] = len(slot_trips)
+        runs = np.array(runs, dtype=np.int32).reshape(-1, 5)
+        run_count = runs[:, 4]
+        slot_runs = np.repeat(np.arange(len(runs), dtype=np.int32), run_count)
+
+        timetable = cls(
+            pattern_routes, pattern_stop_ptr, pattern_stops, arrival_offsets, departure_offsets,
+            pattern_trip_ptr, np.array(slot_trips, dtype=np.int32), slot_runs,
+            runs[:, 0].copy(), runs[:, 1].copy(), runs[:, 2].copy(), runs[:, 3].copy(), run_count.copy(),
+        )
+        logger.debug("PatternTimetable aufgebaut: %(trips)d Trips, %(patterns)d Muster, %(runs)d Läufe, %(bytes)d Bytes", timetable.stats())
+        return timetable
+
+    @classmethod
+    def from_db(cls, db: gtfs_db.GTFSDatabase, service_date, min_last_departure=None):
+        # Fahrplan aller an service_date fahrenden Trips (min_last_departure siehe from_frames)
+        trips, stop_times = db.get_service_day_frames(service_date)
+        return cls.from_frames(trips, stop_times, min_last_departure)
+
+    def stats(self):
+        # Anzahl Trips, Muster, Läufe, Halteereignisse und Speicherbedarf der Arrays
+        arrays = [value for value in vars(self).values() if isinstance(value, np.ndarray)]
+        return {
+            "trips": len(self.trips),
+            "patterns": len(self.pattern_routes),
+            "runs": len(self.run_start),
+            "pattern_stops": len(self.stops),
+            "stop_events": int(np.dot(np.diff(self.pattern_stop_ptr), np.diff(self.pattern_trip_ptr))),
+            "bytes": sum(array.nbytes for array in arrays),
+        }
+
+    # Slot (Position in self.trips) eines Trips oder -1, wenn er an diesem Tag nicht fährt.
+    def slot(self, trip_id):
+        trip_id = int(trip_id)
+        if self._trip_slot is not None:
+            return self._trip_slot[trip_id] if 0 <= trip_id < len(self._trip_slot) else -1
+        i = bisect_left(self._sorted_trips, trip_id)
+        return self._sorted_trip_slots[i] if i < len(self._sorted_trips) and self._sorted_trips[i] == trip_id else -1
+
+    def _slot_start(self, slot):
+        run = self._slot_runs[slot]
+        return self._run_start[run] + (slot - self._run_first[run]) * self._run_headway[run]
+
+    # Muster eines Slots.
+    def _slot_pattern(self, slot):
+        return self._run_patterns[self._slot_runs[slot]]
+
+    # Muster eines Trips oder None.
+    def trip_pattern(self, trip_id):
+        slot = self.slot(trip_id)
+        return self._slot_pattern(slot) if slot >= 0 else None
+
+    # Startzeit (Abfahrt am ersten Halt, GTFS-Sekunden) eines Trips oder None.
+    def trip_start(self, trip_id):
+        slot = self.slot(trip_id)
+        return self._slot_start(slot) if slot >= 0 else None
+
+    # Route, Haltfolge (stop_ids) eines Musters.
+    def pattern_route(self, pattern):
+        return self.pattern_routes.item(pattern)
+
+    def pattern_stops(self, pattern):
+        return self.stops[self._pattern_stop_ptr[pattern]:self._pattern_stop_ptr[pattern + 1]].tolist()
+
+    # Prüft, ob ein Trip an diesem Tag an einer Haltestelle hält.
+    def serves_stop(self, trip_id, stop_id):
+        slot = self.slot(trip_id)
+        return slot >= 0 and self.stop_position(self._slot_pattern(slot), stop_id) is not None
+
+    # Haltposition einer Haltestelle im Muster (erstes Vorkommen) oder None.
+    def stop_position(self, pattern, stop_id):
+        positions = self._stop_positions.get(pattern)
+        if positions is None:
+            positions = {}
+            for position, stop in enumerate(self.pattern_stops(pattern)):
+                positions.setdefault(stop, position)
+            self._stop_positions[pattern] = positions
+        return positions.get(int(stop_id))
+
+    def _event(self, trip_id, stop_id, offsets, position=None):
+        slot = self.slot(trip_id)
+        if slot < 0:
+            return None
+        pattern = self._slot_pattern(slot)
+        if position is None:
+            position = self.stop_position(pattern, stop_id)
+            if position is None:
+                return None
+        return self._slot_start(slot) + offsets.item(self._pattern_stop_ptr[pattern] + position)
+
+    # Ankunft (GTFS-Sekunden) eines Trips an einer Haltestelle oder None; position statt stop_id bei Ringlinien.
+    def arrival(self, trip_id, stop_id=None, position=None):
+        return self._event(trip_id, stop_id, self.arrival_offsets, position)
+
+    # Abfahrt (GTFS-Sekunden) eines Trips an einer Haltestelle oder None.
+    def departure(self, trip_id, stop_id=None, position=None):
+        return self._event(trip_id, stop_id, self.departure_offsets, position)
+
+    # Alle Halte eines Trips als Liste (stop_id, Ankunft, Abfahrt), leer wenn er nicht fährt.
+    def stop_times(self, trip_id):
+        slot = self.slot(trip_id)
+        if slot < 0:
+            return []
+        pattern = self._slot_pattern(slot)
+        start, end = self._pattern_stop_ptr[pattern], self._pattern_stop_ptr[pattern + 1]
+        trip_start = self._slot_start(slot)
+        return list(zip(
+            self.stops[start:end].tolist(),
+            (self.arrival_offsets[start:end] + trip_start).tolist(),
+            (self.departure_offsets[start:end] + trip_start).tolist(),
+        ))
+
+    def _first_slot(self, pattern, position, after_seconds):
+        # Erster Slot des Musters mit Abfahrt an position ab after_seconds (inklusive) und der Offset der Position;
+        # pattern_trip_ptr[pattern + 1], wenn keine Abfahrt mehr folgt. Binärsuche über die Läufe, im Lauf per Division.
+        offset = self._departure_offsets[self._pattern_stop_ptr[pattern] + position]
+        earliest_start = math.ceil(after_seconds) - offset
+        end_run = self._pattern_run_ptr[pattern + 1]
+        run = bisect_left(self._run_last, earliest_start, self._pattern_run_ptr[pattern], end_run)
+        if run == end_run:
+            return self._pattern_trip_ptr[pattern + 1], offset
+        run_start = self._run_start[run]
+        headway = self._run_headway[run]
+        k = -(-(earliest_start - run_start) // headway) if headway and earliest_start > run_start else 0
+        return self._run_first[run] + k, offset
+
+    def _last_slot(self, pattern, position, before_seconds):
+        # Letzter Slot des Musters mit Abfahrt an position bis before_seconds (inklusive) und der Offset der Position;
+        # pattern_trip_ptr[pattern] - 1, wenn keine Abfahrt vorher liegt
+        offset = self._departure_offsets[self._pattern_stop_ptr[pattern] + position]
+        latest_start = math.floor(before_seconds) - offset
+        first_run = self._pattern_run_ptr[pattern]
+        run = bisect_right(self._run_start, latest_start, first_run, self._pattern_run_ptr[pattern + 1]) - 1
+        if run < first_run:
+            return self._pattern_trip_ptr[pattern] - 1, offset
+        headway = self._run_headway[run]
+        k = self._run_count[run] - 1
+        if headway:
+            k = min(k, (latest_start - self._run_start[run]) // headway)
+        return self._run_first[run] + k, offset
+
+    def next_departure(self, pattern, position, after_seconds):
+        """
+        Nächste Abfahrt (dep_seconds, trip_id) eines Musters an Haltposition position ab after_seconds
+        (inklusive) oder None. Binärsuche über die Läufe des Musters, im Lauf per Division.
+        """
+        slot, offset = self._first_slot(pattern, position, after_seconds)
+        if slot == self._pattern_trip_ptr[pattern + 1]:
+            return None
+        return self._slot_start(slot) + offset, self._trips[slot]
+
+    # Letzte Abfahrt (dep_seconds, trip_id) eines Musters an Haltposition position bis before_seconds (inklusive) oder None.
+    def previous_departure(self, pattern, position, before_seconds):
+        slot, offset = self._last_slot(pattern, position, before_seconds)
+        if slot < self._pattern_trip_ptr[pattern]:
+            return None
+        return self._slot_start(slot) + offset, self._trips[slot]
+
+    # Alle Abfahrten (dep_seconds, trip_id) eines Musters an Haltposition position ab after_seconds, aufsteigend.
+    def iter_departures(self, pattern, position, after_seconds):
+        slot, offset = self._first_slot(pattern, position, after_seconds)
+        for slot in range(slot, self._pattern_trip_ptr[pattern + 1]):
+            yield self._slot_start(slot) + offset, self._trips[slot]
+
+    # Alle Abfahrten (dep_seconds, trip_id) eines Musters an Haltposition position bis before_seconds, absteigend.
+    def iter_departures_before(self, pattern, position, before_seconds):
+        slot, offset = self._last_slot(pattern, position, before_seconds)
+        for slot in range(slot, self._pattern_trip_ptr[pattern] - 1, -1):
+            yield self._slot_start(slot) + offset, self._trips[slot]
+
+    def departure_arrays(self):
+        """
+        Alle Abfahrten des Tages als Spalten (stop_ids, route_ids, trip_ids, dep_seconds), wie die Tabelle
+        departures_today, aber ohne Zeilen pro Halt zu speichern: pro Muster Startzeiten x Offsets.
+        """
+        stop_lengths = np.diff(self.pattern_stop_ptr)
+        trip_lengths = np.diff(self.pattern_trip_ptr)
+        slots = np.arange(len(self.trips))
+        slot_starts = self.run_start[self.slot_runs] + (slots - self.run_first[self.slot_runs]) * self.run_headway[self.slot_runs]
+        slot_patterns = self.run_patterns[self.slot_runs]
+        # Pro Slot alle Halte seines Musters: Slot wiederholen, Haltpositionen je Slot durchzählen
+        per_slot = stop_lengths[slot_patterns]
+        event_slots = np.repeat(slots, per_slot)
+        first_event = np.repeat(np.cumsum(per_slot) - per_slot, per_slot)
+        positions = np.arange(len(event_slots)) - first_event + self.pattern_stop_ptr[slot_patterns][event_slots]
+        logger.debug("departure_arrays: %d Abfahrten aus %d Mustern", len(event_slots), int(np.count_nonzero(trip_lengths)))
+        return (
+            self.stops[positions],
+            self.pattern_routes[slot_patterns][event_slots],
+            self.trips[event_slots],
+            slot_starts[event_slots] + self.departure_offsets[positions],
+        )
@@ -1,9 +1,11 @@
-from datetime import datetime, timedelta
-import pandas as pd
+from datetime import datetime, timedelta, time, timezone
 import logging
+import logging.handlers
+import atexit
+import queue
+import threading
+import time as _time
 from collections import defaultdict
-import requests
-from tqdm import tqdm
 import os
 
 logger = logging.getLogger(__name__)
@@ -67,6 +69,11 @@ def parse_gtfs_time(time_str: str) -> int:
     h, m, s = map(int, time_str.split(":"))
     return h * 3600 + m * 60 + s
 
+def format_gtfs_time(seconds: int) -> str:
+    # Sekunden ab Betriebstag-Beginn als GTFS-Zeit HH:MM:SS (auch > 24:00)
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+
 def diff_seconds(time_str1: str, time_str2: str) -> int:
     # Zeitdifferenz in Sekunden berechnen
     sec1 = parse_gtfs_time(time_str1)
@@ -98,7 +105,7 @@ def split_node_id(node_id, sep="@@"):
 
 def get_next_departure_today_dict(dep_dict, stop_id, route_id, current_time):
     # Sucht nächste Abfahrt nach current_time
-    departures = dep_dict.get((str(stop_id), str(route_id)), [])
+    departures = dep_dict.get((int(stop_id), int(route_id)), [])
     departures_after = [
         dep for dep in departures
         if dep['departure_time'] > current_time
@@ -114,15 +121,58 @@ def parse_gtfs_time_ref_date(timestr, ref_date):
     days, h = divmod(h, 24)
     return datetime.combine(ref_date, datetime.min.time()) + timedelta(days=days, hours=h, minutes=m, seconds=s)
 
+def parse_departure_time(value: str, ref_date=None, tz=None) -> datetime:
+    # Abfahrtszeit als "HH:MM", "HH:MM:SS" (bezogen auf ref_date bzw. heute) oder ISO-Zeitstempel.
+    # Mit tz wird eine Zeit ohne Zeitzone als Ortszeit in tz interpretiert.
+    value = value.strip()
+    if "T" in value or "-" in value:
+        return resolve_departure_time(datetime.fromisoformat(value), tz) if tz else datetime.fromisoformat(value)
+    parts = value.split(":")
+    if len(parts) == 2:
+        value += ":00"
+    if ref_date is None:
+        ref_date = datetime.now(tz).date()
+    dt = parse_gtfs_time_ref_date(value, ref_date)
+    return dt.replace(tzinfo=tz) if tz else dt
+
+def resolve_departure_time(departure_time: datetime, tz) -> datetime:
+    # Normalisiert eine Abfahrtszeit auf die Zeitzone tz (None = jetzt, ohne Zeitzone = Ortszeit in tz)
+    if departure_time is None:
+        return datetime.now(tz)
+    if departure_time.tzinfo is None:
+        return departure_time.replace(tzinfo=tz)
+    return departure_time.astimezone(tz)
+
+def service_day_start(service_date, tz=None) -> datetime:
+    # Bezugszeitpunkt der GTFS-Zeiten eines Betriebstages: "Mittag minus 12h" in der Agentur-Zeitzone,
+    # als UTC-Zeitpunkt, damit Sekunden-Offsets auch an Tagen mit Zeitumstellung stimmen
+    if tz is None:
+        return datetime.combine(service_date, datetime.min.time())
+    noon = datetime.combine(service_date, time(12), tzinfo=tz)
+    return noon.astimezone(timezone.utc) - timedelta(hours=12)
+
+def search_time_reference(departure_time: datetime, day_start: datetime = None):
+    # Gibt (Abfahrt, Betriebstag-Beginn) für die Suche zurück; zeitzonenbehaftete Zeiten werden intern in UTC gerechnet.
+    # day_start: bereits bestimmter Betriebstag-Beginn (Profilsuche), sonst der Tag der Abfahrt in ihrer Zeitzone
+    tz = departure_time.tzinfo
+    if day_start is None:
+        day_start = service_day_start(departure_time.date(), tz)
+    if tz is not None:
+        departure_time = departure_time.astimezone(timezone.utc)
+    return departure_time, day_start
+
 def build_departures_dict(deparutes_list):
-    # Baut Dictionary: (stop_id, route_id) -> Liste von departures
+    # Baut Dictionary: (stop_id, route_id) -> Liste von departures, Schlüssel sind die int-Codes der Datenbank
     dep_dict = defaultdict(list)
     for d in deparutes_list:
-        dep_dict[(str(d['stop_id']), str(d['route_id']))].append(d)
+        dep_dict[(int(d['stop_id']), int(d['route_id']))].append(d)
     return dep_dict
 
 def download_with_progress(download_url: str, output_path: str, chunk_size: int = 1024*64):
     # Lädt Datei mit Fortschrittsbalken herunter
+    # requests/tqdm erst hier laden, damit utils (und die CLI) schnell importiert
+    import requests
+    from tqdm import tqdm
     logger.info(f"{YELLOW} Starte Download von {download_url} {RESET}")
     resp = requests.get(download_url, stream=True)
     resp.raise_for_status()
@@ -154,21 +204,71 @@ def pd_export_csv(data_frame, file_name, target_dir):
 
 def pd_csv_filter(download_dir, file_name, filter_field_name, match_field_values):
     # Filtert CSV nach bestimmten Feldwerten und gibt DataFrame zurück
+    import pandas as pd
     csv_path = os.path.join(download_dir, file_name)
     csv_df = pd.read_csv(csv_path)
     filtered_csv_df = csv_df[csv_df[filter_field_name].isin(match_field_values)]
     logger.debug(f"{MAGENTA}'{file_name}' matches for Munich Agencies:{RESET}\n{filtered_csv_df}")
     return filtered_csv_df
 
-def logger_config(log_file_name, logging_level=logging.DEBUG):
-    # Setzt Logging-Konfiguration für Datei und Konsole
+# Listener des asynchronen Loggings (QueueHandler -> Thread -> Datei/Konsole), None = synchron
+_log_listener = None
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler.prepare setzt msg % args schon im aufrufenden Thread zusammen. Hier geht der Eintrag
+    # unverändert in die Queue, msg % args und Zeilenformat erledigen die Handler im Listener-Thread.
+    # Die Queue bleibt im Prozess (kein Pickling); als args übergebene Objekte sollten danach nicht mehr
+    # verändert werden, sonst erscheint der spätere Stand im Log.
+    def prepare(self, record):
+        return record
+
+def logger_config(log_file_name, logging_level=logging.DEBUG, async_handlers=True):
+    # Setzt Logging-Konfiguration für Datei und Konsole.
+    # Mit async_handlers schreibt der aufrufende Thread nur den Eintrag in eine Queue; Formatierung
+    # (auch msg % args, siehe _DeferredQueueHandler) und Datei-/Konsolen-I/O übernimmt ein Hintergrund-Thread (QueueListener).
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
-    logging.basicConfig(
-        level=logging_level,
-        format='%(asctime)s :: [%(levelname)-8s] :: %(filename)-13s :: [Line: %(lineno)-4s] :: %(message)s',
-        handlers=[
-            logging.FileHandler(f"{log_file_name}.log"),
-            logging.StreamHandler()
-        ]
-    )
\ No newline at end of file
+    formatter = logging.Formatter('%(asctime)s :: [%(levelname)-8s] :: %(filename)-13s :: [Line: %(lineno)-4s] :: %(message)s')
+    handlers = [
+        logging.FileHandler(f"{log_file_name}.log"),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    if async_handlers:
+        log_queue = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _log_listener.start()
+        handlers = [_DeferredQueueHandler(log_queue)]
+    logging.basicConfig(level=logging_level, handlers=handlers)
+
+@atexit.register
+def _stop_log_listener():
+    # Restliche Einträge der Queue beim Beenden noch schreiben
+    if _log_listener is not None:
+        _log_listener.stop()
+
+# Schlüssel -> (Zeitpunkt der letzten Ausgabe, seitdem unterdrückte Meldungen)
+_rate_limited_state = {}
+_rate_limited_lock = threading.Lock()
+
+def log_rate_limited(log: logging.Logger, key, level, msg, *args, interval=60.0):
+    # Gibt eine Meldung pro Schlüssel höchstens einmal je interval Sekunden aus; die Anzahl der
+    # dazwischen unterdrückten Meldungen wird an die nächste Ausgabe angehängt. Formatierung lazy (%-Stil).
+    if not log.isEnabledFor(level):
+        return
+    now = _time.monotonic()
+    with _rate_limited_lock:
+        last, suppressed = _rate_limited_state.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _rate_limited_state[key] = (last, suppressed + 1)
+            return
+        _rate_limited_state[key] = (now, 0)
+    if suppressed:
+        msg += " (%d gleichartige Meldungen unterdrückt)"
+        args += (suppressed,)
+    log.log(level, msg, *args, stacklevel=2)